@@ -1,22 +1,43 @@
-from typing import List, Dict, Any
+from datetime import datetime
+from io import BytesIO
+from itertools import chain
+from typing import List, Dict, Any, Optional
 from pathlib import Path
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Request, Response, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from matplotlib.lines import Line2D
+from starlette.concurrency import run_in_threadpool
 from app.config import settings
-from app.database import get_clickhouse_client
+from app.database import execute_async, get_pool
 from app.models.schemas import AreaRequest, CoverageResponse
-from app.services.coverage_service import get_coverage_data
-from app.services.mapping_service import create_coverage_map
-import pandas as pd
+from app.services.aggregation_service import (
+    METRICS, TIME_INTERVALS, get_hex_aggregates, get_time_series, iter_hex_aggregates
+)
+from app.services.cache_service import (
+    cache_key, get_data_version, get_or_render, make_etag, not_modified, set_cache_headers, write_atomic
+)
+from app.services.coverage_clusters import find_clusters, plot_coverage_clusters
+from app.services.coverage_service import choose_resolution, get_coverage_data
+from app.services.export_service import (
+    EXPORT_MEDIA_TYPES, arrow_available, arrow_chunks, coverage_frame, encode_cursor, ndjson_chunks,
+    negotiate_format, pack_hexes, parse_cursor
+)
+from app.services.imbalance_service import compute_imbalance, imbalance_geojson, imbalance_records
+from app.services.ingest_job import get_ingest_job
+from app.services.mapping_service import (
+    render_antenna_map, render_hexmap, render_imbalance, render_raster, render_tile
+)
+from app.services.metrics_service import render_metrics
+from app.services.profile_service import get_data_profile
+from app.services.raster_service import MAX_RASTER_SIDE, data_extent, raster_height, rasterize_points
+from app.services.render_service import get_render_executor
+from app.services.surface_service import SURFACE_METRICS, is_stale, load_surface
+from app.services.tile_service import (
+    empty_tile, read_tile, resolution_for_zoom, tile_bbox, tile_mercator_bounds, tile_path
+)
 import logging
-import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon
-import h3
-import numpy as np
-from io import BytesIO
 import base64
+import numpy as np
 
 
 router = APIRouter()
@@ -27,24 +48,316 @@ logger = logging.getLogger(__name__)
 BASE_DIR = Path(__file__).resolve().parent.parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
+IMAGE_MEDIA_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+IMAGE_FORMAT_QUERY = Query(
+    'png', description="Формат ответа: png, webp или base64 (прежний JSON с base64)"
+)
+
+
+TIME_FROM_QUERY = Query(None, alias='from', description="Начало интервала по eventtime (включительно), ISO 8601")
+TIME_TO_QUERY = Query(None, alias='to', description="Конец интервала по eventtime (не включительно), ISO 8601")
+
+
+def time_range_or_none(time_from, time_to):
+    """Интервал (from, to) для запросов или None, если границы не заданы"""
+    if time_from is None and time_to is None:
+        return None
+    if time_from is not None and time_to is not None and time_from >= time_to:
+        raise HTTPException(status_code=400, detail="Начало интервала должно быть раньше конца")
+    return time_from, time_to
+
+
+def check_image_format(image_format):
+    if image_format != 'base64' and image_format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Доступные форматы: base64, {', '.join(IMAGE_MEDIA_TYPES)}")
+
+
+def image_response(image, image_format, etag):
+    """Бинарный ответ с изображением (Content-Length выставляется автоматически)"""
+    response = Response(content=image, media_type=IMAGE_MEDIA_TYPES[image_format])
+    set_cache_headers(response, etag)
+    return response
+
 @router.get("/", response_class=HTMLResponse)
 async def show_map(request: Request):
     """Главная страница с картой"""
     return templates.TemplateResponse("map.html", {"request": request})
 
 
-@router.post("/coverage", response_model=CoverageResponse)
-async def get_coverage(area: AreaRequest):
-    """Получение данных покрытия для заданной области"""
-    data = get_coverage_data(
-        area.min_lat, area.max_lat,
-        area.min_lon, area.max_lon
-    )
+async def coverage_image(request, bbox, image_format, resolution=None, pixel_size=None, time_range=None):
+    """Карта покрытия области по ячейкам H3: изображение или прежний JSON с base64.
+
+    Разрешение подбирается по размеру области, чтобы объём данных и время
+    отрисовки не зависели от масштаба.
+    """
+    check_image_format(image_format)
+    if resolution is None:
+        resolution = choose_resolution(*bbox, pixel_size=pixel_size)
+    elif resolution not in settings.H3_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Доступные разрешения: {list(settings.H3_RESOLUTIONS)}")
+
+    encoding = 'png' if image_format == 'base64' else image_format
+    key = cache_key('coverage', *bbox, resolution, time_range, encoding)
+    etag = make_etag(key + (image_format,))
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    async def render():
+        cells = await run_in_threadpool(get_coverage_data, *bbox, resolution, time_range)
+        return await get_render_executor().submit(render_hexmap, cells, resolution, None, encoding)
+
+    image = await get_or_render(key, render)
+
+    if image_format == 'base64':
+        response = JSONResponse({
+            "map_image": base64.b64encode(image).decode('utf-8'),
+            "resolution": resolution
+        })
+        set_cache_headers(response, etag)
+    else:
+        response = image_response(image, image_format, etag)
+    response.headers['X-H3-Resolution'] = str(resolution)
+    return response
+
 
-    df = pd.DataFrame(data, columns=['latitude', 'longitude', 'band'])
-    map_img = create_coverage_map(df)
+@router.post("/coverage", response_model=CoverageResponse)
+async def get_coverage(area: AreaRequest, request: Request, format: str = IMAGE_FORMAT_QUERY):
+    """Получение карты покрытия для заданной области"""
+    bbox = (area.min_lat, area.max_lat, area.min_lon, area.max_lon)
+    time_range = time_range_or_none(area.time_from, area.time_to)
+    return await coverage_image(request, bbox, format, area.resolution, area.pixel_size, time_range)
+
+
+@router.get("/coverage")
+async def get_coverage_image(
+        request: Request,
+        min_lat: float, max_lat: float, min_lon: float, max_lon: float,
+        resolution: Optional[int] = Query(None, description="Разрешение H3 (по умолчанию - по размеру области)"),
+        pixel_size: Optional[float] = Query(None, description="Размер пикселя карты клиента, м"),
+        time_from: Optional[datetime] = TIME_FROM_QUERY,
+        time_to: Optional[datetime] = TIME_TO_QUERY,
+        format: str = IMAGE_FORMAT_QUERY
+):
+    """Карта покрытия области по URL (для использования в <img src>)"""
+    bbox = (min_lat, max_lat, min_lon, max_lon)
+    time_range = time_range_or_none(time_from, time_to)
+    return await coverage_image(request, bbox, format, resolution, pixel_size, time_range)
+
+
+@router.get("/coverage-raster")
+async def get_coverage_raster(
+        request: Request,
+        min_lat: Optional[float] = None, max_lat: Optional[float] = None,
+        min_lon: Optional[float] = None, max_lon: Optional[float] = None,
+        width: int = Query(1024, ge=16, le=MAX_RASTER_SIDE, description="Ширина растра, пикселей"),
+        height: Optional[int] = Query(None, ge=16, le=MAX_RASTER_SIDE, description="Высота (по умолчанию - по пропорциям области)"),
+        metric: str = Query('rsrp', description="rsrp, count или band (преобладающий диапазон)"),
+        format: str = Query('png', description="Формат изображения: png или webp")
+):
+    """Растровая карта по всем измерениям области (без ограничения числа точек)"""
+    if metric not in ('rsrp', 'count', 'band'):
+        raise HTTPException(status_code=400, detail="Доступные метрики: rsrp, count, band")
+    if format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Доступные форматы: {', '.join(IMAGE_MEDIA_TYPES)}")
+
+    bbox = (min_lat, max_lat, min_lon, max_lon)
+    if None in bbox:
+        bbox = await run_in_threadpool(data_extent)
+        if None in bbox:
+            raise HTTPException(status_code=404, detail="Нет данных")
+    height = height or raster_height(bbox, width)
+
+    key = cache_key('coverage-raster', *bbox, width, height, metric, format)
+    etag = make_etag(key)
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    async def render():
+        raster = await run_in_threadpool(rasterize_points, bbox, width, height)
+        return await get_render_executor().submit(render_raster, raster, metric, format)
+
+    return image_response(await get_or_render(key, render), format, etag)
+
+
+SURFACE_NOT_BUILT = "Поверхность покрытия не построена (python -m app.build_surface)"
+
+
+def surface_or_404():
+    surface = load_surface()
+    if surface is None:
+        raise HTTPException(status_code=404, detail=SURFACE_NOT_BUILT)
+    return surface
+
+
+def surface_info(surface):
+    """Общие поля ответов поверхности: версия данных, по которой она построена"""
+    return {
+        "data_version": surface.metadata['data_version'],
+        "stale": is_stale(surface.metadata),
+    }
+
+
+@router.get("/surface")
+async def get_surface():
+    """Описание текущей сборки интерполированной поверхности RSRP/RSRQ"""
+    surface = surface_or_404()
+    return {**surface.metadata, **surface_info(surface)}
+
+
+@router.get("/surface/point")
+async def get_surface_point(
+        lat: float, lon: float,
+        band: Optional[str] = Query(None, description="Диапазон (по умолчанию - все)")
+):
+    """Оценка RSRP/RSRQ в точке по предварительно построенной поверхности"""
+    surface = surface_or_404()
+    if band is not None and band not in surface.grids:
+        raise HTTPException(status_code=400, detail=f"Доступные диапазоны: {', '.join(surface.grids)}")
+    return {
+        "lat": lat, "lon": lon,
+        "values": surface.sample(lat, lon, (band,) if band else None),
+        **surface_info(surface)
+    }
+
+
+@router.get("/surface/crop")
+async def get_surface_crop(
+        min_lat: float, max_lat: float, min_lon: float, max_lon: float,
+        band: str = Query(..., description="Диапазон"),
+        metric: str = Query('rsrp', description="rsrp или rsrq"),
+        step: int = Query(1, ge=1, description="Шаг прореживания узлов сетки"),
+        format: str = Query('json', description="json или npy (массив float32 в формате NumPy)")
+):
+    """Фрагмент поверхности по области: сетка значений (NaN/null - нет оценки), строка 0 - северный край"""
+    surface = surface_or_404()
+    if band not in surface.grids:
+        raise HTTPException(status_code=400, detail=f"Доступные диапазоны: {', '.join(surface.grids)}")
+    if metric not in SURFACE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Доступные метрики: {', '.join(SURFACE_METRICS)}")
+    if format not in ('json', 'npy'):
+        raise HTTPException(status_code=400, detail="Доступные форматы: json, npy")
+    bbox = (min_lat, max_lat, min_lon, max_lon)
+    row0, row1, col0, col1 = surface.window(bbox)
+    cells = -(-(row1 - row0) // step) * -(-(col1 - col0) // step)
+    if cells > settings.SURFACE_MAX_CROP_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Фрагмент из {cells} узлов больше {settings.SURFACE_MAX_CROP_CELLS}: увеличьте step"
+        )
 
-    return {"map_image": map_img}
+    values, crop_bbox = await run_in_threadpool(surface.crop, bbox, band, metric, step)
+    headers = {"X-Surface-Bbox": ','.join(f'{value:.6f}' for value in crop_bbox)}
+    if format == 'npy':
+        buf = BytesIO()
+        np.save(buf, values)
+        return Response(content=buf.getvalue(), media_type='application/octet-stream', headers=headers)
+    return JSONResponse({
+        "band": band,
+        "metric": metric,
+        "bbox": crop_bbox,
+        "height": values.shape[0],
+        "width": values.shape[1],
+        "values": np.where(np.isnan(values), None, values.round(2)).tolist(),
+        **surface_info(surface)
+    }, headers=headers)
+
+
+@router.get("/coverage-clusters")
+async def get_coverage_clusters(
+        request: Request,
+        resolution: int = Query(9, description="Разрешение H3"),
+        band: Optional[str] = Query(None, description="Диапазон (по умолчанию - все)"),
+        min_rsrp: Optional[float] = Query(None, description="Учитывать ячейки со средним RSRP не ниже, дБм"),
+        max_rsrp: Optional[float] = Query(None, description="Учитывать ячейки со средним RSRP не выше, дБм"),
+        min_cells: int = Query(1, ge=1, description="Минимальный размер кластера, ячеек"),
+        format: str = Query('geojson', description="geojson, png или webp")
+):
+    """Кластеры покрытия: связные области соседних ячеек H3 со статистикой"""
+    if resolution not in settings.H3_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Доступные разрешения: {list(settings.H3_RESOLUTIONS)}")
+    if band is not None and band not in settings.BANDS:
+        raise HTTPException(status_code=400, detail=f"Доступные диапазоны: {', '.join(settings.BANDS)}")
+    if format != 'geojson' and format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Доступные форматы: geojson, {', '.join(IMAGE_MEDIA_TYPES)}")
+
+    bands = (band,) if band else None
+    key = cache_key('coverage-clusters', resolution, band, min_rsrp, max_rsrp, min_cells, format)
+    etag = make_etag(key)
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    clusters = await run_in_threadpool(find_clusters, resolution, bands, min_rsrp, max_rsrp, min_cells)
+    if format == 'geojson':
+        response = JSONResponse(clusters, media_type='application/geo+json')
+        set_cache_headers(response, etag)
+        return response
+
+    async def render():
+        return await get_render_executor().submit(plot_coverage_clusters, clusters, format)
+
+    return image_response(await get_or_render(key, render), format, etag)
+
+
+IMBALANCE_METRICS = ('delta_rsrp', 'delta_rsrq', 'share_a')
+
+
+@router.get("/imbalance")
+async def get_imbalance(
+        request: Request,
+        resolution: int = Query(9, description="Разрешение H3"),
+        k: int = Query(1, ge=0, le=3, description="Радиус сглаживания по соседним ячейкам"),
+        rsrp_threshold: Optional[float] = Query(None, description="Порог разности RSRP, дБ"),
+        rsrq_threshold: Optional[float] = Query(None, description="Порог разности RSRQ, дБ"),
+        share_threshold: Optional[float] = Query(None, ge=0, le=0.5, description="Порог отклонения доли измерений от 0.5"),
+        min_samples: Optional[int] = Query(None, ge=1, description="Минимум измерений каждого диапазона"),
+        only_flagged: bool = Query(True, description="Возвращать только ячейки с дисбалансом"),
+        metric: str = Query('delta_rsrp', description="Метрика для изображения: delta_rsrp, delta_rsrq или share_a"),
+        format: str = Query('json', description="json, geojson, png или webp")
+):
+    """Дисбаланс LTE1800/LTE2100 по ячейкам H3: разности RSRP/RSRQ и доли измерений"""
+    if resolution not in settings.H3_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Доступные разрешения: {list(settings.H3_RESOLUTIONS)}")
+    if metric not in IMBALANCE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Доступные метрики: {', '.join(IMBALANCE_METRICS)}")
+    if format not in ('json', 'geojson') and format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Доступные форматы: json, geojson, {', '.join(IMAGE_MEDIA_TYPES)}")
+
+    key = cache_key('imbalance', resolution, k, rsrp_threshold, rsrq_threshold, share_threshold,
+                    min_samples, only_flagged, metric, format)
+    etag = make_etag(key)
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    result = await run_in_threadpool(
+        compute_imbalance, resolution, k, rsrp_threshold, rsrq_threshold, share_threshold, min_samples
+    )
+    if format == 'json':
+        response = JSONResponse({
+            "resolution": resolution,
+            "bands": list(result['bands']),
+            "total_cells": len(result['cell']),
+            "flagged_cells": int(result['flagged'].sum()),
+            "cells": await run_in_threadpool(imbalance_records, result, only_flagged),
+        })
+    elif format == 'geojson':
+        response = JSONResponse(await run_in_threadpool(imbalance_geojson, result, only_flagged),
+                                media_type='application/geo+json')
+    else:
+        async def render():
+            return await get_render_executor().submit(render_imbalance, result, metric, format)
+
+        return image_response(await get_or_render(key, render), format, etag)
+
+    set_cache_headers(response, etag)
+    return response
 
 
 @router.get("/coverage-map", response_class=HTMLResponse)
@@ -54,36 +367,55 @@ async def coverage_map(request: Request):
 
 
 @router.get("/coverage-data", response_model=List[Dict[str, Any]])
-async def get_coverage():
+async def get_coverage(
+        request: Request,
+        time_from: Optional[datetime] = TIME_FROM_QUERY,
+        time_to: Optional[datetime] = TIME_TO_QUERY,
+        band: Optional[str] = Query(None, description="Диапазон; без параметра - все диапазоны таблицы"),
+        after: Optional[str] = Query(None, description="Курсор band:h3_index - выдача после этой записи"),
+        limit: Optional[int] = Query(None, ge=1, description="Размер страницы (для json по умолчанию COVERAGE_DATA_PAGE_ROWS)"),
+        response_format: Optional[str] = Query(
+            None, alias='format', description="json, ndjson или arrow; без параметра - по заголовку Accept"
+        )
+):
     """
     GET-эндпоинт для получения данных покрытия с группировкой по H3 гексагонам
-    Возвращает агрегированные данные по каждому гексагону
+    Возвращает агрегированные данные по каждому гексагону (за интервал from/to, если задан)
+    в порядке (band, h3_index). json - одна страница и заголовок X-Next-Cursor, если есть
+    продолжение; ndjson и arrow (Arrow IPC stream) - потоковая выдача всего результата
+    (или limit записей) по блокам ClickHouse
     """
+    time_range = time_range_or_none(time_from, time_to)
     try:
-        client = get_clickhouse_client()
+        response_format = negotiate_format(response_format, request.headers.get('accept'))
+        cursor = parse_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if response_format == 'arrow' and not arrow_available():
+        raise HTTPException(status_code=406, detail="Формат arrow требует пакет pyarrow")
+
+    if response_format == 'json':
+        limit = limit or settings.COVERAGE_DATA_PAGE_ROWS
+    # Данные берутся из агрегатов (разрешение 8, как у h3_index)
+    blocks = iter_hex_aggregates(8, (band,) if band is not None else None, None, time_range, cursor, limit)
 
-        # Запрос данных с группировкой по H3 индексу
-        query = """
-        SELECT 
-            h3_index,
-            avg(latitude) as latitude,
-            avg(longitude) as longitude,
-            band,
-            avg(rsrp) as avg_rsrp,
-            avg(rsrq) as avg_rsrq,
-            count() as point_count
-        FROM lte_coverage.coverage_data
-        GROUP BY h3_index, band
-        LIMIT 10000
-        """
-
-        data = client.execute(query)
-
-        # Преобразуем в список словарей
-        return [dict(zip([
-            'h3_index', 'lat', 'lng',
-            'band', 'avg_rsrp', 'avg_rsrq', 'point_count'
-        ], row)) for row in data]
+    try:
+        if response_format != 'json':
+            chunks = ndjson_chunks(blocks) if response_format == 'ndjson' else arrow_chunks(blocks)
+            # Первый фрагмент читается до ответа: ошибка запроса превращается в 500, а не в оборванный поток
+            first = await run_in_threadpool(next, chunks, None)
+            body = chain([first] if first is not None else [], chunks)
+            return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[response_format])
+
+        records = []
+        last = None
+        for block in await run_in_threadpool(list, blocks):
+            records += coverage_frame(block).to_dict('records')
+            last = (block['band'][-1], block['cell'][-1])
+        response = JSONResponse(records)
+        if len(records) == limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(*last)
+        return response
 
     except Exception as e:
         raise HTTPException(
@@ -92,13 +424,115 @@ async def get_coverage():
         )
 
 
+@router.get("/coverage-hexes")
+async def get_coverage_hexes(
+        request: Request,
+        min_lat: Optional[float] = None, max_lat: Optional[float] = None,
+        min_lon: Optional[float] = None, max_lon: Optional[float] = None,
+        resolution: Optional[int] = Query(
+            None, description="Разрешение H3 (по умолчанию - по размеру области, без области - 8)"
+        ),
+        time_from: Optional[datetime] = TIME_FROM_QUERY,
+        time_to: Optional[datetime] = TIME_TO_QUERY
+):
+    """Агрегаты ячеек в компактном бинарном формате (export_service.pack_hexes).
+
+    Ячейки UInt64, метрики Float32, коды диапазонов UInt8 - для отрисовки
+    гексагонов на canvas в браузере (hexmap, coverage-map) без Matplotlib.
+    """
+    bbox = (min_lat, max_lat, min_lon, max_lon)
+    if all(value is None for value in bbox):
+        bbox = None
+    elif None in bbox:
+        raise HTTPException(status_code=400, detail="Область задаётся всеми четырьмя границами")
+    if resolution is None:
+        resolution = choose_resolution(*bbox) if bbox is not None else 8
+    elif resolution not in settings.H3_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Доступные разрешения: {list(settings.H3_RESOLUTIONS)}")
+    time_range = time_range_or_none(time_from, time_to)
+
+    key = cache_key('coverage-hexes', bbox, resolution, time_range)
+    etag = make_etag(key)
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    def build():
+        return pack_hexes(get_hex_aggregates(resolution, None, bbox, time_range), resolution)
+
+    async def render():
+        return await run_in_threadpool(build)
+
+    try:
+        payload = await get_or_render(key, render)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    response = Response(content=payload, media_type='application/octet-stream')
+    set_cache_headers(response, etag)
+    response.headers['X-H3-Resolution'] = str(resolution)
+    return response
+
+
+@router.get("/coverage-timeseries")
+async def get_coverage_timeseries(
+        request: Request,
+        interval: str = Query('day', description="Шаг ряда: hour, day, week или month"),
+        band: Optional[str] = Query(None, description="Диапазон (по умолчанию - все)"),
+        cell: Optional[str] = Query(None, description="Ячейка H3 (по умолчанию - вся территория)"),
+        time_from: Optional[datetime] = TIME_FROM_QUERY,
+        time_to: Optional[datetime] = TIME_TO_QUERY
+):
+    """Временной ряд по диапазонам: число измерений и средние RSRP/RSRQ, группировка на стороне ClickHouse"""
+    if interval not in TIME_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Доступные шаги: {', '.join(TIME_INTERVALS)}")
+    if band is not None and band not in settings.BANDS:
+        raise HTTPException(status_code=400, detail=f"Доступные диапазоны: {', '.join(settings.BANDS)}")
+    cell_id = None
+    if cell is not None:
+        import h3.api.basic_int as h3
+
+        try:
+            cell_id = h3.str_to_int(cell)
+        except ValueError:
+            cell_id = None
+        if cell_id is None or not h3.is_valid_cell(cell_id):
+            raise HTTPException(status_code=400, detail=f"Некорректная ячейка H3: {cell}")
+        if h3.get_resolution(cell_id) not in settings.H3_RESOLUTIONS:
+            raise HTTPException(status_code=400, detail=f"Доступные разрешения: {list(settings.H3_RESOLUTIONS)}")
+    time_range = time_range_or_none(time_from, time_to)
+
+    key = cache_key('coverage-timeseries', interval, band, cell, time_range)
+    etag = make_etag(key)
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    bands = (band,) if band else None
+    series = await run_in_threadpool(get_time_series, interval, bands, cell_id, time_range)
+    response = JSONResponse({
+        "interval": interval,
+        "cell": cell,
+        "points": [
+            {
+                "time": row.time.isoformat(),
+                "band": row.band,
+                "point_count": int(row.point_count),
+                "avg_rsrp": float(row.avg_rsrp),
+                "avg_rsrq": float(row.avg_rsrq),
+            }
+            for row in series.itertuples(index=False)
+        ]
+    })
+    set_cache_headers(response, etag)
+    return response
+
+
 @router.get("/api/table-structure-full")
 async def get_table_structure_full():
     try:
-        client = get_clickhouse_client()
-
         # Получаем полное описание таблицы
-        structure = client.execute(f"""
+        structure = await execute_async(f"""
         SELECT 
             name, 
             type,
@@ -110,12 +544,12 @@ async def get_table_structure_full():
         """)
 
         # Проверяем существование таблицы
-        exists = client.execute(f"""
+        exists = (await execute_async(f"""
         SELECT count()
         FROM system.tables
         WHERE database = '{settings.CLICKHOUSE_DB}'
         AND name = 'coverage_data'
-        """)[0][0] > 0
+        """))[0][0] > 0
 
         if not exists:
             return {"error": "Table does not exist"}
@@ -129,33 +563,74 @@ async def get_table_structure_full():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def coverage_table_exists():
+    return (await execute_async(f"""
+    SELECT count()
+    FROM system.tables
+    WHERE database = '{settings.CLICKHOUSE_DB}'
+    AND name = 'coverage_data'
+    """))[0][0] > 0
+
+
+@router.get("/api/data-profile")
+async def data_profile():
+    """Профиль качества данных: все статистики по колонкам одним запросом, кеш по версии данных"""
+    try:
+        if not await coverage_table_exists():
+            return {"error": "Table does not exist"}
+        return await run_in_threadpool(get_data_profile)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/healthz")
+async def healthz():
+    """Проверка живости процесса; состояние фоновой загрузки - для информации"""
+    job = get_ingest_job()
+    return {"status": "ok", "ingest": job.status() if job is not None else None}
+
+
+@router.get("/readyz")
+async def readyz():
+    """Готовность: данные загружены и ClickHouse доступен, иначе 503 с прогрессом загрузки"""
+    job = get_ingest_job()
+    ingest = job.status() if job is not None else None
+    ready = job is not None and job.ready
+    if ready:
+        try:
+            ready = await run_in_threadpool(get_pool().health_check)
+        except Exception as e:
+            logger.warning("ClickHouse недоступен: %s", e)
+            ready = False
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "ingest": ingest},
+        status_code=200 if ready else 503
+    )
+
+
+@router.get("/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus: время запросов и фаз, объём чтения ClickHouse"""
+    return Response(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @router.get("/api/check-data")
 async def check_data():
     try:
-        client = get_clickhouse_client()
-
         # 1. Проверяем существование таблицы
-        exists = client.execute(f"""
-        SELECT count()
-        FROM system.tables
-        WHERE database = '{settings.CLICKHOUSE_DB}'
-        AND name = 'coverage_data'
-        """)[0][0] > 0
+        exists = await coverage_table_exists()
 
         if not exists:
             return {"error": "Table does not exist"}
 
-        # 2. Проверяем количество записей
-        count = client.execute(f"SELECT count() FROM {settings.CLICKHOUSE_DB}.coverage_data")[0][0]
+        # 2. Количество записей и пропуски берутся из профиля (один проход по таблице).
+        # Колонки не Nullable, поэтому пропуском считаются NaN, пустые строки и нулевое время
+        profile = await run_in_threadpool(get_data_profile)
+        count = profile["row_count"]
 
-        # 3. Проверяем наличие данных в каждом столбце
         columns_check = {}
         for col in ['latitude', 'longitude', 'altitude', 'band', 'rsrp', 'rsrq', 'h3_index', 'eventtime']:
-            non_null = client.execute(f"""
-            SELECT count()
-            FROM {settings.CLICKHOUSE_DB}.coverage_data
-            WHERE {col} IS NOT NULL
-            """)[0][0]
+            non_null = count - profile["columns"][col]["missing_count"]
             columns_check[col] = {
                 "exists_in_table": True,
                 "non_null_count": non_null,
@@ -173,147 +648,143 @@ async def check_data():
 
 
 @router.get("/coverage-hexmap")
-async def get_coverage_hexmap():
-    """Генерация гексагональной карты с улучшенной визуализацией"""
-    try:
-        client = get_clickhouse_client()
-        query = """
-        SELECT latitude, longitude, band 
-        FROM lte_coverage.coverage_data
-        WHERE band IN ('LTE1800', 'LTE2100')
-        LIMIT 10000
-        """
-        data = client.execute(query)
-
-        fig, ax = plt.subplots(figsize=(14, 10))
-
-        # Уменьшаем размер гексагонов (используем resolution=9 вместо 8)
-        HEX_RESOLUTION = 10
-
-        # Яркие цвета с контрастными границами
-        colors = {
-            'LTE1800': ('#1f78b4', '#0a4b8c'),  # (fill, edge)
-            'LTE2100': ('#e31a1c', '#a50f15')  # (fill, edge)
-        }
-
-        # Собираем границы отдельно для каждого типа
-        boundaries = {'LTE1800': [], 'LTE2100': []}
-
-        for lat, lon, band in data:
-            try:
-                hex_id = h3.latlng_to_cell(lat, lon, HEX_RESOLUTION)
-                hex_boundary = h3.cell_to_boundary(hex_id)
-                boundaries[band].append(np.array([(lon, lat) for lat, lon in hex_boundary]))
-            except:
-                continue
-
-        # Рисуем LTE2100 ПЕРВЫМИ (чтобы они не перекрывались LTE1800)
-        for coords in boundaries['LTE2100']:
-            poly = Polygon(
-                coords,
-                facecolor=colors['LTE2100'][0],
-                edgecolor=colors['LTE2100'][1],
-                alpha=0.7,  # Увеличили прозрачность
-                linewidth=0.8
-            )
-            ax.add_patch(poly)
-
-        # Затем рисуем LTE1800
-        for coords in boundaries['LTE1800']:
-            poly = Polygon(
-                coords,
-                facecolor=colors['LTE1800'][0],
-                edgecolor=colors['LTE1800'][1],
-                alpha=0.6,
-                linewidth=0.5
-            )
-            ax.add_patch(poly)
-
-        # Автоматическое масштабирование
-        ax.autoscale_view()
-
-        # Улучшенная легенда
-        legend_elements = [
-            Line2D([0], [0], marker='s', color='w', label='LTE1800',
-                   markerfacecolor=colors['LTE1800'][0], markersize=15),
-            Line2D([0], [0], marker='s', color='w', label='LTE2100',
-                   markerfacecolor=colors['LTE2100'][0], markersize=15)
-        ]
-        ax.legend(handles=legend_elements, fontsize=12)
-
-        ax.set_title('LTE Coverage Hexagonal Map (Resolution 9)', fontsize=14)
-        ax.set_xlabel('Longitude', fontsize=12)
-        ax.set_ylabel('Latitude', fontsize=12)
-
-        buf = BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', dpi=120)
-        plt.close(fig)
-        buf.seek(0)
+async def get_coverage_hexmap(
+        request: Request,
+        resolution: int = Query(10, description="Разрешение H3"),
+        metric: str = Query('rsrp', description="Метрика заливки: rsrp, rsrq, count или band"),
+        time_from: Optional[datetime] = TIME_FROM_QUERY,
+        time_to: Optional[datetime] = TIME_TO_QUERY,
+        format: str = IMAGE_FORMAT_QUERY
+):
+    """Гексагональная карта: агрегация по ячейкам в ClickHouse, каждая ячейка рисуется один раз"""
+    if resolution not in settings.H3_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Доступные разрешения: {list(settings.H3_RESOLUTIONS)}")
+    if metric != 'band' and metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Доступные метрики: band, {', '.join(METRICS)}")
+    check_image_format(format)
+    time_range = time_range_or_none(time_from, time_to)
+
+    encoding = 'png' if format == 'base64' else format
+    key = cache_key('coverage-hexmap', resolution, metric, time_range, encoding)
+    etag = make_etag(key + (format,))
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    async def render():
+        cells = await run_in_threadpool(get_hex_aggregates, resolution, None, None, time_range)
+        return await get_render_executor().submit(
+            render_hexmap, cells, resolution, METRICS.get(metric), encoding
+        )
 
-        return {"image": f"data:image/png;base64,{base64.b64encode(buf.read()).decode('utf-8')}"}
+    try:
+        image = await get_or_render(key, render)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if format == 'base64':
+        response = JSONResponse({"image": f"data:image/png;base64,{base64.b64encode(image).decode('utf-8')}"})
+        set_cache_headers(response, etag)
+        return response
+    return image_response(image, format, etag)
+
+
+@router.get("/tiles/{band}/{z}/{x}/{y}.png")
+async def get_tile(
+        band: str, z: int, x: int, y: int,
+        request: Request,
+        metric: str = Query('rsrp', description="Метрика заливки: rsrp, rsrq или count")
+):
+    """XYZ-тайл покрытия диапазона: гексагоны разрешения, подобранного по масштабу"""
+    if band not in settings.BANDS:
+        raise HTTPException(status_code=404, detail=f"Неизвестный диапазон: {band}")
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Доступные метрики: {', '.join(METRICS)}")
+    if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Тайл вне допустимого диапазона")
+
+    version = get_data_version()
+    etag = make_etag(('tiles', band, metric, z, x, y, version))
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    resolution = resolution_for_zoom(z)
+    if resolution is None:
+        # Гексагоны меньше пикселя: для обзора данных - /coverage-raster
+        response = Response(content=empty_tile(), media_type='image/png')
+        set_cache_headers(response, etag)
+        return response
+
+    path = tile_path(version, band, metric, z, x, y)
+    tile = await run_in_threadpool(read_tile, path)
+    if tile is None:
+        cells = await run_in_threadpool(
+            get_hex_aggregates, resolution, (band,), tile_bbox(z, x, y)
+        )
+        tile = await get_render_executor().submit(
+            render_tile, cells, tile_mercator_bounds(z, x, y), METRICS[metric]
+        )
+        await run_in_threadpool(write_atomic, path, tile)
+
+    response = Response(content=tile, media_type='image/png')
+    set_cache_headers(response, etag)
+    return response
+
 
 @router.get("/hexmap", response_class=HTMLResponse)
 async def hexmap(request: Request):
     return templates.TemplateResponse("hexmap.html", {"request": request})
 
 
-def create_coverage_map():
-    """Генерирует карту покрытия и возвращает base64 изображение"""
-    try:
-        client = get_clickhouse_client()
-        data = client.execute("""
-        SELECT latitude, longitude, band 
-        FROM lte_coverage.coverage_data
-        WHERE band IN ('LTE1800', 'LTE2100')
-        LIMIT 10000
-        """)
+def antenna_map_key(image_format):
+    return cache_key('coverage_map_with_antenns', max(settings.H3_RESOLUTIONS), image_format)
 
-        fig, ax = plt.subplots(figsize=(12, 8))
-
-        # Центральная точка (антенна)
-        base_station = (52.27664, 104.27792)
-        ax.scatter(*base_station, c='red', s=100, marker='^', label='Базовая станция')
-
-        # Отрисовка гексагонов
-        colors = {'LTE1800': 'blue', 'LTE2100': 'green'}
-        for lat, lon, band in data:
-            hex_id = h3.latlng_to_cell(lat, lon, 11)
-            hex_boundary = h3.cell_to_boundary(hex_id)
-            poly = plt.Polygon(
-                np.array(hex_boundary),
-                color=colors.get(band, 'gray'),
-                alpha=0.5,
-                edgecolor='white',
-                linewidth=0.3
-            )
-            ax.add_patch(poly)
-
-        # Настройки графика
-        ax.set_title('Карта покрытия LTE')
-        ax.set_xlabel('Долгота')
-        ax.set_ylabel('Широта')
-        ax.legend()
-        ax.grid(True, linestyle='--', alpha=0.5)
-        ax.autoscale_view()
-
-        # Сохранение в буфер
-        buf = BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-        plt.close()
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
 
-    except Exception as e:
-        print(f"Ошибка генерации карты: {e}")
-        return None
+async def antenna_map(image_format):
+    """Изображение карты с антенной (из кеша или с отрисовкой)"""
+    async def render():
+        # Агрегаты по (band, ячейка) самого мелкого разрешения: все данные, без повторов ячеек
+        cells = await run_in_threadpool(get_hex_aggregates, max(settings.H3_RESOLUTIONS), settings.BANDS)
+        return await get_render_executor().submit(render_antenna_map, cells, image_format)
+
+    return await get_or_render(antenna_map_key(image_format), render)
+
+
+@router.get("/coverage_map_with_antenns/image")
+async def get_antenna_map_image(
+        request: Request,
+        format: str = Query('png', description="Формат изображения: png или webp")
+):
+    """Изображение карты покрытия с антенной"""
+    if format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Доступные форматы: {', '.join(IMAGE_MEDIA_TYPES)}")
+    etag = make_etag(antenna_map_key(format))
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    return image_response(await antenna_map(format), format, etag)
 
 
 @router.get("/coverage_map_with_antenns", response_class=HTMLResponse)
-async def show_coverage_map():
+async def show_coverage_map(
+        request: Request,
+        embed: str = Query(None, description="base64 - встроить изображение в страницу (прежний вариант)")
+):
     """Отображает HTML страницу с картой покрытия"""
-    map_image = create_coverage_map()
+    etag = make_etag(cache_key('coverage_map_with_antenns_page', embed))
+    cached_response = not_modified(request, etag)
+    if cached_response is not None:
+        return cached_response
+
+    if embed == 'base64':
+        image = await antenna_map('png')
+        map_src = f"data:image/png;base64,{base64.b64encode(image).decode('utf-8')}"
+    else:
+        map_src = "/coverage_map_with_antenns/image"
 
     html_content = f"""
     <!DOCTYPE html>
@@ -372,7 +843,7 @@ async def show_coverage_map():
                     <span>LTE2100</span>
                 </div>
             </div>
-            <img id="coverage-map" src="data:image/png;base64,{map_image}" alt="Карта покрытия">
+            <img id="coverage-map" src="{map_src}" alt="Карта покрытия">
             <div>
                 <button onclick="window.location.reload()">Обновить карту</button>
             </div>
@@ -381,4 +852,6 @@ async def show_coverage_map():
     </html>
     """
 
-    return HTMLResponse(content=html_content)
\ No newline at end of file
+    response = HTMLResponse(content=html_content)
+    set_cache_headers(response, etag)
+    return response
\ No newline at end of file
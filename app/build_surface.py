@@ -0,0 +1,34 @@
+"""Построение интерполированной поверхности RSRP/RSRQ вне приложения.
+
+Запуск: python -m app.build_surface [--force]
+Без --force сборка пропускается, если поверхность уже построена для текущей
+версии данных и тех же параметров. Работающее приложение подхватывает новую
+сборку автоматически.
+"""
+import argparse
+
+from app.config import settings
+from app.database import get_clickhouse_client, manifest_version
+from app.services.surface_service import build_surface
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение поверхности покрытия RSRP/RSRQ")
+    parser.add_argument('--force', action='store_true', help="пересобрать, даже если сборка актуальна")
+    args = parser.parse_args()
+
+    client = get_clickhouse_client()
+    try:
+        version = manifest_version(client)
+    finally:
+        client.disconnect()
+
+    metadata = build_surface(version, force=args.force)
+    if metadata is None:
+        return
+    print(f"Сборка {metadata['directory']} в {settings.SURFACE_DIR}: сетка {metadata['width']}x{metadata['height']}, "
+          f"диапазоны {', '.join(metadata['bands'])}, построена {metadata['built_at']}")
+
+
+if __name__ == '__main__':
+    main()
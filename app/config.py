@@ -6,7 +6,75 @@ class Settings:
     CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "lte_coverage")
     CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
     CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
+    # Пул соединений: максимум одновременных запросов и ожидание свободного соединения (с)
+    CLICKHOUSE_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "8"))
+    CLICKHOUSE_POOL_TIMEOUT = float(os.getenv("CLICKHOUSE_POOL_TIMEOUT", "10"))
+    # Режим запуска python -m app.main: development (один процесс с автоперезагрузкой)
+    # или production (WEB_WORKERS процессов uvicorn без перезагрузки)
+    SERVER_MODE = os.getenv("SERVER_MODE", "development")
+    SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+    WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+    # Пул процессов отрисовки: число процессов, длина очереди и таймаут (с).
+    # По умолчанию ядра делятся между процессами uvicorn
+    RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(
+        1, (os.cpu_count() or 2) // (WEB_WORKERS if SERVER_MODE == "production" else 1)
+    ))))
+    RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "16"))
+    RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "60"))
+    RENDER_START_METHOD = os.getenv("RENDER_START_METHOD", "spawn")
+    # Кеш отрисованных карт в памяти процесса (байты)
+    RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
     BASE_DIR = Path(__file__).resolve().parent.parent
-    DATA_FILE = BASE_DIR / "data" / "Данные проблемы дисбалансов.xlsx"
+    # Дисковый кеш XYZ-тайлов (очищается при изменении данных)
+    TILE_CACHE_DIR = Path(os.getenv("TILE_CACHE_DIR", BASE_DIR / "cache" / "tiles"))
+    # Общий для процессов uvicorn дисковый кеш отрисованных карт (байты, 0 - отключен)
+    # и файл с версией данных, по которой процессы сбрасывают свои кеши
+    RENDER_CACHE_DIR = Path(os.getenv("RENDER_CACHE_DIR", BASE_DIR / "cache" / "render"))
+    RENDER_DISK_CACHE_MAX_BYTES = int(os.getenv("RENDER_DISK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    DATA_VERSION_FILE = Path(os.getenv("DATA_VERSION_FILE", BASE_DIR / "cache" / "data_version"))
+    # Все файлы поддерживаемых форматов из DATA_DIR загружаются при старте
+    DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data"))
+    # Разрешения H3, которые считаются при загрузке (колонки h3_r7 ... h3_r11)
+    H3_RESOLUTIONS = tuple(
+        int(r) for r in os.getenv("H3_RESOLUTIONS", "7,8,9,10,11").split(",")
+    )
+    # Частотные диапазоны, которые отображаются на картах
+    BANDS = ("LTE1800", "LTE2100")
+    # Ориентир по числу ячеек на карте области (POST /coverage), по нему выбирается разрешение H3
+    COVERAGE_TARGET_CELLS = int(os.getenv("COVERAGE_TARGET_CELLS", "5000"))
+    # Потоковая загрузка: размер блока в строках и разделитель CSV
+    INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+    INGEST_CSV_SEPARATOR = os.getenv("INGEST_CSV_SEPARATOR", ",")
+    # Дисбаланс LTE1800/LTE2100: пороги разности RSRP (дБ), RSRQ (дБ), отклонения доли
+    # измерений от 0.5 и минимальное число измерений каждого диапазона в ячейке
+    IMBALANCE_RSRP_THRESHOLD = float(os.getenv("IMBALANCE_RSRP_THRESHOLD", "6"))
+    IMBALANCE_RSRQ_THRESHOLD = float(os.getenv("IMBALANCE_RSRQ_THRESHOLD", "3"))
+    IMBALANCE_SHARE_THRESHOLD = float(os.getenv("IMBALANCE_SHARE_THRESHOLD", "0.3"))
+    IMBALANCE_MIN_SAMPLES = int(os.getenv("IMBALANCE_MIN_SAMPLES", "5"))
+    # Отбор по области: до этой площади (км²) - по диапазонам H3 в первичном ключе,
+    # для больших областей - minmax-индексы широты/долготы; примерное число ячеек покрытия
+    SPATIAL_H3_MAX_AREA_KM2 = float(os.getenv("SPATIAL_H3_MAX_AREA_KM2", "10000"))
+    SPATIAL_COVER_CELLS = int(os.getenv("SPATIAL_COVER_CELLS", "32"))
+    # Потоковая выдача /coverage-data: строк в блоке ClickHouse и размер страницы JSON по умолчанию
+    STREAM_BLOCK_ROWS = int(os.getenv("STREAM_BLOCK_ROWS", "65536"))
+    COVERAGE_DATA_PAGE_ROWS = int(os.getenv("COVERAGE_DATA_PAGE_ROWS", "10000"))
+    # Интерполированная поверхность RSRP/RSRQ (surface_service): каталог сборок, разрешение
+    # агрегатов-источников, шаг сетки (м, сторона не больше SURFACE_MAX_SIDE узлов), число соседей,
+    # степень IDW и радиус, дальше которого покрытие не оценивается (м)
+    SURFACE_DIR = Path(os.getenv("SURFACE_DIR", BASE_DIR / "cache" / "surface"))
+    SURFACE_H3_RESOLUTION = int(os.getenv("SURFACE_H3_RESOLUTION", "10"))
+    SURFACE_CELL_METERS = float(os.getenv("SURFACE_CELL_METERS", "50"))
+    SURFACE_MAX_SIDE = int(os.getenv("SURFACE_MAX_SIDE", "4096"))
+    SURFACE_NEIGHBORS = int(os.getenv("SURFACE_NEIGHBORS", "8"))
+    SURFACE_POWER = float(os.getenv("SURFACE_POWER", "2"))
+    SURFACE_MAX_DISTANCE_M = float(os.getenv("SURFACE_MAX_DISTANCE_M", "1000"))
+    # Узлов сетки на один запрос к cKDTree и предел размера выдаваемого фрагмента
+    SURFACE_BLOCK_POINTS = int(os.getenv("SURFACE_BLOCK_POINTS", "262144"))
+    SURFACE_MAX_CROP_CELLS = int(os.getenv("SURFACE_MAX_CROP_CELLS", "1000000"))
+    # Пересобирать поверхность в фоне после загрузки данных, если версия данных изменилась
+    SURFACE_AUTO_BUILD = os.getenv("SURFACE_AUTO_BUILD", "1") == "1"
+    # Запросы дольше этого времени (с) пишутся в журнал с фазами и текстом SQL; 0 - отключено
+    SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
 
 settings = Settings()
@@ -1,112 +1,439 @@
-import h3
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
 from clickhouse_driver import Client
-import pandas as pd
+from starlette.concurrency import run_in_threadpool
 
 from app.config import settings
+from app.services.h3_service import cells_to_strings, h3_column
+from app.services.ingest_service import columns_to_load, file_fingerprint, prepare_chunk, read_chunks
+from app.services.metrics_service import phase, record_query
 
 
 def get_clickhouse_client():
     """Инициализация клиента ClickHouse"""
     return Client(host=settings.CLICKHOUSE_HOST, user=settings.CLICKHOUSE_USER, password=settings.CLICKHOUSE_PASSWORD, database=settings.CLICKHOUSE_DB)
 
+
+class PoolTimeoutError(Exception):
+    """Нет свободного соединения в пуле за отведённое время"""
+
+
+class ClickHousePool:
+    """Ограниченный пул соединений ClickHouse.
+
+    Одновременно выдаётся не больше size клиентов; простаивающие клиенты
+    переиспользуются, новые открываются по мере необходимости.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт клиента из пула и возвращает его обратно после использования"""
+        with phase('pool_wait'):
+            acquired = self._slots.acquire(timeout=self.timeout)
+        if not acquired:
+            raise PoolTimeoutError(f"Нет свободного соединения ClickHouse за {self.timeout} с")
+        try:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                client = get_clickhouse_client()
+            try:
+                yield client
+            finally:
+                self._idle.put(client)
+        finally:
+            self._slots.release()
+
+    def health_check(self):
+        """Проверка доступности ClickHouse через соединение из пула"""
+        with self.connection() as client:
+            return client.execute('SELECT 1')[0][0] == 1
+
+    def close(self):
+        """Закрывает все простаивающие соединения"""
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            client.disconnect()
+
+
+_pool = None
+
+
+def init_pool():
+    """Создаёт пул соединений (вызывается при старте приложения)"""
+    global _pool
+    if _pool is None:
+        _pool = ClickHousePool(settings.CLICKHOUSE_POOL_SIZE, settings.CLICKHOUSE_POOL_TIMEOUT)
+    return _pool
+
+
+def get_pool():
+    return _pool or init_pool()
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def execute(query, params=None, **kwargs):
+    """Выполняет запрос на соединении из пула"""
+    with get_pool().connection() as client:
+        started = time.perf_counter()
+        with phase('clickhouse'):
+            result = client.execute(query, params, **kwargs)
+        progress = getattr(client.last_query, 'progress', None)
+        record_query(query, time.perf_counter() - started,
+                     getattr(progress, 'rows', 0), getattr(progress, 'bytes', 0))
+        return result
+
+
+def iter_column_blocks(query, params=None, query_settings=None):
+    """Результат запроса по блокам: для каждого блока - список numpy-колонок.
+
+    Блоки читаются по мере поступления от сервера, поэтому память ограничена
+    размером одного блока (max_block_size), а не всего результата.
+    """
+    block_settings = {'use_numpy': True, **(query_settings or {})}
+    with get_pool().connection() as client:
+        completed = False
+        # Время ClickHouse - только ожидание блоков, без обработки у потребителя
+        elapsed = 0.0
+        rows_read = bytes_read = 0
+        try:
+            with client.disconnect_on_error(query, block_settings):
+                started = time.perf_counter()
+                with phase('clickhouse'):
+                    client.connection.send_query(client.substitute_params(query, params, client.connection.context))
+                    client.connection.send_external_tables(None)
+                packets = client.packet_generator()
+                while True:
+                    with phase('clickhouse'):
+                        packet = next(packets, None)
+                    elapsed += time.perf_counter() - started
+                    if packet is None:
+                        break
+                    progress = getattr(packet, 'progress', None)
+                    if progress is not None:
+                        rows_read += progress.rows
+                        bytes_read += progress.bytes
+                    block = getattr(packet, 'block', None)
+                    if block is not None and block.num_rows:
+                        yield block.get_columns()
+                    started = time.perf_counter()
+            completed = True
+        finally:
+            record_query(query, elapsed, rows_read, bytes_read)
+            # Недочитанный результат оставляет соединение занятым - такое соединение закрываем
+            if not completed:
+                client.disconnect()
+
+
+async def execute_async(query, params=None, **kwargs):
+    """Выполняет запрос в пуле потоков, не блокируя event loop"""
+    return await run_in_threadpool(execute, query, params, **kwargs)
+
+
+def rollup_select(resolution):
+    """SELECT, сворачивающий coverage_data в строки таблицы coverage_h3_rollup"""
+    return f'''
+    SELECT
+        toUInt8({resolution}) AS resolution,
+        band,
+        {h3_column(resolution)} AS h3,
+        toStartOfDay(eventtime) AS bucket,
+        source_file,
+        count() AS sample_count,
+        sum(rsrp) AS sum_rsrp,
+        sum(rsrq) AS sum_rsrq,
+        sum(latitude) AS sum_latitude,
+        sum(longitude) AS sum_longitude,
+        quantilesState(0.1, 0.5, 0.9)(toFloat64(rsrp)) AS rsrp_quantiles,
+        quantilesState(0.1, 0.5, 0.9)(toFloat64(rsrq)) AS rsrq_quantiles
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    GROUP BY resolution, band, h3, bucket, source_file
+    '''
+
+
+def init_rollups(client):
+    """Агрегированные таблицы по H3 и материализованные представления, которые их заполняют.
+
+    По одной MV на разрешение; строки хранятся по дням и по исходному файлу,
+    чтобы замена файла удаляла и его агрегаты.
+    """
+    db = settings.CLICKHOUSE_DB
+    client.execute(f'''
+    CREATE TABLE IF NOT EXISTS {db}.coverage_h3_rollup (
+        resolution UInt8,
+        band String,
+        h3 UInt64,
+        bucket DateTime,
+        source_file String,
+        sample_count SimpleAggregateFunction(sum, UInt64),
+        sum_rsrp SimpleAggregateFunction(sum, Float64),
+        sum_rsrq SimpleAggregateFunction(sum, Float64),
+        sum_latitude SimpleAggregateFunction(sum, Float64),
+        sum_longitude SimpleAggregateFunction(sum, Float64),
+        rsrp_quantiles AggregateFunction(quantiles(0.1, 0.5, 0.9), Float64),
+        rsrq_quantiles AggregateFunction(quantiles(0.1, 0.5, 0.9), Float64)
+    ) ENGINE = AggregatingMergeTree()
+    PARTITION BY toYYYYMM(bucket)
+    ORDER BY (resolution, band, h3, bucket, source_file)
+    ''')
+
+    # Данные, загруженные до появления агрегатов, переносятся один раз
+    backfill = client.execute(f'SELECT count() FROM {db}.coverage_h3_rollup')[0][0] == 0
+
+    for res in settings.H3_RESOLUTIONS:
+        client.execute(
+            f'CREATE MATERIALIZED VIEW IF NOT EXISTS {db}.coverage_h3_rollup_mv_r{res} '
+            f'TO {db}.coverage_h3_rollup AS {rollup_select(res)}'
+        )
+        if backfill:
+            client.execute(f'INSERT INTO {db}.coverage_h3_rollup {rollup_select(res)}')
+
+
+# Индексы пропуска coverage_data: данные упорядочены по H3, поэтому диапазоны
+# координат в гранулах узкие и отбор по области пропускает большую часть гранул
+SKIP_INDEXES = [
+    ('idx_latitude', 'latitude TYPE minmax GRANULARITY 4'),
+    ('idx_longitude', 'longitude TYPE minmax GRANULARITY 4'),
+]
+
+
+def coverage_data_ddl(table='coverage_data'):
+    """CREATE TABLE для измерений в компактной схеме.
+
+    band и source_file - LowCardinality (единицы различных значений), H3 - UInt64
+    (h3_index - ячейка разрешения 8), RSRP/RSRQ и высота - Float32 (точность
+    измерений 0.1-1 дБ и метры). Колонки, упорядоченные ключом сортировки,
+    сжимаются дельтами, остальные - ZSTD. minmax-индексы широты и долготы
+    позволяют пропускать гранулы при отборе по большой области.
+    """
+    h3_columns = ',\n        '.join(
+        f'{h3_column(res)} UInt64 CODEC(Delta, ZSTD(1))' for res in settings.H3_RESOLUTIONS
+    )
+    skip_indexes = ',\n        '.join(f'INDEX {name} {definition}' for name, definition in SKIP_INDEXES)
+    return f'''
+    CREATE TABLE IF NOT EXISTS {settings.CLICKHOUSE_DB}.{table} (
+        latitude Float64 CODEC(ZSTD(1)),
+        longitude Float64 CODEC(ZSTD(1)),
+        altitude Float32 CODEC(ZSTD(1)),
+        band LowCardinality(String),
+        rsrp Float32 CODEC(ZSTD(1)),
+        rsrq Float32 CODEC(ZSTD(1)),
+        h3_index UInt64 CODEC(Delta, ZSTD(1)),
+        eventtime DateTime CODEC(Delta, ZSTD(1)),
+        {h3_columns},
+        source_file LowCardinality(String),
+        {skip_indexes}
+    ) ENGINE = MergeTree()
+    PARTITION BY toYYYYMM(eventtime)
+    ORDER BY (band, h3_index)
+    '''
+
+
+def column_types(client, table='coverage_data'):
+    """Типы колонок таблицы: {имя: тип}"""
+    return dict(client.execute(
+        'SELECT name, type FROM system.columns WHERE database = %(db)s AND table = %(table)s',
+        {'db': settings.CLICKHOUSE_DB, 'table': table}
+    ))
+
+
 def init_database():
     """Инициализация базы данных и таблиц"""
     client = get_clickhouse_client()
 
     client.execute(f'CREATE DATABASE IF NOT EXISTS {settings.CLICKHOUSE_DB}')
+    client.execute(coverage_data_ddl())
+
+    # Для таблиц, созданных до появления мультиразрешающих индексов и манифеста
+    for column, column_type in [(h3_column(res), 'UInt64') for res in settings.H3_RESOLUTIONS] + [('source_file', 'LowCardinality(String)')]:
+        client.execute(
+            f'ALTER TABLE {settings.CLICKHOUSE_DB}.coverage_data '
+            f'ADD COLUMN IF NOT EXISTS {column} {column_type}'
+        )
+
+    # Индексы пропуска для таблиц, созданных без них (строятся для новых кусков;
+    # для уже загруженных - ALTER TABLE ... MATERIALIZE INDEX или schema_migration)
+    for name, definition in SKIP_INDEXES:
+        client.execute(
+            f'ALTER TABLE {settings.CLICKHOUSE_DB}.coverage_data '
+            f'ADD INDEX IF NOT EXISTS {name} {definition}'
+        )
+
+    # Манифест загруженных файлов: по одной актуальной записи на файл
     client.execute(f'''
-    CREATE TABLE IF NOT EXISTS {settings.CLICKHOUSE_DB}.coverage_data (
-        latitude Float64,
-        longitude Float64,
-        altitude Float64,
-        band String,
-        rsrp Float64,
-        rsrq Float64,
-        h3_index String,
-        eventtime DateTime
-    ) ENGINE = MergeTree()
-    ORDER BY (band, h3_index)
+    CREATE TABLE IF NOT EXISTS {settings.CLICKHOUSE_DB}.ingest_manifest (
+        file_name String,
+        file_hash String,
+        file_size UInt64,
+        row_count UInt64,
+        loaded_at DateTime
+    ) ENGINE = ReplacingMergeTree(loaded_at)
+    ORDER BY file_name
     ''')
+
+    init_rollups(client)
+    check_partitioning(client)
     return client
 
 
-def load_data_to_clickhouse(client, file_path):
-    """Улучшенная загрузка данных с проверками"""
-    try:
-        # 1. Чтение файла
-        print(f"Чтение файла: {file_path}")
-        df = pd.read_excel(file_path)
-        print(f"Прочитано строк: {len(df)}")
-        print("Колонки в файле:", df.columns.tolist())
-
-        # 2. Обработка числовых колонок
-        numeric_cols = ['vbw', 'servingcellrsrp', 'servingcellrsrq']
-        for col in numeric_cols:
-            if col in df.columns:
-                print(f"Обработка колонки {col}, тип: {df[col].dtype}")
-                if df[col].dtype == object:
-                    df[col] = df[col].astype(str).str.replace(',', '.').astype(float)
-                else:
-                    df[col] = df[col].astype(float)
-                print(f"После преобразования - тип: {df[col].dtype}")
-
-        # 3. Переименование колонок
-        rename_map = {
-            'servingcellrsrp': 'rsrp',
-            'servingcellrsrq': 'rsrq',
-            'height': 'altitude'
-        }
-        print("Переименование колонок:")
-        for old_name, new_name in rename_map.items():
-            if old_name in df.columns:
-                print(f"  {old_name} -> {new_name}")
-                df.rename(columns={old_name: new_name}, inplace=True)
-
-        # 4. Добавление H3 индекса
-        if 'latitude' in df.columns and 'longitude' in df.columns:
-            print("Добавление H3 индексов...")
-            df['h3_index'] = df.apply(
-                lambda row: h3.latlng_to_cell(row['latitude'], row['longitude'], 8),
-                axis=1
-            )
-        else:
-            raise ValueError("Отсутствуют колонки latitude или longitude")
-
-        # 5. Подготовка к загрузке
-        columns_to_load = [
-            'latitude', 'longitude', 'altitude', 'band',
-            'rsrp', 'rsrq', 'h3_index', 'eventtime'
-        ]
-        existing_columns = [col for col in columns_to_load if col in df.columns]
-        missing_columns = [col for col in columns_to_load if col not in df.columns]
-        df['eventtime'] = pd.to_datetime(df['eventtime'])
-        print(df['eventtime'].dtype)
-
-        print("Колонки для загрузки:", existing_columns)
-        print("Отсутствующие колонки:", missing_columns)
-
-        if not existing_columns:
-            raise ValueError("Нет колонок для загрузки")
-
-        # 6. Загрузка данных
-        print(f"Загрузка {len(df)} строк в ClickHouse...")
-        data_to_insert = df[existing_columns].to_dict('records')
-
-        # Проверка первых 2 строк
-        print("Пример данных для вставки (первые 2 строки):")
-        for row in data_to_insert[:2]:
-            print(row)
+def check_partitioning(client):
+    """Предупреждает о таблицах, созданных до разбиения на партиции по месяцам.
+
+    Ключ партиционирования существующей таблицы не меняется через ALTER,
+    поэтому такие таблицы работают, но запросы по времени читают их целиком.
+    """
+    rows = client.execute(
+        "SELECT name FROM system.tables "
+        "WHERE database = %(db)s AND name IN %(tables)s AND partition_key = ''",
+        {'db': settings.CLICKHOUSE_DB, 'tables': ('coverage_data', 'coverage_h3_rollup')}
+    )
+    for (name,) in rows:
+        print(f"Таблица {name} создана без партиций по месяцам: отбор по времени будет читать её целиком. "
+              f"Для разбиения таблицу нужно пересоздать и перезагрузить данные")
+
+
+def get_manifest(client):
+    """Текущее состояние манифеста: {имя файла: (хеш, размер)}"""
+    rows = client.execute(f'''
+    SELECT file_name, file_hash, file_size
+    FROM {settings.CLICKHOUSE_DB}.ingest_manifest FINAL
+    ''')
+    return {name: (file_hash, size) for name, file_hash, size in rows}
+
+
+def manifest_version(client):
+    """Версия данных: отпечаток содержимого манифеста (меняется при каждой загрузке)"""
+    return client.execute(f'''
+    SELECT groupBitXor(cityHash64(file_name, file_hash, loaded_at))
+    FROM {settings.CLICKHOUSE_DB}.ingest_manifest FINAL
+    ''')[0][0]
 
+
+def delete_file_rows(client, source_file):
+    """Удаляет строки, загруженные из указанного файла, и их агрегаты"""
+    for table in ('coverage_data', 'coverage_h3_rollup'):
         client.execute(
-            f'INSERT INTO {settings.CLICKHOUSE_DB}.coverage_data ({", ".join(existing_columns)}) VALUES',
-            data_to_insert
+            f'ALTER TABLE {settings.CLICKHOUSE_DB}.{table} DELETE WHERE source_file = %(source_file)s',
+            {'source_file': source_file},
+            settings={'mutations_sync': 2}
         )
 
-        print("Загрузка завершена успешно!")
-        return True
+
+def has_file_rows(client, source_file):
+    return client.execute(
+        f'SELECT count() FROM {settings.CLICKHOUSE_DB}.coverage_data WHERE source_file = %(source_file)s',
+        {'source_file': source_file}
+    )[0][0] > 0
+
+
+def ingest_file(client, file_path, manifest=None, progress=None):
+    """Идемпотентная загрузка файла с заменой ранее загруженной версии.
+
+    progress - необязательная функция, которой передаётся число строк каждого
+    вставленного блока. Возвращает количество загруженных строк или None,
+    если файл не изменился.
+    """
+    file_path = Path(file_path)
+    manifest = get_manifest(client) if manifest is None else manifest
+    file_hash, file_size = file_fingerprint(file_path)
+
+    if manifest.get(file_path.name) == (file_hash, file_size):
+        print(f"Файл уже загружен, пропуск: {file_path.name}")
+        return None
+
+    if not manifest:
+        # Строки, загруженные до появления манифеста, дублировались при каждом старте
+        print("Манифест пуст: удаление строк, загруженных без манифеста")
+        delete_file_rows(client, '')
+    if file_path.name in manifest:
+        print(f"Файл изменился, замена данных: {file_path.name}")
+        delete_file_rows(client, file_path.name)
+    elif has_file_rows(client, file_path.name):
+        # Загрузка была прервана до записи в манифест (остановка приложения)
+        print(f"Удаление строк прерванной загрузки: {file_path.name}")
+        delete_file_rows(client, file_path.name)
+
+    row_count = load_data_to_clickhouse(client, file_path, progress=progress)
+
+    client.execute(
+        f'INSERT INTO {settings.CLICKHOUSE_DB}.ingest_manifest '
+        f'(file_name, file_hash, file_size, row_count, loaded_at) VALUES',
+        [(file_path.name, file_hash, file_size, row_count, datetime.now().replace(microsecond=0))]
+    )
+    manifest[file_path.name] = (file_hash, file_size)
+    return row_count
+
+
+def load_data_to_clickhouse(client, file_path, chunk_rows=None, source_file=None, progress=None):
+    """Потоковая загрузка файла (xlsx, csv, parquet) колоночными блоками.
+
+    Строки помечаются именем файла (source_file), чтобы их можно было заменить.
+    progress(rows) вызывается после вставки каждого блока.
+    Возвращает количество загруженных строк.
+    """
+    chunk_rows = chunk_rows or settings.INGEST_CHUNK_ROWS
+    source_file = source_file or Path(file_path).name
+    # Таблица в прежней схеме (до schema_migration) хранит h3_index строкой
+    legacy_h3_index = column_types(client).get('h3_index') == 'String'
+    try:
+        print(f"Чтение файла: {file_path} (блоки по {chunk_rows} строк)")
+        started = time.perf_counter()
+        total_rows = 0
+
+        for chunk_number, raw_chunk in enumerate(read_chunks(file_path, chunk_rows), start=1):
+            if chunk_number == 1:
+                print("Колонки в файле:", raw_chunk.columns.tolist())
+
+            chunk = prepare_chunk(raw_chunk)
+            if chunk.empty:
+                continue
+            chunk['source_file'] = source_file
+            if legacy_h3_index:
+                chunk['h3_index'] = cells_to_strings(chunk['h3_index'].to_numpy())
+            if chunk_number == 1:
+                missing_columns = [col for col in columns_to_load() if col not in chunk.columns]
+                print("Колонки для загрузки:", chunk.columns.tolist())
+                print("Отсутствующие колонки:", missing_columns)
+
+            # Колоночная вставка numpy-массивов без построения словарей по строкам
+            client.insert_dataframe(
+                f'INSERT INTO {settings.CLICKHOUSE_DB}.coverage_data ({", ".join(chunk.columns)}) VALUES',
+                chunk,
+                settings={'use_numpy': True}
+            )
+            total_rows += len(chunk)
+            if progress is not None:
+                progress(len(chunk))
+
+            elapsed = time.perf_counter() - started
+            print(f"  блок {chunk_number}: {len(chunk)} строк, всего {total_rows} "
+                  f"({total_rows / elapsed:,.0f} строк/с)")
+
+        elapsed = time.perf_counter() - started
+        rate = total_rows / elapsed if elapsed > 0 else 0
+        print(f"Загрузка завершена успешно: {total_rows} строк за {elapsed:.1f} с ({rate:,.0f} строк/с)")
+        return total_rows
 
     except Exception as e:
         print(f"Ошибка при загрузке данных: {str(e)}")
         raise
-
-
@@ -1,8 +1,12 @@
 import uvicorn
 from fastapi import FastAPI
-from app.database import init_database, load_data_to_clickhouse
+from app.database import close_pool, init_pool
 from app.config import settings
 from app.api.router import router as api_router
+from app.services.ingest_job import start_ingest_job, stop_ingest_job
+from app.services.metrics_service import metrics_middleware
+from app.services.render_service import init_render_executor, shutdown_render_executor
+import argparse
 import os
 from pathlib import Path
 
@@ -10,44 +14,68 @@ from pathlib import Path
 app = FastAPI()
 
 
-def initialize_app():
-    """Инициализация приложения"""
-    print("🔄 Инициализация приложения...")
-
-    # Инициализация базы данных
-    try:
-        client = init_database()
-        if settings.DATA_FILE.exists():
-            print(f"📂 Загрузка данных из {settings.DATA_FILE}")
-            load_data_to_clickhouse(client, settings.DATA_FILE)
-        else:
-            print(f"⚠️ Файл данных не найден: {settings.DATA_FILE}")
-    except Exception as e:
-        print(f"❌ Ошибка инициализации БД: {e}")
-        raise
-
-
 # Подключение роутеров
 app.include_router(api_router)
+# Фазы обработки запросов, заголовок Server-Timing и метрики для /metrics
+app.middleware("http")(metrics_middleware)
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Действия при запуске приложения"""
-    initialize_app()
-    print("✅ Приложение готово к работе")
+    """Действия при запуске приложения.
+
+    Инициализация БД и загрузка данных идут в фоне (готовность - /readyz),
+    процессы отрисовки запускаются при первой отрисовке.
+    """
+    start_ingest_job()
+    pool = init_pool()
+    print(f"🔌 Пул соединений ClickHouse создан (размер {pool.size})")
+    render_executor = init_render_executor()
+    print(f"🖼️ Пул отрисовки создан ({render_executor.workers} процессов)")
+    print("✅ Приложение принимает запросы, загрузка данных идёт в фоне")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Закрытие соединений при остановке"""
+    stop_ingest_job()
+    close_pool()
+    shutdown_render_executor()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сервер карт покрытия LTE")
+    parser.add_argument("--production", action="store_true", default=settings.SERVER_MODE == "production",
+                        help="несколько процессов uvicorn без перезагрузки (SERVER_MODE=production)")
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS,
+                        help="число процессов uvicorn в режиме production (WEB_WORKERS)")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    args = parser.parse_args()
+
     # Определяем корневую директорию проекта
     BASE_DIR = Path(__file__).resolve().parent.parent
     os.chdir(BASE_DIR)
 
-    # Конфигурация Uvicorn
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
+    # Конфигурация Uvicorn: в разработке - один процесс с перезагрузкой при изменении кода,
+    # в production - args.workers процессов (кеши карт и версия данных общие, на диске)
+    if args.production:
+        # Процессы uvicorn заново читают настройки: RENDER_WORKERS делится между ними
+        os.environ["SERVER_MODE"] = "production"
+        os.environ["WEB_WORKERS"] = str(max(1, args.workers))
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            workers=max(1, args.workers),
+            reload=False,
+            log_level="info"
+        )
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            reload=True,
+            log_level="info"
+        )
@@ -1,15 +1,24 @@
 from datetime import datetime
+from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class AreaRequest(BaseModel):
     min_lat: float
     max_lat: float
     min_lon: float
     max_lon: float
+    # Явное разрешение H3; иначе выбирается по размеру области
+    resolution: Optional[int] = None
+    # Размер пикселя карты клиента в метрах (ограничивает детализацию)
+    pixel_size: Optional[float] = None
+    # Необязательный интервал по eventtime: [from, to)
+    time_from: Optional[datetime] = Field(None, alias='from')
+    time_to: Optional[datetime] = Field(None, alias='to')
 
 class CoverageResponse(BaseModel):
     map_image: str
+    resolution: Optional[int] = None
 
 class CoveragePoint(BaseModel):
     latitude: float
@@ -0,0 +1,159 @@
+"""Перенос coverage_data в компактную схему (database.coverage_data_ddl).
+
+Данные копируются по месяцам в новую таблицу, пока старая продолжает
+обслуживать запросы; затем таблицы переименовываются, а материализованные
+представления агрегатов пересоздаются. До и после переноса выводятся объём
+таблицы на диске и время полного сканирования.
+
+Запуск: python -m app.schema_migration [--drop-old] [--runs 5]
+Во время переноса загрузка новых файлов (старт приложения) выполняться не должна.
+"""
+import argparse
+import statistics
+import time
+
+from app.config import settings
+from app.database import coverage_data_ddl, column_types, get_clickhouse_client, init_rollups
+
+TABLE = 'coverage_data'
+NEW_TABLE = 'coverage_data_compact'
+OLD_TABLE = 'coverage_data_legacy'
+
+# Запрос, читающий колонки, которые используют эндпоинты
+SCAN_QUERY = f'''
+SELECT band, count(), avg(rsrp), avg(rsrq), avg(latitude), avg(longitude), max(eventtime), uniq(h3_index)
+FROM {settings.CLICKHOUSE_DB}.{TABLE}
+GROUP BY band
+'''
+
+
+def is_compact(types):
+    return types.get('h3_index') == 'UInt64' and types.get('band', '').startswith('LowCardinality')
+
+
+def table_size(client, table):
+    """Строки, байты на диске и несжатый объём активных кусков таблицы"""
+    rows, on_disk, uncompressed = client.execute(
+        'SELECT sum(rows), sum(bytes_on_disk), sum(data_uncompressed_bytes) FROM system.parts '
+        'WHERE database = %(db)s AND table = %(table)s AND active',
+        {'db': settings.CLICKHOUSE_DB, 'table': table}
+    )[0]
+    columns = client.execute(
+        'SELECT name, type, data_compressed_bytes FROM system.columns '
+        'WHERE database = %(db)s AND table = %(table)s ORDER BY data_compressed_bytes DESC',
+        {'db': settings.CLICKHOUSE_DB, 'table': table}
+    )
+    return {'rows': rows, 'bytes_on_disk': on_disk, 'uncompressed_bytes': uncompressed, 'columns': columns}
+
+
+def scan_latency(client, runs):
+    """Медиана времени сканирования (с) и прочитанный объём (байт) без кеша несжатых блоков"""
+    timings = []
+    read_bytes = 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        client.execute(SCAN_QUERY, settings={'use_uncompressed_cache': 0})
+        timings.append(time.perf_counter() - started)
+        read_bytes = client.last_query.progress.bytes
+    return statistics.median(timings), read_bytes
+
+
+def format_bytes(value):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if abs(value) < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} ТБ'
+
+
+def print_report(title, size, latency, read_bytes):
+    print(f"\n{title}")
+    print(f"  строк: {size['rows']:,}")
+    print(f"  на диске: {format_bytes(size['bytes_on_disk'])}, без сжатия: {format_bytes(size['uncompressed_bytes'])}")
+    print(f"  сканирование: {latency * 1000:.0f} мс, прочитано {format_bytes(read_bytes)}")
+    for name, column_type, compressed in size['columns']:
+        print(f"    {name:<14} {column_type:<40} {format_bytes(compressed)}")
+
+
+def copy_expression(name, types):
+    """Выражение SELECT для колонки новой таблицы"""
+    if name == 'h3_index' and types.get('h3_index') == 'String':
+        return "if(h3_index = '', toUInt64(0), stringToH3(h3_index)) AS h3_index"
+    return name
+
+
+def migrate(drop_old=False, runs=5):
+    client = get_clickhouse_client()
+    db = settings.CLICKHOUSE_DB
+
+    types = column_types(client, TABLE)
+    if not types:
+        print(f"Таблица {TABLE} не найдена: компактная схема будет создана при старте приложения")
+        return
+
+    before = table_size(client, TABLE)
+    before_latency, before_read = scan_latency(client, runs)
+    print_report("До переноса", before, before_latency, before_read)
+
+    if is_compact(types):
+        print("\nТаблица уже в компактной схеме, перенос не требуется")
+        return
+    if column_types(client, OLD_TABLE):
+        raise RuntimeError(f"Таблица {OLD_TABLE} уже существует (предыдущий перенос): удалите её перед повторным запуском")
+
+    # Новая таблица; остатки прерванного переноса удаляются
+    client.execute(f'DROP TABLE IF EXISTS {db}.{NEW_TABLE}')
+    client.execute(coverage_data_ddl(NEW_TABLE))
+    columns = list(column_types(client, NEW_TABLE))
+    select = ', '.join(copy_expression(name, types) for name in columns)
+
+    months = [row[0] for row in client.execute(
+        f'SELECT DISTINCT toYYYYMM(eventtime) AS month FROM {db}.{TABLE} ORDER BY month'
+    )]
+    started = time.perf_counter()
+    for month in months:
+        client.execute(
+            f'INSERT INTO {db}.{NEW_TABLE} ({", ".join(columns)}) '
+            f'SELECT {select} FROM {db}.{TABLE} WHERE toYYYYMM(eventtime) = %(month)s',
+            {'month': month}
+        )
+        print(f"  скопирован месяц {month}")
+    print(f"Копирование завершено за {time.perf_counter() - started:.1f} с")
+
+    old_rows = client.execute(f'SELECT count() FROM {db}.{TABLE}')[0][0]
+    new_rows = client.execute(f'SELECT count() FROM {db}.{NEW_TABLE}')[0][0]
+    if old_rows != new_rows:
+        raise RuntimeError(f"Число строк не совпадает: {old_rows} -> {new_rows}, таблицы не переключены")
+
+    # Представления привязаны к исходной таблице: пересоздаются после переименования
+    for res in settings.H3_RESOLUTIONS:
+        client.execute(f'DROP VIEW IF EXISTS {db}.coverage_h3_rollup_mv_r{res}')
+    client.execute(f'RENAME TABLE {db}.{TABLE} TO {db}.{OLD_TABLE}, {db}.{NEW_TABLE} TO {db}.{TABLE}')
+    init_rollups(client)
+    client.execute(f'OPTIMIZE TABLE {db}.{TABLE} FINAL')
+
+    after = table_size(client, TABLE)
+    after_latency, after_read = scan_latency(client, runs)
+    print_report("После переноса", after, after_latency, after_read)
+
+    ratio = before['bytes_on_disk'] / after['bytes_on_disk'] if after['bytes_on_disk'] else 0
+    print(f"\nОбъём на диске: {format_bytes(before['bytes_on_disk'])} -> {format_bytes(after['bytes_on_disk'])} "
+          f"(в {ratio:.1f} раза меньше), сканирование: {before_latency * 1000:.0f} -> {after_latency * 1000:.0f} мс")
+
+    if drop_old:
+        client.execute(f'DROP TABLE {db}.{OLD_TABLE}')
+        print(f"Таблица {OLD_TABLE} удалена")
+    else:
+        print(f"Прежние данные сохранены в {OLD_TABLE} (удаление: --drop-old или DROP TABLE)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос coverage_data в компактную схему")
+    parser.add_argument('--drop-old', action='store_true', help="удалить прежнюю таблицу после переноса")
+    parser.add_argument('--runs', type=int, default=5, help="число повторов сканирования для замера")
+    args = parser.parse_args()
+    migrate(drop_old=args.drop_old, runs=args.runs)
+
+
+if __name__ == '__main__':
+    main()
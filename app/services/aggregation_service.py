@@ -0,0 +1,279 @@
+"""Агрегация измерений по H3 ячейкам на стороне ClickHouse"""
+from functools import lru_cache
+
+import pandas as pd
+
+from app.config import settings
+from app.database import execute, iter_column_blocks
+from app.services.h3_service import h3_column
+from app.services.metrics_service import timed
+from app.services.spatial_service import coverage_bbox_condition, h3_range_condition
+
+# Метрика карты -> колонка результата агрегации
+METRICS = {
+    'rsrp': 'avg_rsrp',
+    'rsrq': 'avg_rsrq',
+    'count': 'point_count',
+}
+
+# Колонки результата hex_aggregates_query в порядке SELECT (центр масс ячейки
+# в запросе называется centroid_lat/centroid_lon: псевдонимы в ClickHouse видны
+# во всём запросе и не должны совпадать с колонками, по которым отбирается WHERE)
+HEX_AGGREGATE_COLUMNS = (
+    'band', 'cell', 'point_count', 'avg_rsrp', 'avg_rsrq', 'median_rsrp', 'latitude', 'longitude'
+)
+
+
+@timed('dataframe')
+def rows_to_frame(data, columns_with_types, names=None):
+    """DataFrame из колоночного результата clickhouse-driver (names - другие имена колонок)"""
+    names = list(names or (name for name, _ in columns_with_types))
+    return pd.DataFrame({
+        name: data[i] if data else [] for i, name in enumerate(names)
+    }, columns=names)
+
+
+def bbox_params(bbox):
+    min_lat, max_lat, min_lon, max_lon = bbox
+    return {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+
+
+def time_params(time_range):
+    """Параметры и условие отбора по времени: [from, to), любая граница может отсутствовать"""
+    time_from, time_to = time_range or (None, None)
+    conditions, params = [], {}
+    if time_from is not None:
+        conditions.append('{column} >= %(time_from)s')
+        params['time_from'] = time_from
+    if time_to is not None:
+        conditions.append('{column} < %(time_to)s')
+        params['time_to'] = time_to
+    return ' AND '.join(conditions), params
+
+
+@lru_cache(maxsize=1)
+def server_timezone():
+    """Часовой пояс сервера ClickHouse: в нём toStartOfDay делит агрегаты на сутки"""
+    from zoneinfo import ZoneInfo
+
+    return ZoneInfo(execute('SELECT timezone()')[0][0])
+
+
+def server_time_range(time_range):
+    """Интервал во времени сервера (без часового пояса).
+
+    Границы с часовым поясом clickhouse-driver всё равно переводит в пояс
+    сервера, а границы суток агрегатов - тоже в поясе сервера: после перевода
+    _day_aligned проверяет ту же полночь, что и toStartOfDay.
+    """
+    if time_range is None or all(value is None or value.tzinfo is None for value in time_range):
+        return time_range
+    tz = server_timezone()
+    return tuple(
+        value.astimezone(tz).replace(tzinfo=None) if value is not None and value.tzinfo is not None else value
+        for value in time_range
+    )
+
+
+def _day_aligned(time_range):
+    """Границы совпадают с началом суток - интервал выражается дневными агрегатами"""
+    return all(
+        value is None or value == value.replace(hour=0, minute=0, second=0, microsecond=0)
+        for value in (time_range or (None, None))
+    )
+
+
+def _time_filter(column, time_range):
+    condition, params = time_params(time_range)
+    return (f' AND {condition.format(column=column)}' if condition else ''), params
+
+
+def _keyset_filter(cell_column, after, params):
+    """Условие "после курсора" по ключу (band, ячейка) для постраничной выборки"""
+    if after is None:
+        return ''
+    params['after_band'], params['after_cell'] = after
+    return f' AND (band > %(after_band)s OR (band = %(after_band)s AND {cell_column} > %(after_cell)s))'
+
+
+def hex_aggregates_query(resolution, bands=None, bbox=None, time_range=None, after=None):
+    """Запрос агрегатов по парам (band, ячейка H3) и его параметры.
+
+    bands - диапазоны; None - все диапазоны таблицы.
+    after - необязательный курсор (band, cell): отбираются только пары после него
+    в порядке (band, cell). Условие стоит в WHERE, поэтому для агрегатов оно
+    сужает чтение по первичному ключу. Остальные параметры - как у get_hex_aggregates.
+    """
+    if resolution not in settings.H3_RESOLUTIONS:
+        raise ValueError(f"Разрешение {resolution} не индексируется при загрузке")
+    time_range = server_time_range(time_range)
+
+    params = {'resolution': resolution}
+    band_filter = ''
+    if bands is not None:
+        band_filter = ' AND band IN %(bands)s'
+        params['bands'] = tuple(bands)
+    bbox_filter = ''
+    if bbox is not None:
+        bbox_filter = '''
+    HAVING centroid_lat BETWEEN %(min_lat)s AND %(max_lat)s
+    AND centroid_lon BETWEEN %(min_lon)s AND %(max_lon)s'''
+        params.update(bbox_params(bbox))
+
+    if _day_aligned(time_range):
+        time_filter, time_values = _time_filter('bucket', time_range)
+        # Небольшая область сужается диапазонами H3 в первичном ключе, HAVING уточняет отбор
+        condition = h3_range_condition(bbox, 'h3', resolution) if bbox is not None else None
+        rollup_spatial = f' AND {condition}' if condition else ''
+        keyset_filter = _keyset_filter('h3', after, params)
+        query = f'''
+    SELECT
+        band,
+        h3 AS cell,
+        sum(sample_count) AS point_count,
+        sum(sum_rsrp) / point_count AS avg_rsrp,
+        sum(sum_rsrq) / point_count AS avg_rsrq,
+        quantilesMerge(0.1, 0.5, 0.9)(rsrp_quantiles)[2] AS median_rsrp,
+        sum(sum_latitude) / point_count AS centroid_lat,
+        sum(sum_longitude) / point_count AS centroid_lon
+    FROM {settings.CLICKHOUSE_DB}.coverage_h3_rollup
+    WHERE resolution = %(resolution)s{band_filter}{rollup_spatial}{time_filter}{keyset_filter}
+    GROUP BY band, cell{bbox_filter}
+    '''
+    else:
+        time_filter, time_values = _time_filter('eventtime', time_range)
+        raw_spatial = ''
+        if bbox is not None:
+            # Небольшая область - диапазоны H3 в первичном ключе; большая (или строковый
+            # h3_index) - условие по широте/долготе точек для minmax-индексов пропуска
+            raw_spatial = coverage_bbox_condition(bbox, min(resolution, 8)) or '''
+    AND latitude BETWEEN %(min_lat)s AND %(max_lat)s
+    AND longitude BETWEEN %(min_lon)s AND %(max_lon)s'''
+        keyset_filter = _keyset_filter(h3_column(resolution), after, params)
+        query = f'''
+    SELECT
+        band,
+        {h3_column(resolution)} AS cell,
+        count() AS point_count,
+        avg(rsrp) AS avg_rsrp,
+        avg(rsrq) AS avg_rsrq,
+        quantile(0.5)(rsrp) AS median_rsrp,
+        avg(latitude) AS centroid_lat,
+        avg(longitude) AS centroid_lon
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    WHERE 1{band_filter}{raw_spatial}{time_filter}{keyset_filter}
+    GROUP BY band, cell{bbox_filter}
+    '''
+    params.update(time_values)
+    return query, params
+
+
+def get_hex_aggregates(resolution, bands=None, bbox=None, time_range=None):
+    """Количество точек, средние и медиана RSRP/RSRQ по каждой паре (band, ячейка H3).
+
+    Читается агрегированная таблица coverage_h3_rollup, а не сырые измерения.
+    bbox - необязательная область (min_lat, max_lat, min_lon, max_lon),
+    ячейка попадает в область по центру масс своих измерений; небольшие области
+    дополнительно сужаются по первичному ключу (spatial_service).
+    time_range - необязательный интервал (from, to) по eventtime; если границы не
+    совпадают с началом суток, агрегаты считаются по coverage_data. Обе таблицы
+    разбиты на партиции по месяцам, поэтому читаются только нужные партиции.
+    bands - диапазоны (по умолчанию settings.BANDS).
+    """
+    query, params = hex_aggregates_query(resolution, tuple(bands or settings.BANDS), bbox, time_range)
+    data, columns_with_types = execute(
+        query, params,
+        columnar=True, with_column_types=True
+    )
+    return rows_to_frame(data, columns_with_types, HEX_AGGREGATE_COLUMNS)
+
+
+def iter_hex_aggregates(resolution, bands=None, bbox=None, time_range=None, after=None, limit=None):
+    """Агрегаты по блокам в порядке (band, cell): словари колонок HEX_AGGREGATE_COLUMNS.
+
+    Блоки читаются по мере поступления от ClickHouse, в памяти держится один блок.
+    bands - диапазоны; None - все диапазоны таблицы (в отличие от get_hex_aggregates).
+    after/limit - курсор и размер страницы; следующая страница начинается
+    после последней пары (band, cell) текущей.
+    """
+    query, params = hex_aggregates_query(resolution, bands, bbox, time_range, after)
+    query += 'ORDER BY band, cell\n'
+    if limit is not None:
+        query += f'    LIMIT {int(limit)}\n'
+    # Ключ агрегатов начинается с (resolution, band, h3) - группы готовы по мере чтения,
+    # и сортировка не требует всего результата
+    query_settings = {
+        'optimize_aggregation_in_order': 1,
+        'max_block_size': settings.STREAM_BLOCK_ROWS,
+    }
+    for columns in iter_column_blocks(query, params, query_settings):
+        yield dict(zip(HEX_AGGREGATE_COLUMNS, columns))
+
+
+# Шаг временного ряда -> функция округления времени в ClickHouse
+TIME_INTERVALS = {
+    'hour': 'toStartOfHour',
+    'day': 'toStartOfDay',
+    'week': 'toMonday',
+    'month': 'toStartOfMonth',
+}
+
+
+def get_time_series(interval='day', bands=None, cell=None, time_range=None):
+    """Временной ряд по диапазонам: число измерений и средние RSRP/RSRQ на шаг interval.
+
+    cell - необязательная ячейка H3 (int) одного из индексируемых разрешений.
+    Шаги от суток считаются по дневным агрегатам (ключ сортировки агрегатов
+    начинается с resolution, band, h3 - выборка по ячейке читает несколько гранул),
+    почасовой ряд и интервалы не по границе суток - по coverage_data.
+    """
+    round_time = TIME_INTERVALS[interval]
+    time_range = server_time_range(time_range)
+    params = {'bands': tuple(bands or settings.BANDS)}
+    resolution = settings.H3_RESOLUTIONS[0]
+    if cell is not None:
+        import h3.api.basic_int as h3
+
+        resolution = h3.get_resolution(cell)
+        if resolution not in settings.H3_RESOLUTIONS:
+            raise ValueError(f"Разрешение {resolution} не индексируется при загрузке")
+        params['cell'] = cell
+
+    if interval != 'hour' and _day_aligned(time_range):
+        time_filter, time_values = _time_filter('bucket', time_range)
+        cell_filter = ' AND h3 = %(cell)s' if cell is not None else ''
+        params['resolution'] = resolution
+        query = f'''
+    SELECT
+        toDateTime({round_time}(bucket)) AS time,
+        band,
+        sum(sample_count) AS point_count,
+        sum(sum_rsrp) / point_count AS avg_rsrp,
+        sum(sum_rsrq) / point_count AS avg_rsrq
+    FROM {settings.CLICKHOUSE_DB}.coverage_h3_rollup
+    WHERE resolution = %(resolution)s AND band IN %(bands)s{cell_filter}{time_filter}
+    GROUP BY time, band
+    ORDER BY time, band
+    '''
+    else:
+        time_filter, time_values = _time_filter('eventtime', time_range)
+        cell_filter = f' AND {h3_column(resolution)} = %(cell)s' if cell is not None else ''
+        query = f'''
+    SELECT
+        toDateTime({round_time}(eventtime)) AS time,
+        band,
+        count() AS point_count,
+        avg(rsrp) AS avg_rsrp,
+        avg(rsrq) AS avg_rsrq
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    WHERE band IN %(bands)s{cell_filter}{time_filter}
+    GROUP BY time, band
+    ORDER BY time, band
+    '''
+    params.update(time_values)
+
+    data, columns_with_types = execute(
+        query, params,
+        columnar=True, with_column_types=True
+    )
+    return rows_to_frame(data, columns_with_types)
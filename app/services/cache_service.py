@@ -0,0 +1,301 @@
+"""Кеш отрисованных карт и версия данных для его инвалидации.
+
+Версия данных хранится в файле DATA_VERSION_FILE, поэтому её видят все
+процессы uvicorn: процесс, загрузивший данные, записывает версию, остальные
+замечают замену файла и сбрасывают свои кеши. Отрисованные карты кешируются
+в памяти процесса и в общем дисковом кеше (каталог на версию данных).
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from fastapi import Response
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+
+_data_version = 0
+# Отпечаток файла версии (inode, mtime), по которому она была прочитана
+_version_stamp = None
+_version_lock = threading.Lock()
+
+
+def _version_file_stamp():
+    try:
+        stat = settings.DATA_VERSION_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_data_version():
+    """Текущая версия данных (перечитывается, если файл версии заменён другим процессом)"""
+    global _data_version, _version_stamp
+    stamp = _version_file_stamp()
+    if stamp is None or stamp == _version_stamp:
+        return _data_version
+    with _version_lock:
+        try:
+            version = int(settings.DATA_VERSION_FILE.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return _data_version
+        _version_stamp = stamp
+        changed = version != _data_version
+        _data_version = version
+    if changed:
+        render_cache.clear()
+    return version
+
+
+def set_data_version(version):
+    """Устанавливает версию данных для всех процессов; при изменении кеш отрисовки очищается"""
+    global _data_version, _version_stamp
+    with _version_lock:
+        write_atomic(settings.DATA_VERSION_FILE, str(version).encode('utf-8'))
+        _version_stamp = _version_file_stamp()
+        if version == _data_version:
+            return
+        _data_version = version
+    render_cache.clear()
+
+
+@contextmanager
+def file_lock(path):
+    """Межпроцессная блокировка (flock) на время блока: процессы uvicorn ждут друг друга.
+
+    Без fcntl (Windows) блокировка не берётся - там сервер работает одним процессом.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomic(path, data):
+    """Атомарная запись файла через временный файл и os.replace: параллельные
+    запросы и другие процессы не видят недописанный файл"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class RenderCache:
+    """LRU-кеш байтовых ответов с ограничением суммарного размера"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+render_cache = RenderCache(settings.RENDER_CACHE_MAX_BYTES)
+
+
+class DiskCache:
+    """Общий для процессов кеш байтовых ответов на диске.
+
+    Ключ заканчивается версией данных (cache_key): файлы каждой версии лежат
+    в своём каталоге и удаляются целиком после смены версии. При превышении
+    max_bytes удаляются давно не использованные файлы (время изменения
+    обновляется при чтении).
+    """
+
+    # Проверка размера каталога - раз в столько записей процесса
+    PRUNE_EVERY = 64
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return self.directory / str(key[-1]) / digest[:2] / digest
+
+    def get(self, key):
+        if self.max_bytes <= 0:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        write_atomic(self._path(key), value)
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Удаляет самые старые файлы, пока объём кеша больше max_bytes"""
+        entries = []
+        for path in self.directory.rglob('*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def purge_stale(self, version):
+        """Удаляет записи всех версий данных, кроме текущей"""
+        if not self.directory.is_dir():
+            return
+        for entry in self.directory.iterdir():
+            if entry.is_dir() and entry.name != str(version):
+                shutil.rmtree(entry, ignore_errors=True)
+
+
+disk_cache = DiskCache(settings.RENDER_CACHE_DIR, settings.RENDER_DISK_CACHE_MAX_BYTES)
+
+
+class VersionedCache:
+    """Результаты вычислений, действительные до смены версии данных"""
+
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self._version = None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """Значение из кеша или результат compute() для текущей версии данных"""
+        version = get_data_version()
+        with self._lock:
+            if version != self._version:
+                self._items.clear()
+                self._version = version
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                return value
+
+        value = compute()
+        with self._lock:
+            if version == self._version:
+                self._items[key] = value
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+        return value
+
+
+def cache_key(*parts):
+    """Ключ кеша: параметры запроса + текущая версия данных"""
+    return parts + (get_data_version(),)
+
+
+def make_etag(key):
+    return '"' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20] + '"'
+
+
+def not_modified(request, etag):
+    """Ответ 304, если клиент уже имеет версию с этим ETag, иначе None"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return None
+    candidates = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    if etag in candidates or '*' in candidates:
+        return Response(status_code=304, headers={'ETag': etag})
+    return None
+
+
+def set_cache_headers(response, etag):
+    """ETag и требование перепроверки, чтобы браузер присылал If-None-Match"""
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+
+
+# Отрисовки, которые выполняются сейчас: {ключ: задача}
+_in_flight = {}
+
+
+async def _load(key, render):
+    cached = await run_in_threadpool(disk_cache.get, key)
+    if cached is not None:
+        render_cache.put(key, cached)
+        return cached
+    body = await render()
+    render_cache.put(key, body)
+    await run_in_threadpool(disk_cache.put, key, body)
+    return body
+
+
+async def get_or_render(key, render):
+    """Возвращает байты из кеша (памяти процесса, затем общего дискового) или
+    вызывает корутину render() и кеширует результат на обоих уровнях.
+
+    Одновременные промахи по одному ключу (например, сразу после смены версии
+    данных) ждут одну отрисовку, а не запускают свою. Задача защищена от отмены:
+    отключение первого клиента не прерывает отрисовку для остальных.
+    """
+    cached = render_cache.get(key)
+    if cached is not None:
+        return cached
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load(key, render))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await asyncio.shield(task)
@@ -1,96 +1,163 @@
-import base64
+"""Кластеры покрытия: связные области соседних ячеек H3.
+
+Кластер - компонента связности графа, в котором вершины - ячейки с измерениями
+диапазона (при необходимости отфильтрованные по RSRP), а ребра соединяют
+соседние по сетке H3 ячейки. Работает по агрегатам, поэтому учитывает все
+измерения, а не выборку.
+"""
 from io import BytesIO
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.spatial import ConvexHull
-from matplotlib.patches import Polygon
-from matplotlib.lines import Line2D
-
-from app.database import get_clickhouse_client
-
-
-def plot_coverage_clusters():
-    # Запрос данных из ClickHouse
-    client = get_clickhouse_client()
-    data = client.execute("""
-    SELECT latitude, longitude, band 
-    FROM lte_coverage.coverage_data
-    WHERE latitude IS NOT NULL
-    LIMIT 10000
-    """)
 
-    # Начальная точка (антенна)
-    base_station = (52.27664, 104.27792)
+from app.config import settings
+from app.services.aggregation_service import get_hex_aggregates
+from app.services.cache_service import VersionedCache
+from app.services.h3_service import neighbor_indices
+from app.services.metrics_service import phase
+
+# Базовая станция (антенна)
+BASE_STATION = (52.27664, 104.27792)
+
+_clusters_cache = VersionedCache(max_items=32)
+
+
+def label_components(cells):
+    """Номер компоненты связности для каждой ячейки"""
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n = len(cells)
+    neighbors = neighbor_indices(cells, 1)
+    rows = np.repeat(np.arange(n), neighbors.shape[1])
+    cols = neighbors.ravel()
+    found = cols >= 0
+
+    graph = coo_matrix((np.ones(found.sum(), dtype=np.int8), (rows[found], cols[found])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def _band_clusters(resolution, band, min_rsrp, max_rsrp, min_cells):
+    import h3.api.basic_int as h3
+
+    cells = get_hex_aggregates(resolution, (band,))
+    if min_rsrp is not None:
+        cells = cells[cells['avg_rsrp'] >= min_rsrp]
+    if max_rsrp is not None:
+        cells = cells[cells['avg_rsrp'] <= max_rsrp]
+    if cells.empty:
+        return []
+
+    cells = cells.assign(
+        cluster=label_components(cells['cell'].to_numpy(dtype=np.uint64)),
+        weighted_rsrp=cells['avg_rsrp'] * cells['point_count'],
+        weighted_rsrq=cells['avg_rsrq'] * cells['point_count'],
+        weighted_lat=cells['latitude'] * cells['point_count'],
+        weighted_lon=cells['longitude'] * cells['point_count'],
+    )
+    stats = cells.groupby('cluster').agg(
+        cell_count=('cell', 'size'),
+        point_count=('point_count', 'sum'),
+        weighted_rsrp=('weighted_rsrp', 'sum'),
+        weighted_rsrq=('weighted_rsrq', 'sum'),
+        weighted_lat=('weighted_lat', 'sum'),
+        weighted_lon=('weighted_lon', 'sum'),
+        min_cell_rsrp=('avg_rsrp', 'min'),
+        max_cell_rsrp=('avg_rsrp', 'max'),
+    )
+    stats = stats[stats['cell_count'] >= min_cells]
+    members = cells.groupby('cluster')['cell'].apply(list)
+    cell_area = h3.average_hexagon_area(resolution, unit='km^2')
+
+    features = []
+    for cluster, row in stats.iterrows():
+        features.append({
+            "type": "Feature",
+            "geometry": h3.cells_to_geo([int(cell) for cell in members[cluster]]),
+            "properties": {
+                "band": band,
+                "resolution": resolution,
+                "cell_count": int(row['cell_count']),
+                "point_count": int(row['point_count']),
+                "mean_rsrp": row['weighted_rsrp'] / row['point_count'],
+                "mean_rsrq": row['weighted_rsrq'] / row['point_count'],
+                "min_cell_rsrp": row['min_cell_rsrp'],
+                "max_cell_rsrp": row['max_cell_rsrp'],
+                "centroid": [row['weighted_lon'] / row['point_count'], row['weighted_lat'] / row['point_count']],
+                "area_km2": round(row['cell_count'] * cell_area, 4),
+            }
+        })
+    return features
+
+
+def find_clusters(resolution, bands=None, min_rsrp=None, max_rsrp=None, min_cells=1):
+    """Кластеры покрытия как GeoJSON FeatureCollection (кешируется до смены данных)"""
+    bands = tuple(bands or settings.BANDS)
+
+    def compute():
+        features = []
+        for band in bands:
+            features += _band_clusters(resolution, band, min_rsrp, max_rsrp, min_cells)
+        features.sort(key=lambda feature: feature['properties']['cell_count'], reverse=True)
+        for cluster_id, feature in enumerate(features):
+            feature['properties']['cluster_id'] = cluster_id
+        return {"type": "FeatureCollection", "features": features}
+
+    return _clusters_cache.get_or_compute((resolution, bands, min_rsrp, max_rsrp, min_cells), compute)
+
+
+def _geometry_rings(geometry):
+    """Внешние контуры полигонов GeoJSON-геометрии"""
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates'][0]]
+    return [polygon[0] for polygon in geometry['coordinates']]
+
+
+def plot_coverage_clusters(feature_collection, image_format='png'):
+    """Карта кластеров покрытия с базовой станцией"""
+    from matplotlib.collections import PatchCollection
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import Polygon
 
-    # Преобразование данных
-    points = {'LTE1800': [], 'LTE2100': []}
-    for lat, lon, band in data:
-        if band in points:
-            points[band].append((lon, lat))  # (x,y)
+    colors = {'LTE1800': 'blue', 'LTE2100': 'green'}
 
-    # Создание графика
-    plt.figure(figsize=(12, 10))
+    fig = Figure(figsize=(12, 10))
+    ax = fig.subplots()
 
     # 1. Рисуем начальную точку (антенну)
-    plt.scatter(*base_station, c='red', s=100, marker='^', label='Base Station')
-
-    # 2. Рисуем точки приема
-    colors = {'LTE1800': 'blue', 'LTE2100': 'green'}
-    for band, coords in points.items():
-        if coords:
-            x, y = zip(*coords)
-            plt.scatter(x, y, c=colors[band], s=20, alpha=0.6, label=band)
-
-    # 3. Вычисляем и рисуем кластеры
-    for band, coords in points.items():
-        if len(coords) > 10:  # Минимальное количество точек для кластера
-            points_array = np.array(coords)
-
-            # Вычисляем выпуклую оболочку для кластера
-            hull = ConvexHull(points_array)
-
-            # Рисуем косые линии (штриховка)
-            poly = Polygon(
-                points_array[hull.vertices],
-                closed=True,
-                fill=False,
-                edgecolor=colors[band],
-                linestyle='--',
-                linewidth=1.5,
-                hatch='////',
-                alpha=0.4
-            )
-            plt.gca().add_patch(poly)
+    lat, lon = BASE_STATION
+    ax.scatter(lon, lat, c='red', s=100, marker='^', zorder=3)
+
+    # 2. Контуры кластеров со штриховкой
+    patches, edge_colors = [], []
+    for feature in feature_collection['features']:
+        color = colors.get(feature['properties']['band'], 'gray')
+        for ring in _geometry_rings(feature['geometry']):
+            patches.append(Polygon(np.asarray(ring), closed=True))
+            edge_colors.append(color)
+    ax.add_collection(PatchCollection(
+        patches, facecolors='none', edgecolors=edge_colors,
+        linestyles='--', linewidths=1.5, hatch='////', alpha=0.6
+    ))
 
     # Настройки графика
-    plt.title('LTE Coverage Clusters', fontsize=14)
-    plt.xlabel('Longitude', fontsize=12)
-    plt.ylabel('Latitude', fontsize=12)
-    plt.grid(True, linestyle='--', alpha=0.5)
-
-    # Автомасштабирование с учетом начальной точки
-    all_points = [base_station] + [p for coords in points.values() for p in coords]
-    x, y = zip(*all_points)
-    plt.xlim(min(x) - 0.01, max(x) + 0.01)
-    plt.ylim(min(y) - 0.01, max(y) + 0.01)
+    ax.set_title('LTE Coverage Clusters', fontsize=14)
+    ax.set_xlabel('Longitude', fontsize=12)
+    ax.set_ylabel('Latitude', fontsize=12)
+    ax.grid(True, linestyle='--', alpha=0.5)
+    ax.autoscale_view()
 
     # Легенда
     legend_elements = [
         Line2D([0], [0], marker='^', color='w', label='Base Station',
                markerfacecolor='red', markersize=10),
-        Line2D([0], [0], marker='o', color='w', label='LTE1800',
-               markerfacecolor='blue', markersize=10),
-        Line2D([0], [0], marker='o', color='w', label='LTE2100',
-               markerfacecolor='green', markersize=10),
         Line2D([0], [0], color='blue', linestyle='--', label='LTE1800 Cluster'),
         Line2D([0], [0], color='green', linestyle='--', label='LTE2100 Cluster')
     ]
-    plt.legend(handles=legend_elements, loc='upper right')
+    ax.legend(handles=legend_elements, loc='upper right')
 
-    # Сохранение
     buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', dpi=120)
-    plt.close()
-    buf.seek(0)
-    return base64.b64encode(buf.rad()).decode('utf-8')
\ No newline at end of file
+    with phase('encode'):
+        fig.savefig(buf, format=image_format, bbox_inches='tight', dpi=120)
+    return buf.getvalue()
@@ -1,23 +1,30 @@
-from app.database import get_clickhouse_client
+from app.config import settings
+from app.services.aggregation_service import get_hex_aggregates
+from app.services.spatial_service import bbox_area_km2
 
+# Минимальная ширина гексагона на изображении, пикселей
+MIN_HEX_PIXELS = 4
 
-def get_coverage_data(min_lat, max_lat, min_lon, max_lon):
-    """Получает данные покрытия из базы данных"""
-    client = get_clickhouse_client()
 
-    query = '''
-    SELECT latitude, longitude, band 
-    FROM lte_coverage.coverage_data
-    WHERE latitude BETWEEN %(min_lat)s AND %(max_lat)s
-    AND longitude BETWEEN %(min_lon)s AND %(max_lon)s
-    LIMIT 100000
-    '''
+def choose_resolution(min_lat, max_lat, min_lon, max_lon, pixel_size=None):
+    """Самое мелкое разрешение H3, при котором область покрывается не более чем
+    COVERAGE_TARGET_CELLS ячейками, а гексагон (если задан размер пикселя в метрах)
+    занимает не меньше MIN_HEX_PIXELS пикселей
+    """
+    import h3
 
-    data = client.execute(query, {
-        'min_lat': min_lat,
-        'max_lat': max_lat,
-        'min_lon': min_lon,
-        'max_lon': max_lon
-    })
+    area = bbox_area_km2(min_lat, max_lat, min_lon, max_lon)
+    resolutions = sorted(settings.H3_RESOLUTIONS)
+    chosen = resolutions[0]
+    for res in resolutions:
+        if area / h3.average_hexagon_area(res, unit='km^2') > settings.COVERAGE_TARGET_CELLS:
+            break
+        if pixel_size and 2 * h3.average_hexagon_edge_length(res, unit='m') < pixel_size * MIN_HEX_PIXELS:
+            break
+        chosen = res
+    return chosen
 
-    return data
\ No newline at end of file
+
+def get_coverage_data(min_lat, max_lat, min_lon, max_lon, resolution, time_range=None):
+    """Агрегированные ячейки H3 заданного разрешения в области (и интервале времени)"""
+    return get_hex_aggregates(resolution, bbox=(min_lat, max_lat, min_lon, max_lon), time_range=time_range)
@@ -0,0 +1,146 @@
+"""Выдача агрегатов: /coverage-data (JSON-страница, NDJSON, Arrow IPC) и
+компактный бинарный формат /coverage-hexes для отрисовки в браузере.
+
+Потоковые форматы пишут результат по блокам ClickHouse (iter_hex_aggregates),
+поэтому память сервера не зависит от размера выборки. Курсор страницы -
+строка "band:h3_index" последней полученной записи.
+"""
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+from app.services.h3_service import cells_to_strings
+from app.services.metrics_service import timed
+
+# Формат ответа -> тип содержимого
+EXPORT_MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Сигнатура бинарного формата ячеек (pack_hexes)
+HEX_PAYLOAD_MAGIC = b'H3HX'
+
+# Признак конца потока Arrow IPC: маркер продолжения и нулевая длина сообщения
+ARROW_END_OF_STREAM = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+
+def negotiate_format(requested, accept):
+    """Формат ответа: явный параметр format, иначе первый подходящий тип из Accept"""
+    if requested is not None:
+        if requested not in EXPORT_MEDIA_TYPES:
+            raise ValueError(f"Доступные форматы: {', '.join(EXPORT_MEDIA_TYPES)}")
+        return requested
+    for item in (accept or '').split(','):
+        media_type = item.split(';', 1)[0].strip()
+        for name, known in EXPORT_MEDIA_TYPES.items():
+            if media_type == known:
+                return name
+    return 'json'
+
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def encode_cursor(band, cell):
+    import h3.api.basic_int as h3
+
+    return f"{band}:{h3.int_to_str(int(cell))}"
+
+
+def parse_cursor(cursor):
+    """Курсор "band:h3_index" -> (band, cell); ValueError для некорректной строки"""
+    import h3.api.basic_int as h3
+
+    band, separator, cell = cursor.rpartition(':')
+    if not separator or not band:
+        raise ValueError("Курсор должен иметь вид band:h3_index")
+    cell = h3.str_to_int(cell)
+    if not h3.is_valid_cell(cell):
+        raise ValueError("Курсор содержит некорректную ячейку H3")
+    return band, cell
+
+
+@timed('dataframe')
+def coverage_frame(block):
+    """Записи /coverage-data из блока агрегатов"""
+    return pd.DataFrame({
+        'h3_index': cells_to_strings(block['cell']),
+        'lat': block['latitude'],
+        'lng': block['longitude'],
+        'band': block['band'],
+        'avg_rsrp': block['avg_rsrp'],
+        'avg_rsrq': block['avg_rsrq'],
+        'point_count': block['point_count'],
+    })
+
+
+def ndjson_chunks(blocks):
+    """Строки NDJSON: по одному фрагменту ответа на блок"""
+    for block in blocks:
+        yield coverage_frame(block).to_json(orient='records', lines=True).rstrip('\n') + '\n'
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('h3_index', pa.string()),
+        ('lat', pa.float64()),
+        ('lng', pa.float64()),
+        ('band', pa.string()),
+        ('avg_rsrp', pa.float64()),
+        ('avg_rsrq', pa.float64()),
+        ('point_count', pa.uint64()),
+    ])
+
+
+def arrow_chunks(blocks):
+    """Поток Arrow IPC: схема, по одному record batch на блок, признак конца.
+
+    Каждое сообщение сериализуется отдельно, поэтому поток отдаётся клиенту
+    по мере чтения, без накопления в буфере писателя.
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    yield schema.serialize().to_pybytes()
+    for block in blocks:
+        batch = pa.RecordBatch.from_pandas(coverage_frame(block), schema=schema, preserve_index=False)
+        yield batch.serialize().to_pybytes()
+    yield ARROW_END_OF_STREAM
+
+
+@timed('encode')
+def pack_hexes(cells, resolution):
+    """Агрегаты get_hex_aggregates в бинарном виде для отрисовки в браузере.
+
+    Все числа little-endian. Заголовок 16 байт: сигнатура H3HX, число ячеек n
+    (UInt32), разрешение (UInt32) и длина таблицы диапазонов в байтах (UInt32).
+    Таблица - JSON-массив имён диапазонов, дополненный пробелами до кратного 8.
+    Далее колонки подряд: ячейка UInt64[n], avg_rsrp Float32[n], avg_rsrq
+    Float32[n], point_count UInt32[n], код диапазона UInt8[n] (индекс в
+    таблице). Смещения колонок кратны размеру элемента, поэтому в браузере
+    колонки читаются типизированными массивами без копирования.
+    """
+    codes, bands = pd.factorize(cells['band'], sort=True)
+    band_table = json.dumps([str(band) for band in bands]).encode('utf-8')
+    band_table += b' ' * (-len(band_table) % 8)
+    point_count = cells['point_count'].to_numpy(dtype=np.uint64)
+    return b''.join([
+        struct.pack('<4sIII', HEX_PAYLOAD_MAGIC, len(cells), resolution, len(band_table)),
+        band_table,
+        cells['cell'].to_numpy(dtype='<u8').tobytes(),
+        cells['avg_rsrp'].to_numpy(dtype='<f4').tobytes(),
+        cells['avg_rsrq'].to_numpy(dtype='<f4').tobytes(),
+        np.minimum(point_count, np.iinfo(np.uint32).max).astype('<u4').tobytes(),
+        codes.astype(np.uint8).tobytes(),
+    ])
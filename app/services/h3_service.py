@@ -0,0 +1,180 @@
+"""Векторизованные операции над H3-индексами в виде uint64.
+
+Пакет h3 нужен только функциям, которые вызывают его поэлементно, и
+импортируется в них; остальные операции - битовые над массивами numpy.
+"""
+import threading
+
+import numpy as np
+
+from app.services.cache_service import VersionedCache
+from app.services.metrics_service import timed
+
+# Раскладка 64-битного индекса H3: биты 52-55 - разрешение,
+# далее 15 цифр по 3 бита (цифра r занимает биты 3*(15-r) .. 3*(15-r)+2).
+_RES_SHIFT = np.uint64(52)
+_RES_MASK = np.uint64(0xF) << _RES_SHIFT
+_MAX_RES = 15
+
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_NIBBLE_SHIFTS = np.arange(14, -1, -1, dtype=np.uint64) * np.uint64(4)
+
+
+def h3_column(resolution):
+    """Имя колонки coverage_data с индексом заданного разрешения"""
+    return f"h3_r{resolution}"
+
+
+@timed('h3')
+def latlng_to_cells(lat, lon, resolution):
+    """Индексирует массивы координат; одинаковые точки считаются один раз.
+
+    Для точек без координат (NaN) возвращается 0.
+    """
+    import h3.api.basic_int as h3_int
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    cells = np.zeros(len(lat), dtype=np.uint64)
+
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    if not valid.any():
+        return cells
+
+    coords = np.column_stack([lat[valid], lon[valid]])
+    unique, inverse = np.unique(coords, axis=0, return_inverse=True)
+    unique_cells = np.fromiter(
+        (h3_int.latlng_to_cell(a, b, resolution) for a, b in unique),
+        dtype=np.uint64,
+        count=len(unique)
+    )
+    cells[valid] = unique_cells[inverse.reshape(-1)]
+    return cells
+
+
+@timed('h3')
+def cells_to_parent(cells, resolution):
+    """Родительские ячейки заданного разрешения (битовые операции, без вызовов h3)"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    unused_digits = np.uint64((1 << (3 * (_MAX_RES - resolution))) - 1)
+    parents = (cells & ~_RES_MASK) | (np.uint64(resolution) << _RES_SHIFT) | unused_digits
+    return np.where(cells == 0, np.uint64(0), parents)
+
+
+@timed('h3')
+def latlng_to_multi_resolution(lat, lon, resolutions):
+    """Индексы сразу для нескольких разрешений: {разрешение: массив uint64}.
+
+    Точки индексируются только на самом мелком разрешении,
+    более крупные получаются из него как родители.
+    """
+    resolutions = sorted(resolutions)
+    finest = latlng_to_cells(lat, lon, resolutions[-1])
+    result = {resolutions[-1]: finest}
+    for res in resolutions[:-1]:
+        result[res] = cells_to_parent(finest, res)
+    return result
+
+
+@timed('h3')
+def cells_to_strings(cells):
+    """Строковое (hex) представление индексов без поэлементного форматирования"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    nibbles = ((cells[:, None] >> _NIBBLE_SHIFTS) & np.uint64(0xF)).astype(np.intp)
+    chars = np.ascontiguousarray(_HEX_DIGITS[nibbles])
+    return chars.view(f"S{len(_NIBBLE_SHIFTS)}").ravel().astype(str)
+
+
+@timed('h3')
+def grid_disk_cells(cells, k):
+    """Ячейки в радиусе k вокруг каждой: массив (n, 3k(k+1)+1), 0 - нет ячейки (у пентагонов).
+
+    h3.grid_disk вызывается поэлементно; для повторяющихся наборов ячеек
+    используется neighbor_indices с кешем колец.
+    """
+    import h3.api.basic_int as h3_int
+
+    neighbors = np.zeros((len(cells), 3 * k * (k + 1) + 1), dtype=np.uint64)
+    for i, cell in enumerate(cells):
+        disk = h3_int.grid_disk(int(cell), k)
+        neighbors[i, :len(disk)] = disk
+    return neighbors
+
+
+class GridDiskTable:
+    """Кольца радиуса k уже встречавшихся ячеек, отсортированных по индексу.
+
+    Кольца ячеек, которых ещё нет в таблице, считаются grid_disk_cells и
+    добавляются, поэтому каждая ячейка обходится h3 один раз.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.cells = np.zeros(0, dtype=np.uint64)
+        self.disks = np.zeros((0, 3 * k * (k + 1) + 1), dtype=np.uint64)
+        self._lock = threading.Lock()
+
+    def _positions(self, cells):
+        positions = np.minimum(np.searchsorted(self.cells, cells), max(len(self.cells) - 1, 0))
+        found = self.cells[positions] == cells if len(self.cells) else np.zeros(len(cells), dtype=bool)
+        return positions, found
+
+    def lookup(self, cells):
+        """Кольца ячеек cells: массив (n, 3k(k+1)+1), как у grid_disk_cells"""
+        with self._lock:
+            positions, found = self._positions(cells)
+            if not found.all():
+                missing = np.unique(cells[~found])
+                merged = np.concatenate([self.cells, missing])
+                order = np.argsort(merged, kind='stable')
+                self.cells = merged[order]
+                self.disks = np.concatenate([self.disks, grid_disk_cells(missing, self.k)])[order]
+                positions, _ = self._positions(cells)
+            return self.disks[positions]
+
+
+# Таблицы колец по (разрешение, k); сбрасываются со сменой версии данных,
+# поэтому память ограничена ячейками текущих данных
+_grid_disk_tables = VersionedCache(max_items=16)
+
+
+def cell_resolution(cell):
+    return int((np.uint64(cell) & _RES_MASK) >> _RES_SHIFT)
+
+
+@timed('h3')
+def neighbor_indices(cells, k):
+    """Позиции в cells ячеек из радиуса k вокруг каждой ячейки: (n, m), -1 - ячейки нет в cells"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    n = len(cells)
+    if n == 0:
+        return np.zeros((0, 3 * k * (k + 1) + 1), dtype=np.intp)
+    table = _grid_disk_tables.get_or_compute((cell_resolution(cells[0]), k), lambda: GridDiskTable(k))
+    disk = table.lookup(cells)
+
+    # Бинарный поиск по отсортированному массиву вместо словаря по ячейкам
+    order = np.argsort(cells)
+    sorted_cells = cells[order]
+    positions = np.minimum(np.searchsorted(sorted_cells, disk), n - 1)
+    found = (sorted_cells[positions] == disk) & (disk != 0)
+    return np.where(found, order[positions], -1)
+
+
+@timed('h3')
+def children_ranges(cells, resolution):
+    """Границы [min, max] индексов потомков каждой ячейки на разрешении resolution.
+
+    Цифры потомков занимают младшие биты, поэтому все потомки ячейки лежат в
+    непрерывном диапазоне uint64, и фильтр по нему использует ключ сортировки.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    parent_res = ((cells & _RES_MASK) >> _RES_SHIFT).astype(np.int64)
+    unused = np.uint64((1 << (3 * (_MAX_RES - resolution))) - 1)
+    # Цифры разрешений parent_res+1 .. 15 родителя сбрасываются
+    free_bits = np.left_shift(np.uint64(1), (3 * (_MAX_RES - parent_res)).astype(np.uint64)) - np.uint64(1)
+    base = (cells & ~_RES_MASK & ~free_bits) | (np.uint64(resolution) << _RES_SHIFT)
+    # Наибольший потомок: цифры parent_res+1 .. resolution равны 6
+    sixes = np.array([
+        sum(6 << (3 * (_MAX_RES - r)) for r in range(res + 1, resolution + 1)) for res in parent_res
+    ], dtype=np.uint64)
+    return base | unused, base | sixes | unused
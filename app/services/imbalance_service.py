@@ -0,0 +1,159 @@
+"""Поиск дисбалансов между диапазонами LTE1800 и LTE2100 по ячейкам H3.
+
+Для каждой ячейки за один сгруппированный запрос к агрегатам считаются
+количества и суммы RSRP/RSRQ обоих диапазонов, затем значения сглаживаются
+по соседям в радиусе k (взвешивание числом измерений) и сравниваются с порогами.
+"""
+import numpy as np
+
+from app.config import settings
+from app.database import execute
+from app.services.cache_service import VersionedCache
+from app.services.h3_service import neighbor_indices
+
+_imbalance_cache = VersionedCache(max_items=16)
+
+SUM_COLUMNS = ['count', 'sum_rsrp', 'sum_rsrq']
+
+
+def fetch_band_pairs(resolution, band_a, band_b):
+    """Суммы по ячейке для двух диапазонов: словарь numpy-массивов"""
+    query = f'''
+    SELECT
+        h3 AS cell,
+        sumIf(sample_count, band = %(band_a)s) AS count_a,
+        sumIf(sum_rsrp, band = %(band_a)s) AS sum_rsrp_a,
+        sumIf(sum_rsrq, band = %(band_a)s) AS sum_rsrq_a,
+        sumIf(sample_count, band = %(band_b)s) AS count_b,
+        sumIf(sum_rsrp, band = %(band_b)s) AS sum_rsrp_b,
+        sumIf(sum_rsrq, band = %(band_b)s) AS sum_rsrq_b
+    FROM {settings.CLICKHOUSE_DB}.coverage_h3_rollup
+    WHERE resolution = %(resolution)s AND band IN (%(band_a)s, %(band_b)s)
+    GROUP BY cell
+    '''
+    data, columns_with_types = execute(
+        query, {'resolution': resolution, 'band_a': band_a, 'band_b': band_b},
+        columnar=True, with_column_types=True
+    )
+    names = [name for name, _ in columns_with_types]
+    if not data:
+        return {name: np.zeros(0, dtype=np.uint64 if name == 'cell' else np.float64) for name in names}
+    return {
+        name: np.asarray(column, dtype=np.uint64 if name == 'cell' else np.float64)
+        for name, column in zip(names, data)
+    }
+
+
+def smooth_sums(values, neighbors):
+    """Суммы по соседям: values (n,), neighbors (n, m) с -1 для отсутствующих"""
+    padded = np.append(values, 0.0)
+    return padded[neighbors].sum(axis=1)
+
+
+def compute_imbalance(resolution, k=1, rsrp_threshold=None, rsrq_threshold=None,
+                      share_threshold=None, min_samples=None):
+    """Дисбаланс по ячейкам; результат - словарь numpy-массивов одинаковой длины.
+
+    delta_rsrp/delta_rsrq - разность средних (LTE1800 - LTE2100) после сглаживания,
+    share_a - доля измерений LTE1800, flagged - превышение хотя бы одного порога
+    при достаточном числе измерений обоих диапазонов.
+    """
+    band_a, band_b = settings.BANDS[:2]
+    rsrp_threshold = settings.IMBALANCE_RSRP_THRESHOLD if rsrp_threshold is None else rsrp_threshold
+    rsrq_threshold = settings.IMBALANCE_RSRQ_THRESHOLD if rsrq_threshold is None else rsrq_threshold
+    share_threshold = settings.IMBALANCE_SHARE_THRESHOLD if share_threshold is None else share_threshold
+    min_samples = settings.IMBALANCE_MIN_SAMPLES if min_samples is None else min_samples
+
+    def compute():
+        pairs = fetch_band_pairs(resolution, band_a, band_b)
+        cells = pairs['cell']
+
+        # -1 в матрице соседей указывает на добавленный в конец нулевой элемент
+        neighbors = neighbor_indices(cells, k) if k > 0 else np.arange(len(cells))[:, None]
+        smoothed = {
+            f'{column}_{suffix}': smooth_sums(pairs[f'{column}_{suffix}'], neighbors)
+            for column in SUM_COLUMNS for suffix in ('a', 'b')
+        }
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = {
+                f'{metric}_{suffix}': smoothed[f'sum_{metric}_{suffix}'] / smoothed[f'count_{suffix}']
+                for metric in ('rsrp', 'rsrq') for suffix in ('a', 'b')
+            }
+            total = smoothed['count_a'] + smoothed['count_b']
+            share_a = smoothed['count_a'] / total
+
+        delta_rsrp = mean['rsrp_a'] - mean['rsrp_b']
+        delta_rsrq = mean['rsrq_a'] - mean['rsrq_b']
+        enough = (smoothed['count_a'] >= min_samples) & (smoothed['count_b'] >= min_samples)
+        flagged = (
+            (np.abs(np.nan_to_num(delta_rsrp)) >= rsrp_threshold)
+            | (np.abs(np.nan_to_num(delta_rsrq)) >= rsrq_threshold)
+            | (np.abs(np.nan_to_num(share_a, nan=0.5) - 0.5) >= share_threshold)
+        ) & enough
+
+        return {
+            'cell': cells,
+            'count_a': pairs['count_a'],
+            'count_b': pairs['count_b'],
+            'rsrp_a': mean['rsrp_a'],
+            'rsrp_b': mean['rsrp_b'],
+            'rsrq_a': mean['rsrq_a'],
+            'rsrq_b': mean['rsrq_b'],
+            'delta_rsrp': delta_rsrp,
+            'delta_rsrq': delta_rsrq,
+            'share_a': share_a,
+            'flagged': flagged,
+            'bands': (band_a, band_b),
+            'resolution': resolution,
+        }
+
+    key = (resolution, k, rsrp_threshold, rsrq_threshold, share_threshold, min_samples)
+    return _imbalance_cache.get_or_compute(key, compute)
+
+
+def _cell_properties(result, i):
+    import h3.api.basic_int as h3
+
+    band_a, band_b = result['bands']
+
+    def number(value):
+        return None if np.isnan(value) else round(float(value), 3)
+
+    return {
+        "h3_index": h3.int_to_str(int(result['cell'][i])),
+        f"count_{band_a}": int(result['count_a'][i]),
+        f"count_{band_b}": int(result['count_b'][i]),
+        f"rsrp_{band_a}": number(result['rsrp_a'][i]),
+        f"rsrp_{band_b}": number(result['rsrp_b'][i]),
+        f"rsrq_{band_a}": number(result['rsrq_a'][i]),
+        f"rsrq_{band_b}": number(result['rsrq_b'][i]),
+        "delta_rsrp": number(result['delta_rsrp'][i]),
+        "delta_rsrq": number(result['delta_rsrq'][i]),
+        f"share_{band_a}": number(result['share_a'][i]),
+        "flagged": bool(result['flagged'][i]),
+    }
+
+
+def imbalance_records(result, only_flagged=True):
+    """Ячейки результата в виде списка словарей"""
+    indices = np.flatnonzero(result['flagged']) if only_flagged else range(len(result['cell']))
+    return [_cell_properties(result, i) for i in indices]
+
+
+def imbalance_geojson(result, only_flagged=True):
+    """Ячейки результата как GeoJSON FeatureCollection"""
+    import h3.api.basic_int as h3
+
+    indices = np.flatnonzero(result['flagged']) if only_flagged else range(len(result['cell']))
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": h3.cells_to_geo([int(result['cell'][i])]),
+                "properties": _cell_properties(result, i),
+            }
+            for i in indices
+        ]
+    }
@@ -0,0 +1,151 @@
+"""Фоновая инициализация БД и загрузка файлов из DATA_DIR.
+
+Приложение начинает принимать запросы сразу после старта; создание таблиц
+и загрузка данных идут в отдельном потоке. Состояние и прогресс задачи
+отдаются эндпоинтами /healthz и /readyz.
+
+В режиме production каждый процесс uvicorn запускает свою задачу; загрузка
+выполняется под межпроцессной блокировкой, поэтому данные загружает первый
+процесс, а остальные, дождавшись его, находят файлы в манифесте и
+пропускают их.
+"""
+import threading
+import time
+
+from app.config import settings
+from app.database import get_manifest, ingest_file, init_database, manifest_version
+from app.services.cache_service import disk_cache, file_lock, get_data_version, set_data_version
+from app.services.ingest_service import data_files
+from app.services.surface_service import start_surface_build
+from app.services.tile_service import purge_stale_tiles
+
+
+class IngestCancelled(Exception):
+    """Загрузка остановлена при завершении приложения"""
+
+
+class IngestJob:
+    """Задача загрузки: pending -> running -> ready или failed"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.state = 'pending'
+        self.stage = None
+        self.files_total = 0
+        self.files_done = 0
+        self.current_file = None
+        self.rows_loaded = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def start(self):
+        if self._thread is None:
+            self.state = 'running'
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='ingest-job', daemon=True)
+            self._thread.start()
+        return self
+
+    def cancel(self, timeout=None):
+        """Останавливает загрузку после текущего блока и ждёт завершения потока"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _add_rows(self, rows):
+        self.rows_loaded += rows
+        if self._stop.is_set():
+            raise IngestCancelled("Загрузка остановлена")
+
+    def _run(self):
+        try:
+            self.stage = 'waiting'
+            with file_lock(settings.DATA_VERSION_FILE.parent / 'ingest.lock'):
+                self._ingest()
+            self.state = 'ready'
+            print(f"✅ Данные готовы ({self.rows_loaded} строк загружено за {time.time() - self.started_at:.1f} с)")
+            if settings.SURFACE_AUTO_BUILD:
+                # Поверхность пересобирается, только если версия данных или параметры изменились
+                start_surface_build(get_data_version())
+        except IngestCancelled:
+            self.state = 'failed'
+            self.error = "Загрузка остановлена"
+        except Exception as e:
+            print(f"❌ Ошибка инициализации БД: {e}")
+            self.state = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+
+    def _ingest(self):
+        if self._stop.is_set():
+            raise IngestCancelled("Загрузка остановлена")
+        print("🔄 Инициализация базы данных...")
+        self.stage = 'init_database'
+        client = init_database()
+        try:
+            self.stage = 'ingest'
+            files = data_files(self.data_dir)
+            self.files_total = len(files)
+            if not files:
+                print(f"⚠️ Файлы данных не найдены в {self.data_dir}")
+            # Загружаются только новые и изменившиеся файлы
+            manifest = get_manifest(client)
+            for file_path in files:
+                self.current_file = file_path.name
+                print(f"📂 Проверка файла {file_path.name}")
+                ingest_file(client, file_path, manifest, progress=self._add_rows)
+                self.files_done += 1
+                # Версия данных входит в ключи кеша карт и ETag: обновляется после каждого файла
+                set_data_version(manifest_version(client))
+            self.current_file = None
+
+            self.stage = 'finalize'
+            set_data_version(manifest_version(client))
+            purge_stale_tiles(get_data_version())
+            disk_cache.purge_stale(get_data_version())
+        finally:
+            client.disconnect()
+
+    def status(self):
+        """Состояние и прогресс задачи"""
+        finished = self.finished_at or time.time()
+        return {
+            'state': self.state,
+            'stage': self.stage,
+            'files_total': self.files_total,
+            'files_done': self.files_done,
+            'current_file': self.current_file,
+            'rows_loaded': self.rows_loaded,
+            'elapsed_seconds': round(finished - self.started_at, 1) if self.started_at else None,
+            'error': self.error,
+        }
+
+
+_job = None
+
+
+def start_ingest_job():
+    """Запускает фоновую загрузку (вызывается при старте приложения)"""
+    global _job
+    if _job is None:
+        _job = IngestJob(settings.DATA_DIR).start()
+    return _job
+
+
+def get_ingest_job():
+    return _job
+
+
+def stop_ingest_job(timeout=5):
+    global _job
+    if _job is not None:
+        _job.cancel(timeout)
+        _job = None
@@ -0,0 +1,135 @@
+"""Потоковое чтение исходных файлов и подготовка блоков для вставки"""
+import hashlib
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.services.h3_service import h3_column, latlng_to_multi_resolution
+
+NUMERIC_COLUMNS = ['vbw', 'servingcellrsrp', 'servingcellrsrq']
+
+RENAME_MAP = {
+    'servingcellrsrp': 'rsrp',
+    'servingcellrsrq': 'rsrq',
+    'height': 'altitude'
+}
+
+FLOAT_COLUMNS = ['latitude', 'longitude', 'altitude', 'rsrp', 'rsrq']
+
+SUPPORTED_SUFFIXES = ('.xlsx', '.xlsm', '.csv', '.parquet')
+
+
+def columns_to_load():
+    """Колонки coverage_data, заполняемые при загрузке"""
+    return [
+        'latitude', 'longitude', 'altitude', 'band',
+        'rsrp', 'rsrq', 'h3_index', 'eventtime'
+    ] + [h3_column(res) for res in settings.H3_RESOLUTIONS]
+
+
+def data_files(directory):
+    """Файлы поддерживаемых форматов в каталоге данных"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    return sorted(
+        path for path in directory.iterdir()
+        if path.is_file() and path.suffix.lower() in SUPPORTED_SUFFIXES and not path.name.startswith('~$')
+    )
+
+
+def file_fingerprint(file_path, block_size=1 << 20):
+    """SHA-256 и размер файла (файл читается блоками)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def read_chunks(file_path, chunk_rows):
+    """Читает файл блоками не больше chunk_rows строк (xlsx, csv, parquet)"""
+    suffix = Path(file_path).suffix.lower()
+    if suffix in ('.xlsx', '.xlsm'):
+        yield from _read_excel_chunks(file_path, chunk_rows)
+    elif suffix == '.csv':
+        yield from pd.read_csv(file_path, sep=settings.INGEST_CSV_SEPARATOR, chunksize=chunk_rows)
+    elif suffix == '.parquet':
+        yield from _read_parquet_chunks(file_path, chunk_rows)
+    else:
+        raise ValueError(f"Неподдерживаемый формат файла: {suffix}")
+
+
+def _read_excel_chunks(file_path, chunk_rows):
+    # read_only-режим openpyxl не держит в памяти весь лист
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(name) if name is not None else '' for name in header]
+        while True:
+            batch = list(islice(rows, chunk_rows))
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def _read_parquet_chunks(file_path, chunk_rows):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для загрузки Parquet требуется пакет pyarrow")
+
+    parquet_file = pq.ParquetFile(file_path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+def prepare_chunk(df):
+    """Приводит блок исходных данных к колонкам и типам coverage_data"""
+    # 1. Обработка числовых колонок (в выгрузках встречается запятая как разделитель)
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].astype(str).str.replace(',', '.').astype(float)
+            else:
+                df[col] = df[col].astype(float)
+
+    # 2. Переименование колонок
+    df = df.rename(columns={old: new for old, new in RENAME_MAP.items() if old in df.columns})
+
+    if 'latitude' not in df.columns or 'longitude' not in df.columns:
+        raise ValueError("Отсутствуют колонки latitude или longitude")
+
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
+
+    # 3. Точки без координат не индексируются и не загружаются
+    df = df[np.isfinite(df['latitude'].to_numpy()) & np.isfinite(df['longitude'].to_numpy())]
+
+    # 4. H3 индексы для всех разрешений за один проход
+    cells = latlng_to_multi_resolution(
+        df['latitude'].to_numpy(), df['longitude'].to_numpy(),
+        set(settings.H3_RESOLUTIONS) | {8}
+    )
+    df = df.assign(**{h3_column(res): cells[res] for res in settings.H3_RESOLUTIONS})
+    df['h3_index'] = cells[8]
+
+    if 'band' in df.columns:
+        df['band'] = df['band'].fillna('').astype(str)
+    if 'eventtime' in df.columns:
+        df['eventtime'] = pd.to_datetime(df['eventtime'])
+
+    return df[[col for col in columns_to_load() if col in df.columns]]
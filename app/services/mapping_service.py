@@ -1,34 +1,263 @@
-import geopandas as gpd
-import matplotlib.pyplot as plt
+"""Отрисовка карт покрытия.
+
+Функции выполняются в процессах пула отрисовки (render_service), поэтому
+принимают уже полученные данные, используют объектный API Figure вместо
+глобального состояния pyplot и возвращают изображение (PNG или WebP) в байтах.
+Matplotlib импортируется внутри функций: модуль подключается эндпоинтами,
+а сама отрисовка идёт только в процессах пула.
+"""
 from io import BytesIO
-import base64
+
+import numpy as np
+
+from app.services.metrics_service import phase, timed
+
+# Цвета диапазонов: (заливка, контур)
+BAND_COLORS = {
+    'LTE1800': ('#1f78b4', '#0a4b8c'),
+    'LTE2100': ('#e31a1c', '#a50f15')
+}
+DEFAULT_BAND_COLOR = ('#888888', '#555555')
+
+METRIC_LABELS = {
+    'avg_rsrp': 'Средний RSRP, дБм',
+    'avg_rsrq': 'Средний RSRQ, дБ',
+    'point_count': 'Количество измерений',
+}
+
+# Фиксированные шкалы метрик: соседние тайлы должны раскрашиваться одинаково
+METRIC_RANGES = {
+    'avg_rsrp': (-120.0, -70.0),
+    'avg_rsrq': (-20.0, -3.0),
+    'point_count': (1.0, 100.0),
+}
+
+# Радиус Земли для проекции Web Mercator, м
+EARTH_RADIUS = 6378137.0
+
+
+def _to_image(fig, image_format='png', **kwargs):
+    buf = BytesIO()
+    with phase('encode'):
+        fig.savefig(buf, format=image_format, bbox_inches='tight', **kwargs)
+    return buf.getvalue()
+
+
+@timed('h3')
+def cell_polygons(cells):
+    """Границы ячеек H3 в координатах (lon, lat), по одному вызову h3 на ячейку"""
+    import h3.api.basic_int as h3
+
+    return [np.array(h3.cell_to_boundary(int(cell)))[:, ::-1] for cell in cells]
 
 
-def create_coverage_map(df):
-    """Создает карту покрытия из DataFrame"""
-    gdf = gpd.GeoDataFrame(
-        df,
-        geometry=gpd.points_from_xy(df.longitude, df.latitude),
-        crs="EPSG:4326"
+def render_hexmap(cells, resolution, value_column=None, image_format='png'):
+    """Гексагональная карта по агрегатам (band, cell, ...).
+
+    Каждая ячейка рисуется один раз в составе общей PolyCollection; заливка -
+    значение value_column (или цвет диапазона, если колонка не задана),
+    контур - цвет диапазона.
+    """
+    from matplotlib.collections import PolyCollection
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+
+    # LTE2100 рисуем ПЕРВЫМИ (чтобы они не перекрывали LTE1800)
+    cells = cells.sort_values('band', key=lambda band: band != 'LTE2100', kind='stable')
+
+    fig = Figure(figsize=(14, 10))
+    ax = fig.subplots()
+
+    bands = cells['band'].to_numpy()
+    collection = PolyCollection(
+        cell_polygons(cells['cell'].to_numpy()),
+        edgecolors=[BAND_COLORS.get(band, DEFAULT_BAND_COLOR)[1] for band in bands],
+        linewidths=0.5,
+        alpha=0.7
     )
+    if value_column is None:
+        collection.set_facecolor([BAND_COLORS.get(band, DEFAULT_BAND_COLOR)[0] for band in bands])
+    else:
+        collection.set_array(cells[value_column].to_numpy(dtype=float))
+        collection.set_cmap('RdYlGn')
+        fig.colorbar(collection, ax=ax, label=METRIC_LABELS.get(value_column, value_column))
+    ax.add_collection(collection)
 
-    lte1800 = gdf[gdf['band'] == 'LTE1800']
-    lte2100 = gdf[gdf['band'] == 'LTE2100']
+    # Автоматическое масштабирование
+    ax.autoscale_view()
 
-    fig, ax = plt.subplots(figsize=(10, 10))
+    legend_elements = [
+        Line2D([0], [0], marker='h', color='w', label=band,
+               markerfacecolor=fill, markeredgecolor=edge, markersize=15)
+        for band, (fill, edge) in BAND_COLORS.items()
+    ]
+    ax.legend(handles=legend_elements, fontsize=12)
 
-    if not lte1800.empty:
-        lte1800.plot(ax=ax, color='blue', markersize=5, label='LTE1800')
-    if not lte2100.empty:
-        lte2100.plot(ax=ax, color='red', markersize=5, label='LTE2100')
+    ax.set_title(f'LTE Coverage Hexagonal Map (Resolution {resolution}, {len(cells)} cells)', fontsize=14)
+    ax.set_xlabel('Longitude', fontsize=12)
+    ax.set_ylabel('Latitude', fontsize=12)
 
-    ax.legend()
-    plt.title('LTE Coverage Map')
-    plt.xlabel('Longitude')
-    plt.ylabel('Latitude')
+    return _to_image(fig, image_format, dpi=120)
+
+
+def lonlat_to_mercator(coords):
+    """Перевод массива точек (lon, lat) в метры Web Mercator"""
+    lon = np.radians(coords[..., 0])
+    lat = np.radians(np.clip(coords[..., 1], -85.0511, 85.0511))
+    return np.stack([EARTH_RADIUS * lon, EARTH_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))], axis=-1)
+
+
+def render_tile(cells, mercator_bounds, value_column, tile_size=256):
+    """Прозрачный тайл tile_size x tile_size с гексагонами, попадающими в границы"""
+    from matplotlib.collections import PolyCollection
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(1, 1), dpi=tile_size)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_axis_off()
+
+    if len(cells):
+        vmin, vmax = METRIC_RANGES.get(value_column, (None, None))
+        collection = PolyCollection(
+            [lonlat_to_mercator(polygon) for polygon in cell_polygons(cells['cell'].to_numpy())],
+            linewidths=0.3,
+            edgecolors='white',
+            alpha=0.75,
+            cmap='RdYlGn'
+        )
+        collection.set_array(cells[value_column].to_numpy(dtype=float))
+        collection.set_clim(vmin, vmax)
+        ax.add_collection(collection)
+
+    min_x, min_y, max_x, max_y = mercator_bounds
+    ax.set_xlim(min_x, max_x)
+    ax.set_ylim(min_y, max_y)
 
     buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    plt.close()
+    with phase('encode'):
+        fig.savefig(buf, format='png', transparent=True)
+    return buf.getvalue()
+
+
+def render_raster(raster, metric, image_format='png'):
+    """Растровая карта по результату raster_service.rasterize_points.
+
+    metric: rsrp - средний RSRP, count - плотность измерений (лог. шкала),
+    band - преобладающий диапазон в пикселе.
+    """
+    from matplotlib.colors import LogNorm, to_rgba
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+
+    min_lat, max_lat, min_lon, max_lon = raster['bbox']
+    height, width = raster['count'].shape
+
+    fig = Figure(figsize=(max(6.0, width / 100), max(4.0, height / 100)))
+    ax = fig.subplots()
+    image_kwargs = dict(extent=(min_lon, max_lon, min_lat, max_lat), origin='upper',
+                        interpolation='nearest', aspect='auto')
+
+    if metric == 'rsrp':
+        vmin, vmax = METRIC_RANGES['avg_rsrp']
+        image = ax.imshow(np.ma.masked_invalid(raster['mean_rsrp']), cmap='RdYlGn',
+                          vmin=vmin, vmax=vmax, **image_kwargs)
+        fig.colorbar(image, ax=ax, label=METRIC_LABELS['avg_rsrp'])
+    elif metric == 'count':
+        count = np.ma.masked_equal(raster['count'], 0)
+        image = ax.imshow(count, cmap='viridis', norm=LogNorm(vmin=1, vmax=max(int(raster['count'].max()), 2)),
+                          **image_kwargs)
+        fig.colorbar(image, ax=ax, label=METRIC_LABELS['point_count'])
+    else:
+        palette = np.array(
+            [to_rgba(BAND_COLORS.get(band, DEFAULT_BAND_COLOR)[0]) for band in raster['bands']]
+            + [(0.0, 0.0, 0.0, 0.0)]
+        )
+        # -1 (нет данных) попадает на последний, прозрачный цвет палитры
+        ax.imshow(palette[raster['dominant_band']], **image_kwargs)
+        ax.legend(handles=[
+            Line2D([0], [0], marker='s', color='w', label=band,
+                   markerfacecolor=BAND_COLORS.get(band, DEFAULT_BAND_COLOR)[0], markersize=12)
+            for band in raster['bands']
+        ])
+
+    ax.set_title(f"LTE Coverage Raster ({raster['points']} points, {width}x{height})")
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+
+    return _to_image(fig, image_format, dpi=100)
+
+
+def render_imbalance(result, metric='delta_rsrp', image_format='png'):
+    """Карта дисбаланса диапазонов по результату imbalance_service.compute_imbalance.
+
+    Заливка - разность metric (расходящаяся шкала, 0 - баланс), ячейки с
+    превышением порогов обводятся черным контуром.
+    """
+    from matplotlib.collections import PolyCollection
+    from matplotlib.figure import Figure
+
+    band_a, band_b = result['bands']
+    values = result[metric]
+    if metric == 'share_a':
+        values = values - 0.5
+    limit = float(np.nanmax(np.abs(values))) if np.isfinite(values).any() else 1.0
+    flagged = result['flagged']
+
+    fig = Figure(figsize=(14, 10))
+    ax = fig.subplots()
+
+    collection = PolyCollection(
+        cell_polygons(result['cell']),
+        edgecolors=np.where(flagged[:, None], [[0.0, 0.0, 0.0, 1.0]], [[1.0, 1.0, 1.0, 0.6]]),
+        linewidths=np.where(flagged, 1.2, 0.3),
+        alpha=0.8,
+        cmap='RdBu'
+    )
+    collection.set_array(np.ma.masked_invalid(values))
+    collection.set_clim(-limit, limit)
+    ax.add_collection(collection)
+    label = f'{metric} ({band_a} - {band_b})' if metric != 'share_a' else f'Доля {band_a} - 0.5'
+    fig.colorbar(collection, ax=ax, label=label)
+    ax.autoscale_view()
+
+    ax.set_title(f"Дисбаланс {band_a}/{band_b} (Resolution {result['resolution']}, "
+                 f"{int(flagged.sum())} из {len(flagged)} ячеек отмечено)", fontsize=14)
+    ax.set_xlabel('Longitude', fontsize=12)
+    ax.set_ylabel('Latitude', fontsize=12)
+
+    return _to_image(fig, image_format, dpi=120)
+
+
+def render_antenna_map(cells, image_format='png'):
+    """Карта покрытия с базовой станцией по агрегатам (band, cell): ячейка рисуется один раз"""
+    from matplotlib.collections import PolyCollection
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+
+    # Центральная точка (антенна), оси - долгота и широта
+    base_lat, base_lon = 52.27664, 104.27792
+    ax.scatter(base_lon, base_lat, c='red', s=100, marker='^', label='Базовая станция')
+
+    # Отрисовка гексагонов одной коллекцией
+    colors = {'LTE1800': 'blue', 'LTE2100': 'green'}
+    if len(cells):
+        ax.add_collection(PolyCollection(
+            cell_polygons(cells['cell'].to_numpy()),
+            facecolors=[colors.get(band, 'gray') for band in cells['band']],
+            edgecolors='white',
+            linewidths=0.3,
+            alpha=0.5
+        ))
+
+    # Настройки графика
+    ax.set_title('Карта покрытия LTE')
+    ax.set_xlabel('Долгота')
+    ax.set_ylabel('Широта')
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.5)
+    ax.autoscale_view()
 
-    return base64.b64encode(buf.getvalue()).decode('utf-8')
\ No newline at end of file
+    return _to_image(fig, image_format, dpi=100)
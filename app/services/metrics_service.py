@@ -0,0 +1,258 @@
+"""Метрики запросов: время по фазам обработки и объём прочитанных ClickHouse данных.
+
+Для каждого HTTP-запроса создаётся RequestMetrics и кладётся в contextvar;
+он доступен и в потоках run_in_threadpool (контекст копируется, объект общий).
+Фазы отмечаются контекстным менеджером phase() или декоратором timed():
+  pool_wait  - ожидание соединения из пула ClickHouse;
+  clickhouse - выполнение запроса и получение результата;
+  dataframe  - сборка DataFrame/ответа из колонок;
+  h3         - векторные операции H3;
+  render     - отрисовка Matplotlib (в процессе пула отрисовки);
+  encode     - кодирование изображения (savefig);
+  render_queue - ожидание свободного процесса отрисовки.
+Вложенные отметки одной фазы учитываются один раз.
+
+Гистограммы и счётчики отдаются в текстовом формате Prometheus (/metrics).
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Длина текста запроса в журнале медленных запросов
+SLOW_QUERY_TEXT_LIMIT = 2000
+
+
+class RequestMetrics:
+    """Фазы и статистика ClickHouse одного запроса"""
+
+    def __init__(self):
+        self.phases = {}
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.queries = []
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, query, seconds, rows, bytes_read):
+        with self._lock:
+            self.rows_read += rows
+            self.bytes_read += bytes_read
+            self.queries.append((query, seconds, rows, bytes_read))
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def current_metrics():
+    return _current.get()
+
+
+def activate(metrics):
+    """Делает metrics текущими для контекста; возвращает токен для deactivate"""
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """Отмечает время блока как фазу текущего запроса (вне запроса ничего не делает)"""
+    metrics = _current.get()
+    if metrics is None or name in metrics._active:
+        yield
+        return
+    metrics._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._active.discard(name)
+        metrics.add_phase(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Декоратор: вызов функции учитывается как фаза name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_query(query, seconds, rows, bytes_read):
+    """Статистика выполненного запроса ClickHouse для текущего HTTP-запроса"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_query(query, seconds, rows, bytes_read)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками"""
+
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+                inf = _format_labels(self.labelnames, labels, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{inf} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Counter:
+    """Счётчик Prometheus с метками"""
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса', ('method', 'route', 'status')
+)
+PHASE_DURATION = Histogram(
+    'http_request_phase_seconds', 'Время фаз обработки HTTP-запроса', ('route', 'phase')
+)
+CLICKHOUSE_ROWS = Counter(
+    'clickhouse_read_rows_total', 'Строк прочитано ClickHouse при обработке запросов', ('route',)
+)
+CLICKHOUSE_BYTES = Counter(
+    'clickhouse_read_bytes_total', 'Байт прочитано ClickHouse при обработке запросов', ('route',)
+)
+CLICKHOUSE_QUERIES = Counter(
+    'clickhouse_queries_total', 'Запросов к ClickHouse при обработке HTTP-запросов', ('route',)
+)
+
+REGISTRY = [REQUEST_DURATION, PHASE_DURATION, CLICKHOUSE_ROWS, CLICKHOUSE_BYTES, CLICKHOUSE_QUERIES]
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(metrics):
+    """Значение заголовка Server-Timing (мс по фазам)"""
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in sorted(metrics.phases.items()))
+
+
+def _route_name(request):
+    route = request.scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+def _log_slow_request(request, route, status, duration, metrics):
+    phases = ', '.join(f'{name}={seconds * 1000:.0f}мс' for name, seconds in sorted(metrics.phases.items()))
+    queries = '\n'.join(
+        f'  [{seconds * 1000:.0f} мс, {rows} строк, {bytes_read} байт] {" ".join(query.split())[:SLOW_QUERY_TEXT_LIMIT]}'
+        for query, seconds, rows, bytes_read in metrics.queries
+    )
+    logger.warning(
+        "Медленный запрос %s %s (%s): %d, %.0f мс; %s; ClickHouse: %d строк, %d байт\n%s",
+        request.method, request.url.path, route, status, duration * 1000, phases,
+        metrics.rows_read, metrics.bytes_read, queries
+    )
+
+
+async def metrics_middleware(request, call_next):
+    """Middleware: собирает фазы запроса, обновляет гистограммы и пишет медленные запросы"""
+    metrics = RequestMetrics()
+    token = activate(metrics)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers['Server-Timing'] = server_timing(metrics)
+        return response
+    finally:
+        duration = time.perf_counter() - started
+        deactivate(token)
+        route = _route_name(request)
+
+        REQUEST_DURATION.observe((request.method, route, str(status)), duration)
+        for name, seconds in metrics.phases.items():
+            PHASE_DURATION.observe((route, name), seconds)
+        if metrics.queries:
+            CLICKHOUSE_QUERIES.inc((route,), len(metrics.queries))
+            CLICKHOUSE_ROWS.inc((route,), metrics.rows_read)
+            CLICKHOUSE_BYTES.inc((route,), metrics.bytes_read)
+
+        if settings.SLOW_REQUEST_SECONDS and duration >= settings.SLOW_REQUEST_SECONDS:
+            _log_slow_request(request, route, status, duration, metrics)
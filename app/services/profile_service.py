@@ -0,0 +1,114 @@
+"""Профиль качества данных coverage_data за один проход по таблице"""
+import math
+
+from app.config import settings
+from app.database import execute
+from app.services.cache_service import VersionedCache, get_data_version
+from app.services.h3_service import h3_column
+
+NUMERIC_COLUMNS = ['latitude', 'longitude', 'altitude', 'rsrp', 'rsrq']
+
+# Допустимые диапазоны измерений LTE (3GPP TS 36.133): RSRP, дБм и RSRQ, дБ
+VALID_RANGES = {
+    'rsrp': (-140.0, -44.0),
+    'rsrq': (-20.0, -3.0),
+}
+
+QUANTILES = (0.01, 0.5, 0.99)
+
+_profile_cache = VersionedCache(max_items=1)
+
+
+def _profile_expressions():
+    """Пары (имя, выражение) для единственного SELECT профиля"""
+    expressions = [('row_count', 'count()')]
+    quantile_args = ', '.join(str(q) for q in QUANTILES)
+    # Минимум, максимум и квантили - только по конечным значениям: NaN (некорректные
+    # значения при загрузке) исказили бы их, а в пустой таблице quantiles() дают NaN
+    for col in NUMERIC_COLUMNS:
+        expressions += [
+            (f'{col}__min', f'minIf({col}, isFinite({col}))'),
+            (f'{col}__max', f'maxIf({col}, isFinite({col}))'),
+            (f'{col}__quantiles', f'quantilesIf({quantile_args})({col}, isFinite({col}))'),
+            (f'{col}__finite_count', f'countIf(isFinite({col}))'),
+            (f'{col}__zero_count', f'countIf({col} = 0)'),
+            (f'{col}__nan_count', f'countIf(isNaN({col}))'),
+        ]
+    for col, (low, high) in VALID_RANGES.items():
+        expressions.append((f'{col}__out_of_range', f'countIf(NOT isNaN({col}) AND ({col} < {low} OR {col} > {high}))'))
+    expressions += [
+        ('band__distinct', 'uniqExact(band)'),
+        ('band__values', 'groupUniqArray(100)(band)'),
+        ('band__empty_count', "countIf(band = '')"),
+        # h3_index - UInt64 (0 - нет ячейки) или String в таблицах прежней схемы
+        ('h3_index__empty_count', "countIf(toString(h3_index) IN ('', '0'))"),
+        ('eventtime__min', 'min(eventtime)'),
+        ('eventtime__max', 'max(eventtime)'),
+        ('eventtime__zero_count', 'countIf(toUnixTimestamp(eventtime) = 0)'),
+    ]
+    for res in settings.H3_RESOLUTIONS:
+        expressions.append((f'h3_r{res}__distinct', f'uniq({h3_column(res)})'))
+    return expressions
+
+
+def _finite(value):
+    """Число для JSON: NaN и бесконечность (не сериализуются) заменяются на None"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _compute_profile():
+    expressions = _profile_expressions()
+    select = ',\n        '.join(f'{expression} AS `{name}`' for name, expression in expressions)
+    row = execute(f'''
+    SELECT
+        {select}
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    ''')[0]
+    values = dict(zip([name for name, _ in expressions], row))
+
+    columns = {}
+    for col in NUMERIC_COLUMNS:
+        # Без конечных значений minIf/maxIf возвращают 0 - статистики нет
+        has_values = values[f'{col}__finite_count'] > 0
+        columns[col] = {
+            "min": _finite(values[f'{col}__min']) if has_values else None,
+            "max": _finite(values[f'{col}__max']) if has_values else None,
+            "quantiles": {
+                f"p{round(q * 100)}": _finite(v) if has_values else None
+                for q, v in zip(QUANTILES, values[f'{col}__quantiles'])
+            },
+            "zero_count": values[f'{col}__zero_count'],
+            "missing_count": values[f'{col}__nan_count'],
+        }
+    columns['band'] = {
+        "distinct": values['band__distinct'],
+        "values": sorted(values['band__values']),
+        "missing_count": values['band__empty_count'],
+    }
+    columns['h3_index'] = {
+        "missing_count": values['h3_index__empty_count'],
+    }
+    eventtime_min, eventtime_max = values['eventtime__min'], values['eventtime__max']
+    columns['eventtime'] = {
+        "min": eventtime_min,
+        "max": eventtime_max,
+        "span_seconds": (eventtime_max - eventtime_min).total_seconds() if values['row_count'] else 0,
+        "missing_count": values['eventtime__zero_count'],
+    }
+
+    return {
+        "row_count": values['row_count'],
+        "columns": columns,
+        "out_of_range": {col: values[f'{col}__out_of_range'] for col in VALID_RANGES},
+        "valid_ranges": VALID_RANGES,
+        "h3_cells": {res: values[f'h3_r{res}__distinct'] for res in settings.H3_RESOLUTIONS},
+    }
+
+
+def get_data_profile():
+    """Профиль данных; пересчитывается только при изменении версии данных"""
+    return _profile_cache.get_or_compute(
+        'profile', lambda: {"data_version": get_data_version(), **_compute_profile()}
+    )
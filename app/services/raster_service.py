@@ -0,0 +1,104 @@
+"""Растровая агрегация измерений на NumPy: все точки без усечения.
+
+Точки читаются из ClickHouse колоночными блоками и раскладываются по пикселям
+сетки сложением по затронутым блоком пикселям: время O(точек), память
+O(пикселей) на растр и O(блока) на временные массивы.
+"""
+import math
+
+import numpy as np
+
+from app.config import settings
+from app.database import execute, iter_column_blocks
+from app.services.spatial_service import coverage_bbox_condition
+
+MAX_RASTER_SIDE = 4096
+
+
+def data_extent():
+    """Область, покрывающая все измерения: (min_lat, max_lat, min_lon, max_lon)"""
+    min_lat, max_lat, min_lon, max_lon = execute(f'''
+    SELECT min(latitude), max(latitude), min(longitude), max(longitude)
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    ''')[0]
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def raster_height(bbox, width):
+    """Высота растра, сохраняющая пропорции области"""
+    min_lat, max_lat, min_lon, max_lon = bbox
+    lon_span = (max_lon - min_lon) * math.cos(math.radians((min_lat + max_lat) / 2))
+    if lon_span <= 0:
+        return width
+    return max(1, min(MAX_RASTER_SIDE, round(width * (max_lat - min_lat) / lon_span)))
+
+
+def _scatter_add(target, index, weights=None):
+    """target[index] += weights (или 1) с учётом повторов в index.
+
+    Суммы считаются только по затронутым элементам (np.unique + bincount), а не
+    по массиву размера target, поэтому блок не выделяет массивов размера растра.
+    """
+    if not len(index):
+        return
+    touched, inverse = np.unique(index, return_inverse=True)
+    target[touched] += np.bincount(inverse.reshape(-1), weights=weights, minlength=len(touched)).astype(target.dtype)
+
+
+def rasterize_points(bbox, width, height, bands=None):
+    """Сетка height x width по области bbox.
+
+    Возвращает словарь: count - число измерений в пикселе, mean_rsrp - средний
+    RSRP (NaN без данных), dominant_band - индекс диапазона с наибольшим числом
+    измерений (-1 без данных), а также bands, bbox и общее число точек.
+    """
+    min_lat, max_lat, min_lon, max_lon = bbox
+    bands = tuple(bands or settings.BANDS)
+    size = width * height
+
+    counts = np.zeros(len(bands) * size, dtype=np.int64)
+    rsrp_sum = np.zeros(size, dtype=np.float64)
+    rsrp_count = np.zeros(size, dtype=np.int64)
+
+    x_scale = width / (max_lon - min_lon) if max_lon > min_lon else 0.0
+    y_scale = height / (max_lat - min_lat) if max_lat > min_lat else 0.0
+
+    query = f'''
+    SELECT longitude, latitude, rsrp, toUInt8(indexOf(%(bands)s, band) - 1) AS band_code
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    WHERE band IN %(bands)s
+    AND latitude BETWEEN %(min_lat)s AND %(max_lat)s
+    AND longitude BETWEEN %(min_lon)s AND %(max_lon)s{coverage_bbox_condition(bbox)}
+    '''
+    params = {
+        'bands': bands,
+        'min_lat': min_lat, 'max_lat': max_lat,
+        'min_lon': min_lon, 'max_lon': max_lon
+    }
+
+    for lon, lat, rsrp, band_code in iter_column_blocks(query, params):
+        # Строка 0 растра - северный край области
+        px = np.clip(((lon - min_lon) * x_scale).astype(np.intp), 0, width - 1)
+        py = np.clip(((max_lat - lat) * y_scale).astype(np.intp), 0, height - 1)
+        pixel = py * width + px
+
+        _scatter_add(counts, band_code.astype(np.intp) * size + pixel)
+
+        valid = np.isfinite(rsrp)
+        _scatter_add(rsrp_sum, pixel[valid], rsrp[valid])
+        _scatter_add(rsrp_count, pixel[valid])
+
+    counts = counts.reshape(len(bands), size)
+    total = counts.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_rsrp = np.where(rsrp_count > 0, rsrp_sum / rsrp_count, np.nan)
+    dominant_band = np.where(total > 0, counts.argmax(axis=0), -1)
+
+    return {
+        'count': total.reshape(height, width).astype(np.uint32),
+        'mean_rsrp': mean_rsrp.reshape(height, width).astype(np.float32),
+        'dominant_band': dominant_band.reshape(height, width).astype(np.int8),
+        'bands': bands,
+        'bbox': bbox,
+        'points': int(total.sum()),
+    }
@@ -0,0 +1,108 @@
+"""Пул процессов для отрисовки карт с ограниченной очередью"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.services.metrics_service import RequestMetrics, activate, current_metrics, deactivate
+
+
+def _init_worker():
+    # В рабочих процессах используется только неинтерактивный backend
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _timed_call(func, args):
+    """Вызов func(*args) в рабочем процессе с учётом фаз (encode, h3 и т.п.)"""
+    metrics = RequestMetrics()
+    token = activate(metrics)
+    started = time.perf_counter()
+    try:
+        result = func(*args)
+    finally:
+        deactivate(token)
+    return result, time.perf_counter() - started, metrics.phases
+
+
+class RenderExecutor:
+    """Выполняет функции отрисовки в отдельных процессах.
+
+    Одновременно принимается не больше workers + queue_size задач,
+    остальные запросы сразу получают 503; задача дольше timeout - 504.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.timeout = timeout
+        self._pending = 0
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(settings.RENDER_START_METHOD),
+            initializer=_init_worker
+        )
+
+    async def submit(self, func, *args):
+        """Отрисовка в пуле процессов; возвращает результат func(*args)"""
+        if self._pending >= self.capacity:
+            raise HTTPException(
+                status_code=503,
+                detail="Очередь отрисовки переполнена, повторите запрос позже",
+                headers={"Retry-After": "1"}
+            )
+
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        submitted = time.perf_counter()
+        future = self._executor.submit(_timed_call, func, args)
+        # Слот освобождается только когда процесс действительно закончил работу
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+
+        try:
+            result, elapsed, phases = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise HTTPException(status_code=504, detail=f"Отрисовка не уложилась в {self.timeout} с")
+
+        metrics = current_metrics()
+        if metrics is not None:
+            # Всё, что не отмечено внутри процесса, - сама отрисовка; остаток - очередь и передача данных
+            for name, seconds in phases.items():
+                metrics.add_phase(name, seconds)
+            metrics.add_phase('render', max(elapsed - sum(phases.values()), 0.0))
+            metrics.add_phase('render_queue', max(time.perf_counter() - submitted - elapsed, 0.0))
+        return result
+
+    def _release(self):
+        self._pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_render_executor = None
+
+
+def init_render_executor():
+    """Создаёт пул отрисовки (вызывается при старте приложения)"""
+    global _render_executor
+    if _render_executor is None:
+        _render_executor = RenderExecutor(
+            settings.RENDER_WORKERS, settings.RENDER_QUEUE_SIZE, settings.RENDER_TIMEOUT
+        )
+    return _render_executor
+
+
+def get_render_executor():
+    return _render_executor or init_render_executor()
+
+
+def shutdown_render_executor():
+    global _render_executor
+    if _render_executor is not None:
+        _render_executor.shutdown()
+        _render_executor = None
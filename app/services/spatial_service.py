@@ -0,0 +1,136 @@
+"""Пространственный отбор по прямоугольной области.
+
+Ключи сортировки таблиц начинаются с индекса H3 (coverage_data - band, h3_index
+разрешения 8; агрегаты - resolution, band, h3), а у соседних ячеек H3 близкие
+номера. Небольшая область поэтому переводится в покрывающий набор ячеек, а он -
+в диапазоны индексов их потомков: условие по диапазонам отбирает гранулы по
+первичному ключу. Для больших областей покрытие почти совпадает со всей
+таблицей, и отбор по широте/долготе выполняют minmax-индексы пропуска.
+"""
+import math
+
+import numpy as np
+
+from app.config import settings
+from app.database import execute
+from app.services.h3_service import cells_to_parent, children_ranges, grid_disk_cells
+
+# Разрешение колонки h3_index в coverage_data
+H3_INDEX_RESOLUTION = 8
+# Длина градуса широты, км
+KM_PER_DEGREE = 111.32
+
+
+def bbox_area_km2(min_lat, max_lat, min_lon, max_lon):
+    """Приблизительная площадь области в км²"""
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    return (abs(max_lat - min_lat) * KM_PER_DEGREE) * (abs(max_lon - min_lon) * KM_PER_DEGREE * math.cos(mid_lat))
+
+
+def use_h3_ranges(bbox, max_area_km2=None):
+    """Выбор способа отбора по размеру области: True - диапазоны H3, False - minmax-индексы"""
+    if max_area_km2 is None:
+        max_area_km2 = settings.SPATIAL_H3_MAX_AREA_KM2
+    return bbox_area_km2(*bbox) <= max_area_km2
+
+
+def covering_resolution(bbox, max_resolution):
+    """Самое мелкое разрешение не крупнее max_resolution, при котором область
+    покрывается примерно SPATIAL_COVER_CELLS ячейками
+    """
+    import h3.api.basic_int as h3
+
+    area = bbox_area_km2(*bbox)
+    chosen = 0
+    for res in range(max_resolution + 1):
+        if area / h3.average_hexagon_area(res, unit='km^2') > settings.SPATIAL_COVER_CELLS:
+            break
+        chosen = res
+    return chosen
+
+
+def covering_cells(bbox, resolution):
+    """Ячейки разрешения resolution, покрывающие область.
+
+    polygon_to_cells отбирает ячейки по центру, поэтому к ним добавляются ячейки
+    углов и центра области, а набор расширяется на одно кольцо соседей.
+    """
+    import h3.api.basic_int as h3
+
+    min_lat, max_lat, min_lon, max_lon = bbox
+    corners = [(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon)]
+    cells = set(h3.polygon_to_cells(h3.LatLngPoly(corners), resolution))
+    cells.update(h3.latlng_to_cell(lat, lon, resolution) for lat, lon in corners)
+    cells.add(h3.latlng_to_cell((min_lat + max_lat) / 2, (min_lon + max_lon) / 2, resolution))
+
+    disk = grid_disk_cells(np.fromiter(cells, dtype=np.uint64, count=len(cells)), 1)
+    return np.unique(disk[disk != 0])
+
+
+def merged_ranges(cells, cover_resolution, resolution):
+    """Диапазоны [min, max] потомков ячеек cover_resolution на разрешении resolution.
+
+    Соседние по номеру ячейки одного родителя объединяются: промежуток между их
+    диапазонами заполнен только недопустимыми индексами.
+    """
+    cells = np.sort(np.asarray(cells, dtype=np.uint64))
+    low, high = children_ranges(cells, resolution)
+
+    consecutive = np.diff(cells) == np.uint64(1 << (3 * (15 - cover_resolution)))
+    if cover_resolution > 0:
+        parents = cells_to_parent(cells, cover_resolution - 1)
+        consecutive &= parents[1:] == parents[:-1]
+
+    ranges = []
+    start = 0
+    for i in range(1, len(cells) + 1):
+        if i == len(cells) or not consecutive[i - 1]:
+            ranges.append((int(low[start]), int(high[i - 1])))
+            start = i
+    return ranges
+
+
+def h3_range_condition(bbox, column, resolution, max_cover_resolution=None, max_area_km2=None):
+    """Условие SQL по диапазонам индексов column (ячейки разрешения resolution),
+    покрывающим область, или None, если область больше max_area_km2.
+
+    max_cover_resolution ограничивает разрешение покрытия (по умолчанию - resolution).
+    """
+    if not use_h3_ranges(bbox, max_area_km2):
+        return None
+    cover_resolution = covering_resolution(bbox, min(resolution, max_cover_resolution or resolution))
+    ranges = merged_ranges(covering_cells(bbox, cover_resolution), cover_resolution, resolution)
+    # Границы - целые числа, вычисленные здесь же, поэтому подставляются в текст запроса
+    return '(' + ' OR '.join(f'{column} BETWEEN {low} AND {high}' for low, high in ranges) + ')'
+
+
+_h3_index_numeric = False
+
+
+def h3_index_is_numeric():
+    """h3_index хранится как UInt64 (компактная схема); в прежней схеме - строка,
+    и диапазоны по ней не строятся.
+
+    Запоминается только положительный ответ: таблица может ещё не существовать
+    (загрузка идёт в фоне) или быть переведена на новую схему (schema_migration)
+    во время работы процесса, а обратно на строку схема не меняется.
+    """
+    global _h3_index_numeric
+    if not _h3_index_numeric:
+        _h3_index_numeric = execute(
+            'SELECT type FROM system.columns WHERE database = %(db)s AND table = %(table)s AND name = %(name)s',
+            {'db': settings.CLICKHOUSE_DB, 'table': 'coverage_data', 'name': 'h3_index'}
+        ) == [('UInt64',)]
+    return _h3_index_numeric
+
+
+def coverage_bbox_condition(bbox, max_cover_resolution=H3_INDEX_RESOLUTION):
+    """Условие по h3_index для coverage_data (' AND ...') или пустая строка.
+
+    Точки области находятся в ячейках h3_index, потомках покрывающих ячеек
+    разрешения не крупнее max_cover_resolution.
+    """
+    if not h3_index_is_numeric():
+        return ''
+    condition = h3_range_condition(bbox, 'h3_index', H3_INDEX_RESOLUTION, max_cover_resolution)
+    return f' AND {condition}' if condition else ''
@@ -0,0 +1,278 @@
+"""Интерполированная поверхность RSRP/RSRQ по диапазонам.
+
+Поверхность строится заранее (build_surface): центры ячеек H3 из агрегатов
+coverage_h3_rollup индексируются scipy cKDTree, и каждый узел регулярной
+сетки получает IDW-оценку по ближайшим соседям в пределах
+SURFACE_MAX_DISTANCE_M (дальше - NaN, покрытие не оценивается).
+Сетка каждого диапазона - массив float32 (2, height, width) (RSRP, RSRQ;
+строка 0 - северный край) в файле .npy, который читается через memmap, так
+что выборка точки или области не загружает поверхность в память.
+
+Файлы лежат в SURFACE_DIR/<сборка>/, текущая сборка и параметры сетки - в
+SURFACE_DIR/current.json. Новая сборка пишется рядом и включается
+атомарной заменой current.json; поверхность пересобирается при смене
+версии данных.
+"""
+import json
+import math
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.services.aggregation_service import get_hex_aggregates
+from app.services.cache_service import file_lock, get_data_version
+from app.services.spatial_service import KM_PER_DEGREE
+
+# Каналы сетки
+SURFACE_METRICS = ('rsrp', 'rsrq')
+CURRENT_FILE = 'current.json'
+
+_build_lock = threading.Lock()
+_load_lock = threading.Lock()
+_loaded = None
+
+
+def surface_params():
+    """Параметры построения: при их изменении поверхность пересобирается"""
+    return {
+        'resolution': settings.SURFACE_H3_RESOLUTION,
+        'cell_meters': settings.SURFACE_CELL_METERS,
+        'neighbors': settings.SURFACE_NEIGHBORS,
+        'power': settings.SURFACE_POWER,
+        'max_distance_m': settings.SURFACE_MAX_DISTANCE_M,
+    }
+
+
+def surface_grid(min_lat, max_lat, min_lon, max_lon):
+    """Сетка с шагом SURFACE_CELL_METERS (укрупняется, чтобы сторона не превышала SURFACE_MAX_SIDE)"""
+    lat0 = math.radians((min_lat + max_lat) / 2)
+    lat_step = settings.SURFACE_CELL_METERS / 1000 / KM_PER_DEGREE
+    lon_step = lat_step / max(math.cos(lat0), 1e-6)
+    scale = max(
+        1.0,
+        (max_lat - min_lat) / lat_step / settings.SURFACE_MAX_SIDE,
+        (max_lon - min_lon) / lon_step / settings.SURFACE_MAX_SIDE
+    )
+    lat_step *= scale
+    lon_step *= scale
+    return {
+        'bbox': [min_lat, max_lat, min_lon, max_lon],
+        'lat_step': lat_step,
+        'lon_step': lon_step,
+        'height': max(1, math.ceil((max_lat - min_lat) / lat_step)),
+        'width': max(1, math.ceil((max_lon - min_lon) / lon_step)),
+    }
+
+
+def _planar(lat, lon, lat0):
+    """Координаты в км (равнопромежуточная проекция около широты lat0)"""
+    return np.column_stack([
+        np.asarray(lon, dtype=np.float64) * math.cos(math.radians(lat0)),
+        np.asarray(lat, dtype=np.float64)
+    ]) * KM_PER_DEGREE
+
+
+def interpolate_into(out, cells, grid):
+    """IDW-интерполяция средних RSRP/RSRQ ячеек в массив out (2, height, width).
+
+    Узлы сетки обрабатываются полосами строк, поэтому память не зависит от
+    размера сетки; вес соседа - 1/d^SURFACE_POWER.
+    """
+    from scipy.spatial import cKDTree
+
+    min_lat, max_lat, min_lon, _ = grid['bbox']
+    height, width = grid['height'], grid['width']
+    lat0 = (min_lat + max_lat) / 2
+
+    tree = cKDTree(_planar(cells['latitude'], cells['longitude'], lat0))
+    values = cells[['avg_rsrp', 'avg_rsrq']].to_numpy(dtype=np.float64)
+    k = min(settings.SURFACE_NEIGHBORS, len(cells))
+    max_km = settings.SURFACE_MAX_DISTANCE_M / 1000
+
+    lons = min_lon + (np.arange(width) + 0.5) * grid['lon_step']
+    rows_per_block = max(1, settings.SURFACE_BLOCK_POINTS // width)
+    for start in range(0, height, rows_per_block):
+        stop = min(start + rows_per_block, height)
+        lats = max_lat - (np.arange(start, stop) + 0.5) * grid['lat_step']
+        grid_lon, grid_lat = np.meshgrid(lons, lats)
+        distance, index = tree.query(
+            _planar(grid_lat.ravel(), grid_lon.ravel(), lat0),
+            k=k, distance_upper_bound=max_km, workers=-1
+        )
+        if k == 1:
+            distance, index = distance[:, None], index[:, None]
+
+        # Отсутствующий сосед: бесконечное расстояние и индекс len(cells)
+        found = np.isfinite(distance)
+        weights = np.where(found, 1.0 / np.maximum(distance, 1e-6) ** settings.SURFACE_POWER, 0.0)
+        index = np.where(found, index, 0)
+        for channel in range(len(SURFACE_METRICS)):
+            neighbor_values = values[index, channel]
+            valid = np.isfinite(neighbor_values) & found
+            channel_weights = np.where(valid, weights, 0.0)
+            total = channel_weights.sum(axis=1)
+            weighted = (channel_weights * np.where(valid, neighbor_values, 0.0)).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                estimate = np.where(total > 0, weighted / total, np.nan)
+            out[channel, start:stop] = estimate.reshape(stop - start, width)
+
+
+def read_metadata():
+    """Описание текущей сборки или None, если поверхность не строилась"""
+    try:
+        with open(settings.SURFACE_DIR / CURRENT_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_stale(metadata, version=None):
+    version = get_data_version() if version is None else version
+    return metadata is None or metadata['data_version'] != version or metadata['params'] != surface_params()
+
+
+def build_surface(version=None, force=False):
+    """Строит поверхность для версии данных version, если текущая сборка устарела.
+
+    Возвращает описание сборки (или None, если данных нет).
+    """
+    version = get_data_version() if version is None else version
+    # Поверхность общая для процессов uvicorn: строит один, остальные находят готовую сборку
+    with _build_lock, file_lock(settings.SURFACE_DIR / 'build.lock'):
+        metadata = read_metadata()
+        if not force and not is_stale(metadata, version):
+            return metadata
+
+        started = time.perf_counter()
+        resolution = settings.SURFACE_H3_RESOLUTION
+        cells = {band: get_hex_aggregates(resolution, (band,)) for band in settings.BANDS}
+        if all(frame.empty for frame in cells.values()):
+            print("⚠️ Поверхность покрытия не построена: нет данных")
+            return None
+
+        # Область данных с запасом на радиус интерполяции
+        lat = np.concatenate([frame['latitude'].to_numpy(dtype=np.float64) for frame in cells.values()])
+        lon = np.concatenate([frame['longitude'].to_numpy(dtype=np.float64) for frame in cells.values()])
+        pad = settings.SURFACE_MAX_DISTANCE_M / 1000 / KM_PER_DEGREE
+        pad_lon = pad / max(math.cos(math.radians(float(np.mean(lat)))), 1e-6)
+        grid = surface_grid(float(lat.min()) - pad, float(lat.max()) + pad,
+                            float(lon.min()) - pad_lon, float(lon.max()) + pad_lon)
+
+        name = f"build-{version}-{int(time.time())}"
+        directory = settings.SURFACE_DIR / name
+        directory.mkdir(parents=True, exist_ok=True)
+        for band, frame in cells.items():
+            out = np.lib.format.open_memmap(
+                directory / f'{band}.npy', mode='w+', dtype=np.float32,
+                shape=(len(SURFACE_METRICS), grid['height'], grid['width'])
+            )
+            out[:] = np.nan
+            if not frame.empty:
+                interpolate_into(out, frame, grid)
+            out.flush()
+            del out
+
+        metadata = {
+            'directory': name,
+            'data_version': version,
+            'params': surface_params(),
+            'bands': list(cells),
+            'metrics': list(SURFACE_METRICS),
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            **grid,
+        }
+        # Атомарное переключение: читатели видят либо прежнюю, либо новую сборку целиком
+        pending = settings.SURFACE_DIR / (CURRENT_FILE + '.tmp')
+        with open(pending, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(pending, settings.SURFACE_DIR / CURRENT_FILE)
+
+        # Открытые memmap прежних сборок остаются доступны до закрытия
+        for path in settings.SURFACE_DIR.glob('build-*'):
+            if path.name != name:
+                shutil.rmtree(path, ignore_errors=True)
+
+        print(f"🗺️ Поверхность покрытия построена: {grid['width']}x{grid['height']} "
+              f"за {time.perf_counter() - started:.1f} с")
+        return metadata
+
+
+def start_surface_build(version=None):
+    """Сборка в фоновом потоке (после загрузки данных)"""
+    def run():
+        try:
+            build_surface(version)
+        except Exception as e:
+            print(f"❌ Ошибка построения поверхности покрытия: {e}")
+
+    thread = threading.Thread(target=run, name='surface-build', daemon=True)
+    thread.start()
+    return thread
+
+
+class Surface:
+    """Открытая сборка поверхности: выборка точек и областей из memmap"""
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        directory = settings.SURFACE_DIR / metadata['directory']
+        self.grids = {band: np.load(directory / f'{band}.npy', mmap_mode='r') for band in metadata['bands']}
+        self.min_lat, self.max_lat, self.min_lon, self.max_lon = metadata['bbox']
+        self.lat_step = metadata['lat_step']
+        self.lon_step = metadata['lon_step']
+        self.height = metadata['height']
+        self.width = metadata['width']
+
+    def sample(self, lat, lon, bands=None):
+        """Значения в узле сетки, содержащем точку: {band: {rsrp, rsrq}} (None вне данных)"""
+        row = math.floor((self.max_lat - lat) / self.lat_step)
+        col = math.floor((lon - self.min_lon) / self.lon_step)
+        inside = 0 <= row < self.height and 0 <= col < self.width
+        result = {}
+        for band in bands or self.grids:
+            values = self.grids[band][:, row, col] if inside else [np.nan] * len(SURFACE_METRICS)
+            result[band] = {
+                metric: None if np.isnan(value) else round(float(value), 2)
+                for metric, value in zip(SURFACE_METRICS, values)
+            }
+        return result
+
+    def window(self, bbox):
+        """Строки и колонки сетки, покрывающие bbox: (row0, row1, col0, col1)"""
+        min_lat, max_lat, min_lon, max_lon = bbox
+        row0 = max(0, math.floor((self.max_lat - max_lat) / self.lat_step))
+        row1 = min(self.height, math.ceil((self.max_lat - min_lat) / self.lat_step))
+        col0 = max(0, math.floor((min_lon - self.min_lon) / self.lon_step))
+        col1 = min(self.width, math.ceil((max_lon - self.min_lon) / self.lon_step))
+        return row0, max(row0, row1), col0, max(col0, col1)
+
+    def crop(self, bbox, band, metric, step=1):
+        """Фрагмент сетки по области (каждый step-й узел) и его фактические границы"""
+        row0, row1, col0, col1 = self.window(bbox)
+        values = np.array(self.grids[band][SURFACE_METRICS.index(metric), row0:row1:step, col0:col1:step])
+        crop_bbox = [
+            self.max_lat - row1 * self.lat_step, self.max_lat - row0 * self.lat_step,
+            self.min_lon + col0 * self.lon_step, self.min_lon + col1 * self.lon_step,
+        ]
+        return values, crop_bbox
+
+
+def load_surface():
+    """Текущая сборка (переоткрывается при замене current.json) или None"""
+    global _loaded
+    try:
+        stamp = (settings.SURFACE_DIR / CURRENT_FILE).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    loaded = _loaded
+    if loaded is not None and loaded[0] == stamp:
+        return loaded[1]
+    with _load_lock:
+        if _loaded is None or _loaded[0] != stamp:
+            metadata = read_metadata()
+            _loaded = (stamp, Surface(metadata) if metadata is not None else None)
+        return _loaded[1]
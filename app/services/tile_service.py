@@ -0,0 +1,99 @@
+"""XYZ-тайлы: геометрия тайлов и дисковый кеш отрисованных тайлов"""
+import math
+import shutil
+import struct
+import zlib
+from functools import lru_cache
+
+from app.config import settings
+
+TILE_SIZE = 256
+# Половина длины экватора в проекции Web Mercator (EPSG:3857), м
+MERCATOR_EXTENT = 20037508.342789244
+# Доля тайла, на которую расширяется выборка, чтобы крайние гексагоны не обрезались
+TILE_PADDING = 0.15
+# Меньше этой ширины (пикселей тайла) гексагоны не рисуются: тайл пустой
+MIN_HEX_PIXELS = 1.0
+
+
+def hex_pixels(zoom, resolution):
+    """Примерная ширина гексагона разрешения resolution в пикселях тайла масштаба zoom (на экваторе)"""
+    import h3
+
+    meters_per_pixel = 2 * MERCATOR_EXTENT / (TILE_SIZE * 2 ** zoom)
+    return 2 * h3.average_hexagon_edge_length(resolution, unit='m') / meters_per_pixel
+
+
+def resolution_for_zoom(zoom):
+    """Разрешение H3, при котором гексагон занимает порядка 10-30 пикселей тайла,
+    или None, если даже самые крупные гексагоны меньше MIN_HEX_PIXELS: такой тайл
+    охватывает почти все данные, а отрисовал бы только точки
+    """
+    resolutions = sorted(settings.H3_RESOLUTIONS)
+    resolution = min(max(zoom - 4, resolutions[0]), resolutions[-1])
+    if hex_pixels(zoom, resolution) < MIN_HEX_PIXELS:
+        return None
+    return resolution
+
+
+@lru_cache(maxsize=1)
+def empty_tile():
+    """Прозрачный PNG-тайл TILE_SIZE x TILE_SIZE (без Matplotlib и пула отрисовки)"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    # Строка изображения: байт фильтра и RGBA-пиксели
+    rows = (b'\x00' + b'\x00' * 4 * TILE_SIZE) * TILE_SIZE
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', TILE_SIZE, TILE_SIZE, 8, 6, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(rows)),
+        chunk(b'IEND', b''),
+    ])
+
+
+def tile_mercator_bounds(z, x, y):
+    """Границы тайла в метрах Web Mercator: (min_x, min_y, max_x, max_y)"""
+    span = 2 * MERCATOR_EXTENT / 2 ** z
+    min_x = -MERCATOR_EXTENT + x * span
+    max_y = MERCATOR_EXTENT - y * span
+    return min_x, max_y - span, min_x + span, max_y
+
+
+def tile_bbox(z, x, y, padding=TILE_PADDING):
+    """Границы тайла в градусах (min_lat, max_lat, min_lon, max_lon) с запасом padding"""
+    n = 2 ** z
+
+    def lon(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (
+        max(lat(y + 1 + padding), -85.0511),
+        min(lat(y - padding), 85.0511),
+        max(lon(x - padding), -180.0),
+        min(lon(x + 1 + padding), 180.0)
+    )
+
+
+def tile_path(version, band, metric, z, x, y):
+    return settings.TILE_CACHE_DIR / str(version) / band / metric / str(z) / str(x) / f"{y}.png"
+
+
+def read_tile(path):
+    """Содержимое тайла из кеша или None"""
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def purge_stale_tiles(version):
+    """Удаляет тайлы всех версий данных, кроме текущей"""
+    if not settings.TILE_CACHE_DIR.is_dir():
+        return
+    for entry in settings.TILE_CACHE_DIR.iterdir():
+        if entry.is_dir() and entry.name != str(version):
+            shutil.rmtree(entry, ignore_errors=True)
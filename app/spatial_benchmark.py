@@ -0,0 +1,138 @@
+"""Замер отбора по области: сколько гранул читается при разных размерах
+области и способах отбора.
+
+Для квадратов нарастающего размера вокруг центра данных выполняется
+EXPLAIN indexes=1 и сам запрос агрегатов, который строит
+aggregation_service.hex_aggregates_query, по двум источникам:
+  rollup - агрегаты coverage_h3_rollup (запросы карт без времени или по суткам);
+  raw    - coverage_data (интервал времени не по границе суток).
+Способ отбора задаётся порогом SPATIAL_H3_MAX_AREA_KM2 на время замера:
+  scan   - выбор по размеру области, индексы пропуска отключены;
+  minmax - всегда без диапазонов H3 (условие по широте/долготе и minmax-индексы);
+  h3     - всегда диапазоны H3 в первичном ключе;
+  auto   - вариант, который выбирается по размеру области.
+
+Запуск: python -m app.spatial_benchmark [--sizes 0.5,1,2,5,10,20,50] [--resolution 10] [--json]
+"""
+import argparse
+import json
+import math
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from app.config import settings
+from app.database import column_types, get_clickhouse_client
+from app.services.aggregation_service import hex_aggregates_query
+from app.services.spatial_service import KM_PER_DEGREE, bbox_area_km2
+
+GRANULES = re.compile(r'Granules:\s*(\d+)/(\d+)')
+
+# Начало интервала не по границе суток направляет запрос в coverage_data
+RAW_TIME_RANGE = (datetime(1970, 1, 1, 0, 0, 1), None)
+SOURCES = {'rollup': None, 'raw': RAW_TIME_RANGE}
+# Вариант -> порог площади для диапазонов H3 (None - значение из настроек)
+VARIANT_MAX_AREA = {'scan': None, 'minmax': 0.0, 'h3': math.inf, 'auto': None}
+
+
+def square_bbox(center, half_size_km):
+    lat, lon = center
+    d_lat = half_size_km / KM_PER_DEGREE
+    d_lon = half_size_km / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+    return lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon
+
+
+def granules(client, query, params, query_settings):
+    """(выбрано, всего) гранул по EXPLAIN indexes=1: всего - до первого индекса, выбрано - после последнего"""
+    plan = '\n'.join(row[0] for row in client.execute(f'EXPLAIN indexes = 1 {query}', params, settings=query_settings))
+    matches = GRANULES.findall(plan)
+    if not matches:
+        return None, None
+    return int(matches[-1][0]), int(matches[0][1])
+
+
+@contextmanager
+def h3_area_limit(max_area_km2):
+    """Временно меняет порог SPATIAL_H3_MAX_AREA_KM2 (None - без изменений)"""
+    saved = settings.SPATIAL_H3_MAX_AREA_KM2
+    if max_area_km2 is not None:
+        settings.SPATIAL_H3_MAX_AREA_KM2 = max_area_km2
+    try:
+        yield
+    finally:
+        settings.SPATIAL_H3_MAX_AREA_KM2 = saved
+
+
+def measure(client, bbox, resolution, source, variant):
+    query_settings = {'use_skip_indexes': 0 if variant == 'scan' else 1, 'use_uncompressed_cache': 0}
+    with h3_area_limit(VARIANT_MAX_AREA[variant]):
+        query, params = hex_aggregates_query(resolution, bbox=bbox, time_range=SOURCES[source])
+
+    selected, total = granules(client, query, params, query_settings)
+    started = time.perf_counter()
+    rows = client.execute(query, params, settings=query_settings)
+    elapsed = time.perf_counter() - started
+    progress = client.last_query.progress
+    return {
+        'source': source,
+        'variant': variant,
+        'granules_selected': selected,
+        'granules_total': total,
+        'rows_read': progress.rows,
+        'bytes_read': progress.bytes,
+        'cells': len(rows),
+        'points': sum(row[2] for row in rows),
+        'latency_ms': round(elapsed * 1000, 1),
+    }
+
+
+def run(sizes, resolution, variants=('scan', 'minmax', 'h3', 'auto')):
+    client = get_clickhouse_client()
+    if column_types(client).get('h3_index') != 'UInt64':
+        print("h3_index хранится строкой (прежняя схема): в coverage_data диапазоны H3 не применяются, "
+              "см. app.schema_migration")
+
+    center = client.execute(f'''
+    SELECT quantileExact(0.5)(latitude), quantileExact(0.5)(longitude)
+    FROM {settings.CLICKHOUSE_DB}.coverage_data
+    ''')[0]
+
+    results = []
+    for half_size in sizes:
+        bbox = square_bbox(center, half_size)
+        for source in SOURCES:
+            for variant in variants:
+                row = measure(client, bbox, resolution, source, variant)
+                row.update(half_size_km=half_size, area_km2=round(bbox_area_km2(*bbox), 2))
+                results.append(row)
+    return results
+
+
+def print_table(results):
+    print(f"{'площадь, км²':>14} {'источник':<8} {'вариант':<8} {'гранулы':>15} {'строк':>12} "
+          f"{'ячеек':>8} {'точек':>10} {'мс':>8}")
+    for row in results:
+        granules_text = f"{row['granules_selected']}/{row['granules_total']}"
+        print(f"{row['area_km2']:>14} {row['source']:<8} {row['variant']:<8} {granules_text:>15} "
+              f"{row['rows_read']:>12} {row['cells']:>8} {row['points']:>10} {row['latency_ms']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Гранулы, читаемые запросом агрегатов при отборе по области")
+    parser.add_argument('--sizes', default='0.5,1,2,5,10,20,50',
+                        help="половины сторон квадратов, км (через запятую)")
+    parser.add_argument('--resolution', type=int, default=10, choices=settings.H3_RESOLUTIONS,
+                        help="разрешение H3 агрегатов")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    results = run([float(size) for size in args.sizes.split(',')], args.resolution)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""Нагрузочные замеры: синтетические данные, локальная замена ClickHouse и сценарии.
+
+Запуск: python -m benchmarks.run --help
+"""
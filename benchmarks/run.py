@@ -0,0 +1,339 @@
+"""Замеры загрузки и эндпоинтов на синтетических данных.
+
+Для каждого объёма данных:
+  1. генерируется CSV с drive-test измерениями (benchmarks.synthetic);
+  2. файл загружается load_data_to_clickhouse в отдельном процессе -
+     скорость загрузки (строк/с) и пиковая память;
+  3. приложение запускается в отдельном процессе (benchmarks.serve), и каждый
+     эндпоинт запрашивается --requests раз: время первого запроса, p50/p99 и
+     пиковая память сервера вместе с процессами отрисовки.
+
+Кеш отрисованных карт отключается (RENDER_CACHE_MAX_BYTES=0 и
+RENDER_DISK_CACHE_MAX_BYTES=0), чтобы повторные запросы отрисовывали карту заново; профиль данных кешируется до смены данных,
+поэтому для /api/check-data показателен первый запрос (cold_ms).
+
+Хранилище (--backend):
+  clickhouse - настоящий сервер (база --database пересоздаётся!);
+  chdb       - встроенный ClickHouse из пакета chdb, без сервера;
+  record     - настоящий сервер, ответы записываются в --recordings;
+  replay     - записанные ответы без ClickHouse (замер только Python-части).
+По умолчанию - chdb, если пакет установлен, иначе replay при наличии записей.
+
+python -m benchmarks.run --sizes 10k,1M,10M --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import synthetic
+from benchmarks.standin import chdb_available, install
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BBOX = {
+    'min_lat': synthetic.BASE_STATION[0] - 0.03, 'max_lat': synthetic.BASE_STATION[0] + 0.03,
+    'min_lon': synthetic.BASE_STATION[1] - 0.05, 'max_lon': synthetic.BASE_STATION[1] + 0.05,
+}
+
+# (имя, метод, путь, тело запроса)
+SCENARIOS = [
+    ('coverage-data', 'GET', '/coverage-data', None),
+    ('coverage-hexmap', 'GET', '/coverage-hexmap?resolution=9&metric=rsrp&format=png', None),
+    ('coverage', 'POST', '/coverage?format=png', BBOX),
+    ('check-data', 'GET', '/api/check-data', None),
+]
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    """Суммарный RSS процесса и всех его потомков, байт"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+        except psutil.Error:
+            return 0
+
+    parents = {}
+    for entry in Path('/proc').iterdir():
+        if entry.name.isdigit():
+            try:
+                stat = (entry / 'stat').read_text()
+            except OSError:
+                continue
+            parents[int(entry.name)] = int(stat.rsplit(')', 1)[1].split()[1])
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [child for child, ppid in parents.items() if ppid == parent]
+        tree.update(children)
+        frontier.extend(children)
+
+    total = 0
+    for member in tree:
+        try:
+            for line in Path(f'/proc/{member}/status').read_text().splitlines():
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler:
+    """Пиковый RSS дерева процессов за время замера (опрос в фоновом потоке)"""
+
+    def __init__(self, pid, interval=0.02):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def ingest_job(backend, path, csv_path, database):
+    """Загрузка файла в отдельном процессе: строки, секунды, пиковый RSS"""
+    install(backend, path)
+    from app import database as db
+    from app.config import settings
+
+    if backend == 'clickhouse':
+        # Соединение без базы: клиент приложения подключается к уже существующей
+        from clickhouse_driver import Client
+
+        server = Client(host=settings.CLICKHOUSE_HOST, user=settings.CLICKHOUSE_USER,
+                        password=settings.CLICKHOUSE_PASSWORD)
+        server.execute(f'DROP DATABASE IF EXISTS {database}')
+        server.execute(f'CREATE DATABASE {database}')
+        server.disconnect()
+    client = db.init_database()
+    started = time.perf_counter()
+    rows = db.load_data_to_clickhouse(client, csv_path)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss - КБ в Linux
+    return rows, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def request(base_url, method, path, body):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'} if data else {})
+    started = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=600) as response:
+        payload = response.read()
+    return time.perf_counter() - started, len(payload)
+
+
+def wait_ready(base_url, server, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {server.returncode}")
+        try:
+            urllib.request.urlopen(base_url + '/readyz', timeout=5).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise TimeoutError("Сервер не запустился")
+
+
+def measure_endpoint(base_url, pid, method, path, body, requests):
+    timings, errors, size, cold = [], 0, 0, None
+    with RssSampler(pid) as sampler:
+        try:
+            cold, size = request(base_url, method, path, body)
+        except urllib.error.HTTPError:
+            errors += 1
+        for _ in range(requests):
+            try:
+                elapsed, size = request(base_url, method, path, body)
+                timings.append(elapsed)
+            except urllib.error.HTTPError:
+                errors += 1
+    timings_ms = np.array(timings) * 1000
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'cold_ms': round(cold * 1000, 2) if cold is not None else None,
+        'p50_ms': round(float(np.percentile(timings_ms, 50)), 2) if len(timings) else None,
+        'p99_ms': round(float(np.percentile(timings_ms, 99)), 2) if len(timings) else None,
+        'mean_ms': round(float(timings_ms.mean()), 2) if len(timings) else None,
+        'response_bytes': size,
+        'peak_rss_bytes': sampler.peak,
+    }
+
+
+def run_size(rows, args, workdir, env):
+    result = {'rows': rows}
+
+    csv_path = workdir / f'drive_{rows}.csv'
+    if not csv_path.exists():
+        started = time.perf_counter()
+        synthetic.write_csv(csv_path, rows, sites=args.sites,
+                            band_mix={'LTE1800': args.lte1800_share, 'LTE2100': 1 - args.lte1800_share})
+        result['generate_s'] = round(time.perf_counter() - started, 2)
+
+    # Хранилище для этого объёма: каталог chdb или файл записи ответов
+    if args.backend == 'chdb':
+        store = workdir / f'chdb_{rows}'
+        shutil.rmtree(store, ignore_errors=True)
+    else:
+        store = Path(args.recordings) / f'{rows}.pickle' if args.recordings else None
+    ingest_backend = 'clickhouse' if args.backend == 'record' else args.backend
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        loaded, seconds, peak = pool.submit(ingest_job, ingest_backend, str(store), str(csv_path), args.database).result()
+    result['ingest'] = {
+        'rows': loaded,
+        'seconds': round(seconds, 2),
+        'rows_per_s': round(loaded / seconds) if seconds else None,
+        'peak_rss_bytes': peak,
+    }
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.serve', '--backend', args.backend, '--path', str(store), '--port', str(port)],
+        cwd=ROOT, env=env
+    )
+    try:
+        wait_ready(base_url, server, args.startup_timeout)
+        result['server_idle_rss_bytes'] = process_tree_rss(server.pid)
+        result['endpoints'] = {
+            name: measure_endpoint(base_url, server.pid, method, path, body, args.requests)
+            for name, method, path, body in SCENARIOS
+        }
+    finally:
+        # SIGINT - штатная остановка uvicorn (сохранение записи ответов)
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры загрузки и эндпоинтов на синтетических данных")
+    parser.add_argument('--sizes', default='10k,1M,10M', help="объёмы данных через запятую (10k, 1M, 10M)")
+    parser.add_argument('--backend', default='auto', choices=['auto', 'clickhouse', 'chdb', 'record', 'replay'])
+    parser.add_argument('--database', default='lte_coverage_bench', help="база ClickHouse для замеров (пересоздаётся)")
+    parser.add_argument('--recordings', help="каталог записей ответов для record/replay")
+    parser.add_argument('--workdir', help="каталог для сгенерированных файлов (по умолчанию - временный)")
+    parser.add_argument('--requests', type=int, default=30, help="запросов к каждому эндпоинту")
+    parser.add_argument('--sites', type=int, default=7, help="число сайтов вокруг базовой станции")
+    parser.add_argument('--lte1800-share', type=float, default=0.6, help="доля измерений LTE1800")
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--output', help="файл для результата JSON (по умолчанию - stdout)")
+    args = parser.parse_args()
+
+    if args.backend == 'auto':
+        if chdb_available():
+            args.backend = 'chdb'
+        elif args.recordings:
+            args.backend = 'replay'
+        else:
+            parser.error("chdb не установлен: укажите --backend clickhouse или записи ответов (--recordings)")
+    if args.backend in ('record', 'replay') and not args.recordings:
+        parser.error(f"Для --backend {args.backend} нужен --recordings")
+    if args.recordings:
+        Path(args.recordings).mkdir(parents=True, exist_ok=True)
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='lte_bench_'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    (workdir / 'empty').mkdir(exist_ok=True)
+
+    # Настройки приложения для дочерних процессов (и загрузки в этом процессе)
+    os.environ.update({
+        'CLICKHOUSE_DB': args.database,
+        'DATA_DIR': str(workdir / 'empty'),
+        'TILE_CACHE_DIR': str(workdir / 'tiles'),
+        'RENDER_CACHE_MAX_BYTES': '0',
+        'RENDER_DISK_CACHE_MAX_BYTES': '0',
+        'RENDER_CACHE_DIR': str(workdir / 'render'),
+        'DATA_VERSION_FILE': str(workdir / 'data_version'),
+        # Фоновое построение поверхности исказило бы замеры и перезаписало cache/surface
+        'SURFACE_DIR': str(workdir / 'surface'),
+        'SURFACE_AUTO_BUILD': '0',
+    })
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'backend': args.backend,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'requests': args.requests,
+        },
+        'results': [],
+    }
+    for size in args.sizes.split(','):
+        rows = parse_size(size)
+        print(f"Объём {rows:,} строк ({args.backend})", file=sys.stderr)
+        report['results'].append(run_size(rows, args, workdir, env))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding='utf-8')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""Запуск приложения с заменителем ClickHouse (для benchmarks.run).
+
+python -m benchmarks.serve --backend chdb --path /tmp/bench/chdb --port 8765
+"""
+import argparse
+
+import uvicorn
+
+from benchmarks.standin import install
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Приложение с заменителем ClickHouse")
+    parser.add_argument('--backend', default='clickhouse', choices=['clickhouse', 'chdb', 'record', 'replay'])
+    parser.add_argument('--path', help="каталог данных chdb или файл записи ответов")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    # Подмена до импорта приложения: пул и init_database берут клиента из app.database
+    install(args.backend, args.path)
+    from app.main import app
+
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
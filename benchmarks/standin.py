@@ -0,0 +1,358 @@
+"""Замена сервера ClickHouse для замеров без сетевой базы.
+
+ChdbClient - встроенный ClickHouse (пакет chdb) с интерфейсом clickhouse-driver
+в объёме, который использует приложение: execute (в т.ч. columnar и
+with_column_types), insert_dataframe, потоковое чтение блоков для
+iter_column_blocks и last_query.progress.
+
+RecordingClient записывает ответы настоящего сервера, ReplayClient отдаёт
+записанные ответы: так замеряется вся обработка на стороне Python (DataFrame,
+H3, отрисовка, сериализация) без ClickHouse.
+
+install(backend) подменяет app.database.get_clickhouse_client.
+"""
+import atexit
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+BLOCK_ROWS = 65536
+
+# Настройки клиента clickhouse-driver, которые не передаются серверу
+CLIENT_SETTINGS = {'use_numpy'}
+
+
+def escape(value):
+    """Литерал ClickHouse для параметра запроса"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(value.item() if isinstance(value, np.generic) else value)
+    if isinstance(value, datetime):
+        return f"'{value.strftime('%Y-%m-%d %H:%M:%S')}'"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}'"
+    if isinstance(value, (list, tuple)):
+        return '(' + ', '.join(escape(item) for item in value) + ')'
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def substitute(query, params):
+    if not params:
+        return query
+    return query % {key: escape(value) for key, value in params.items()}
+
+
+def normalize(query):
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def _inner_type(column_type):
+    for wrapper in ('Nullable(', 'LowCardinality(', 'SimpleAggregateFunction('):
+        if column_type.startswith(wrapper):
+            column_type = column_type[len(wrapper):-1]
+            if wrapper == 'SimpleAggregateFunction(':
+                column_type = column_type.split(',', 1)[1].strip()
+    return column_type
+
+
+def convert_value(value, column_type):
+    """Значение из JSONCompact в тип Python, как его возвращает clickhouse-driver"""
+    column_type = _inner_type(column_type)
+    if column_type.startswith('Array('):
+        return [convert_value(item, column_type[6:-1]) for item in value]
+    if value is None:
+        return float('nan') if column_type.startswith('Float') else None
+    if column_type.startswith(('Int', 'UInt')):
+        return int(value)
+    if column_type.startswith('Float'):
+        return float(value)
+    if column_type.startswith('DateTime'):
+        return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    if column_type == 'Date':
+        return date.fromisoformat(value)
+    return value
+
+
+NUMPY_TYPES = {
+    'UInt8': np.uint8, 'UInt16': np.uint16, 'UInt32': np.uint32, 'UInt64': np.uint64,
+    'Int8': np.int8, 'Int16': np.int16, 'Int32': np.int32, 'Int64': np.int64,
+    'Float32': np.float32, 'Float64': np.float64,
+}
+
+
+def to_numpy(column, column_type):
+    dtype = NUMPY_TYPES.get(_inner_type(column_type))
+    if dtype is not None:
+        return np.asarray(column, dtype=dtype)
+    if _inner_type(column_type).startswith('DateTime'):
+        return np.asarray(column, dtype='datetime64[s]')
+    return np.asarray(column, dtype=object)
+
+
+class _Block:
+    def __init__(self, columns):
+        self.columns = columns
+        self.num_rows = len(columns[0]) if columns else 0
+
+    def get_columns(self):
+        return self.columns
+
+
+class _Connection:
+    """Минимум соединения clickhouse-driver для iter_column_blocks"""
+
+    def __init__(self, client):
+        self.client = client
+        self.context = None
+        self.query = None
+
+    def send_query(self, query, *args, **kwargs):
+        self.query = query
+
+    def send_external_tables(self, tables):
+        pass
+
+
+class StandInClient:
+    """Общая часть клиентов-заменителей: разбор вызовов clickhouse-driver"""
+
+    def __init__(self):
+        self.connection = _Connection(self)
+        self.last_query = SimpleNamespace(progress=SimpleNamespace(rows=0, bytes=0, total_rows=0), elapsed=0.0)
+        self._block_settings = {}
+
+    def run(self, query, query_settings):
+        """Выполняет запрос: (строки, [(имя, тип)])"""
+        raise NotImplementedError
+
+    def insert_rows(self, query, rows):
+        raise NotImplementedError
+
+    def insert_dataframe(self, query, dataframe, settings=None):
+        raise NotImplementedError
+
+    def execute(self, query, params=None, with_column_types=False, columnar=False, settings=None, **kwargs):
+        if isinstance(params, (list, tuple)) and normalize(query).upper().endswith('VALUES'):
+            self.insert_rows(query, params)
+            return []
+        rows, columns = self.run(substitute(query, params), settings or {})
+        result = rows
+        if columnar:
+            result = [list(column) for column in zip(*rows)] if rows else []
+            if (settings or {}).get('use_numpy'):
+                result = [to_numpy(column, column_type) for column, (_, column_type) in zip(result, columns)]
+        if with_column_types:
+            return result, columns
+        return result
+
+    def substitute_params(self, query, params, context):
+        return substitute(query, params)
+
+    @contextmanager
+    def disconnect_on_error(self, query, settings):
+        self._block_settings = settings or {}
+        yield
+
+    def packet_generator(self):
+        rows, columns = self.run(self.connection.query, self._block_settings)
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            yield SimpleNamespace(block=_Block([
+                to_numpy(column, column_type)
+                for column, (_, column_type) in zip(zip(*block), columns)
+            ]))
+
+    def disconnect(self):
+        pass
+
+
+class ChdbClient(StandInClient):
+    """Встроенный ClickHouse (chdb): одна сессия на процесс, запросы по очереди"""
+
+    _session = None
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        super().__init__()
+        with ChdbClient._lock:
+            if ChdbClient._session is None:
+                from chdb import session
+
+                ChdbClient._session = session.Session(path)
+
+    def _query(self, query, output_format='JSONCompact'):
+        with ChdbClient._lock:
+            started = time.perf_counter()
+            result = ChdbClient._session.query(query, output_format)
+            elapsed = time.perf_counter() - started
+        rows_read = getattr(result, 'rows_read', lambda: 0)()
+        bytes_read = getattr(result, 'bytes_read', lambda: 0)()
+        self.last_query = SimpleNamespace(
+            progress=SimpleNamespace(rows=rows_read, bytes=bytes_read, total_rows=rows_read),
+            elapsed=elapsed
+        )
+        return result
+
+    def run(self, query, query_settings):
+        server_settings = {k: v for k, v in query_settings.items() if k not in CLIENT_SETTINGS}
+        if server_settings:
+            statement = normalize(query).upper()
+            if statement.startswith(('SELECT', 'WITH', 'INSERT')):
+                query += ' SETTINGS ' + ', '.join(f'{k} = {escape(v)}' for k, v in server_settings.items())
+        result = self._query(query)
+        payload = result.bytes() if hasattr(result, 'bytes') else bytes(result)
+        if not payload.strip():
+            return [], []
+        data = json.loads(payload)
+        columns = [(column['name'], column['type']) for column in data['meta']]
+        rows = [
+            tuple(convert_value(value, column_type) for value, (_, column_type) in zip(row, columns))
+            for row in data['data']
+        ]
+        return rows, columns
+
+    def _table_structure(self, query):
+        """Таблица и структура колонок из 'INSERT INTO db.table (a, b) VALUES'"""
+        match = re.match(r'\s*INSERT INTO\s+([\w.]+)\s*\(([^)]*)\)', query, re.IGNORECASE)
+        table, names = match.group(1), [name.strip() for name in match.group(2).split(',')]
+        database, _, name = table.rpartition('.')
+        rows, _ = self.run(substitute(
+            'SELECT name, type FROM system.columns WHERE database = %(db)s AND table = %(table)s',
+            {'db': database or 'default', 'table': name}
+        ), {})
+        types = dict(rows)
+        return table, names, ', '.join(f'{column} {types[column]}' for column in names)
+
+    def _insert_csv(self, query, write):
+        table, names, structure = self._table_structure(query)
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            write(path, names)
+            self._query(
+                f"INSERT INTO {table} ({', '.join(names)}) "
+                f"SELECT * FROM file('{path}', 'CSVWithNames', '{structure}')"
+            )
+        finally:
+            os.unlink(path)
+
+    def insert_rows(self, query, rows):
+        import pandas as pd
+
+        def write(path, names):
+            pd.DataFrame(list(rows), columns=names).to_csv(path, index=False)
+
+        self._insert_csv(query, write)
+
+    def insert_dataframe(self, query, dataframe, settings=None):
+        def write(path, names):
+            dataframe[names].to_csv(path, index=False, na_rep='nan', date_format='%Y-%m-%d %H:%M:%S')
+
+        self._insert_csv(query, write)
+        return len(dataframe)
+
+
+class RecordingClient(StandInClient):
+    """Настоящий clickhouse-driver Client, ответы которого записываются в файл"""
+
+    _records = {}
+    _lock = threading.Lock()
+    _path = None
+
+    def __init__(self, path):
+        super().__init__()
+        from clickhouse_driver import Client
+        from app.config import settings
+
+        self.client = Client(host=settings.CLICKHOUSE_HOST, user=settings.CLICKHOUSE_USER,
+                             password=settings.CLICKHOUSE_PASSWORD, database=settings.CLICKHOUSE_DB)
+        with RecordingClient._lock:
+            if RecordingClient._path is None:
+                RecordingClient._path = path
+                atexit.register(RecordingClient.save)
+
+    @classmethod
+    def save(cls):
+        with cls._lock, open(cls._path, 'wb') as f:
+            pickle.dump(cls._records, f)
+
+    def run(self, query, query_settings):
+        settings = {k: v for k, v in query_settings.items() if k not in CLIENT_SETTINGS}
+        rows, columns = self.client.execute(query, settings=settings, with_column_types=True)
+        self.last_query = self.client.last_query
+        with RecordingClient._lock:
+            RecordingClient._records[normalize(query)] = (rows, columns)
+        return rows, columns
+
+    def insert_rows(self, query, rows):
+        self.client.execute(query, rows)
+
+    def insert_dataframe(self, query, dataframe, settings=None):
+        return self.client.insert_dataframe(query, dataframe, settings=settings)
+
+    def disconnect(self):
+        self.client.disconnect()
+
+
+class ReplayClient(StandInClient):
+    """Ответы из файла RecordingClient; вставки только считаются"""
+
+    _records = None
+
+    def __init__(self, path):
+        super().__init__()
+        if ReplayClient._records is None:
+            with open(path, 'rb') as f:
+                ReplayClient._records = pickle.load(f)
+        self.inserted_rows = 0
+
+    def run(self, query, query_settings):
+        rows, columns = ReplayClient._records.get(normalize(query), ([], []))
+        self.last_query = SimpleNamespace(
+            progress=SimpleNamespace(rows=len(rows), bytes=0, total_rows=len(rows)), elapsed=0.0
+        )
+        return rows, columns
+
+    def insert_rows(self, query, rows):
+        self.inserted_rows += len(rows)
+
+    def insert_dataframe(self, query, dataframe, settings=None):
+        self.inserted_rows += len(dataframe)
+        return len(dataframe)
+
+
+BACKENDS = {
+    'chdb': ChdbClient,
+    'record': RecordingClient,
+    'replay': ReplayClient,
+}
+
+
+def chdb_available():
+    try:
+        import chdb  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def install(backend, path):
+    """Подменяет фабрику клиентов приложения; backend 'clickhouse' - настоящий сервер"""
+    if backend == 'clickhouse':
+        return
+    import app.database
+
+    client_class = BACKENDS[backend]
+    app.database.get_clickhouse_client = lambda: client_class(path)
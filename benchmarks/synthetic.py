@@ -0,0 +1,115 @@
+"""Генератор синтетических drive-test измерений.
+
+Маршруты - случайные блуждания вокруг базовой станции, уровень сигнала
+считается по модели потерь на трассе (3GPP TR 36.942, городская среда)
+до ближайшего сектора с логнормальным затенением. Колонки совпадают с
+исходными выгрузками (servingcellrsrp, servingcellrsrq, height), поэтому
+файл загружается обычным load_data_to_clickhouse.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BASE_STATION = (52.27664, 104.27792)
+KM_PER_DEGREE = 111.32
+
+# Мощность на ресурсный элемент (дБм) и поправка на частоту (дБ) по диапазонам
+BAND_PROFILES = {
+    'LTE1800': {'power': 18.0, 'frequency_loss': 0.0},
+    'LTE2100': {'power': 18.0, 'frequency_loss': 2.2},
+}
+
+
+def site_positions(sites, center=BASE_STATION, spacing_km=1.5, seed=0):
+    """Координаты сайтов: первый - в центре, остальные - по кольцам вокруг"""
+    rng = np.random.default_rng(seed)
+    lat0, lon0 = center
+    positions = [(lat0, lon0)]
+    for i in range(1, sites):
+        angle = 2 * np.pi * i / max(sites - 1, 1) + rng.uniform(-0.3, 0.3)
+        distance = spacing_km * (1 + (i - 1) // 6) * rng.uniform(0.8, 1.2)
+        positions.append((
+            lat0 + distance * np.sin(angle) / KM_PER_DEGREE,
+            lon0 + distance * np.cos(angle) / (KM_PER_DEGREE * np.cos(np.radians(lat0)))
+        ))
+    return np.array(positions)
+
+
+def generate_chunk(rows, rng, sites, band_mix, center, radius_km, start_time, step_seconds=1.0):
+    """Блок измерений: маршруты по 500-2000 точек, шаг около 10 м"""
+    lat0, lon0 = center
+    km_per_lon = KM_PER_DEGREE * np.cos(np.radians(lat0))
+
+    route_lengths = []
+    while sum(route_lengths) < rows:
+        route_lengths.append(int(rng.integers(500, 2000)))
+    route_lengths[-1] -= sum(route_lengths) - rows
+    route_id = np.repeat(np.arange(len(route_lengths)), route_lengths)
+
+    # Старт маршрута - случайная точка в круге, далее шаги со случайным поворотом
+    start_r = radius_km * np.sqrt(rng.random(len(route_lengths)))
+    start_a = rng.uniform(0, 2 * np.pi, len(route_lengths))
+    heading = np.cumsum(rng.normal(0, 0.15, rows)) + start_a[route_id]
+    step_km = rng.uniform(0.005, 0.015, rows)
+    dx = step_km * np.cos(heading)
+    dy = step_km * np.sin(heading)
+    # Накопленная сумма внутри каждого маршрута
+    offsets = np.concatenate([[0], np.cumsum(route_lengths)[:-1]])
+    x = np.cumsum(dx) - np.repeat(np.cumsum(dx)[offsets] - dx[offsets], route_lengths)
+    y = np.cumsum(dy) - np.repeat(np.cumsum(dy)[offsets] - dy[offsets], route_lengths)
+    x += (start_r * np.cos(start_a))[route_id]
+    y += (start_r * np.sin(start_a))[route_id]
+
+    latitude = lat0 + y / KM_PER_DEGREE
+    longitude = lon0 + x / km_per_lon
+
+    bands = np.array(list(band_mix))
+    weights = np.array([band_mix[band] for band in bands], dtype=float)
+    band_code = rng.choice(len(bands), size=rows, p=weights / weights.sum())
+
+    # Расстояние до ближайшего сайта, км
+    site_x = (sites[:, 1] - lon0) * km_per_lon
+    site_y = (sites[:, 0] - lat0) * KM_PER_DEGREE
+    distance = np.sqrt((x[:, None] - site_x) ** 2 + (y[:, None] - site_y) ** 2).min(axis=1)
+    distance = np.maximum(distance, 0.02)
+
+    power = np.array([BAND_PROFILES.get(b, BAND_PROFILES['LTE1800'])['power'] for b in bands])
+    frequency_loss = np.array([BAND_PROFILES.get(b, BAND_PROFILES['LTE1800'])['frequency_loss'] for b in bands])
+    path_loss = 128.1 + 37.6 * np.log10(distance) + frequency_loss[band_code]
+    rsrp = np.clip(power[band_code] - path_loss + rng.normal(0, 8, rows), -140, -44)
+    rsrq = np.clip(-3 - 17 * (rsrp + 44) / -96 + rng.normal(0, 1.5, rows), -20, -3)
+
+    eventtime = start_time + pd.to_timedelta(np.arange(rows) * step_seconds, unit='s')
+
+    return pd.DataFrame({
+        'latitude': latitude,
+        'longitude': longitude,
+        'height': rng.normal(450, 15, rows).round(1),
+        'band': bands[band_code],
+        'servingcellrsrp': rsrp.round(1),
+        'servingcellrsrq': rsrq.round(1),
+        'eventtime': eventtime,
+    })
+
+
+def generate(rows, chunk_rows=100_000, sites=7, band_mix=None, center=BASE_STATION, radius_km=5.0,
+             start_time=datetime(2025, 1, 1), seed=0):
+    """Итератор блоков DataFrame общей длиной rows"""
+    rng = np.random.default_rng(seed)
+    band_mix = band_mix or {'LTE1800': 0.6, 'LTE2100': 0.4}
+    positions = site_positions(sites, center, seed=seed)
+    start = pd.Timestamp(start_time)
+    produced = 0
+    while produced < rows:
+        size = min(chunk_rows, rows - produced)
+        yield generate_chunk(size, rng, positions, band_mix, center, radius_km,
+                             start + pd.Timedelta(seconds=produced))
+        produced += size
+
+
+def write_csv(path, rows, **kwargs):
+    """Записывает rows измерений в CSV (формат выгрузок) и возвращает путь"""
+    for number, chunk in enumerate(generate(rows, **kwargs)):
+        chunk.to_csv(path, mode='w' if number == 0 else 'a', header=number == 0, index=False)
+    return path
@@ -0,0 +1,21 @@
+"""Курсор страниц /coverage-data: band:h3_index"""
+import pytest
+
+np = pytest.importorskip('numpy')
+h3 = pytest.importorskip('h3.api.basic_int')
+
+from app.services.export_service import encode_cursor, parse_cursor  # noqa: E402
+
+
+@pytest.mark.parametrize('band', ['LTE1800', 'LTE:2100'])
+def test_cursor_round_trip(band):
+    cell = h3.latlng_to_cell(52.27664, 104.27792, 8)
+    cursor = encode_cursor(band, np.uint64(cell))
+    assert cursor == f'{band}:{h3.int_to_str(cell)}'
+    assert parse_cursor(cursor) == (band, cell)
+
+
+@pytest.mark.parametrize('cursor', ['', 'LTE1800', ':88283082bffffff', 'LTE1800:zz', 'LTE1800:1'])
+def test_parse_cursor_rejects_invalid(cursor):
+    with pytest.raises(ValueError):
+        parse_cursor(cursor)
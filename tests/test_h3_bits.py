@@ -0,0 +1,77 @@
+"""Битовые операции над индексами H3 сверяются с пакетом h3"""
+import pytest
+
+np = pytest.importorskip('numpy')
+h3 = pytest.importorskip('h3.api.basic_int')
+
+from app.services.h3_service import cells_to_parent, children_ranges, latlng_to_multi_resolution  # noqa: E402
+from app.services.spatial_service import covering_cells, merged_ranges  # noqa: E402
+
+# Иркутск (данные проекта), экватор, южное полушарие и западная долгота
+POINTS = [(52.27664, 104.27792), (0.0, 0.0), (-33.8688, 151.2093), (40.7128, -74.0060)]
+RESOLUTIONS = range(7, 12)
+
+
+def sample_cells(resolution):
+    cells = [h3.latlng_to_cell(lat, lon, resolution) for lat, lon in POINTS]
+    # Пентагоны: у них нет потомков с цифрой 1
+    return np.array(cells + sorted(h3.get_pentagons(resolution))[:2], dtype=np.uint64)
+
+
+@pytest.mark.parametrize('resolution', RESOLUTIONS)
+def test_cells_to_parent_matches_h3(resolution):
+    cells = sample_cells(resolution)
+    for parent_resolution in range(0, resolution + 1):
+        expected = [h3.cell_to_parent(int(cell), parent_resolution) for cell in cells]
+        assert cells_to_parent(cells, parent_resolution).tolist() == expected
+
+
+def test_cells_to_parent_keeps_missing_cells():
+    assert cells_to_parent(np.array([0], dtype=np.uint64), 7).tolist() == [0]
+
+
+def test_multi_resolution_matches_h3():
+    lat = np.array([p[0] for p in POINTS])
+    lon = np.array([p[1] for p in POINTS])
+    result = latlng_to_multi_resolution(lat, lon, RESOLUTIONS)
+    for resolution in RESOLUTIONS:
+        assert result[resolution].tolist() == [h3.latlng_to_cell(a, b, resolution) for a, b in POINTS]
+
+
+@pytest.mark.parametrize('resolution', RESOLUTIONS)
+@pytest.mark.parametrize('depth', [0, 1, 3])
+def test_children_ranges_match_h3(resolution, depth):
+    child_resolution = min(resolution + depth, 15)
+    cells = sample_cells(resolution)
+    low, high = children_ranges(cells, child_resolution)
+    for cell, cell_low, cell_high in zip(cells, low, high):
+        children = h3.cell_to_children(int(cell), child_resolution)
+        assert int(cell_low) == min(children)
+        assert int(cell_high) == max(children)
+
+
+@pytest.mark.parametrize('cover_resolution,resolution', [(5, 8), (7, 8), (7, 11), (8, 10)])
+def test_merged_ranges_contain_exactly_the_children(cover_resolution, resolution):
+    bbox = (52.25, 52.30, 104.22, 104.33)
+    cover = covering_cells(bbox, cover_resolution)
+    ranges = merged_ranges(cover, cover_resolution, resolution)
+
+    def in_ranges(cell):
+        return any(low <= cell <= high for low, high in ranges)
+
+    for cell in cover:
+        children = h3.cell_to_children(int(cell), resolution)
+        assert all(in_ranges(child) for child in children)
+        # Соседи снаружи покрытия в диапазоны не попадают
+        for neighbor in h3.grid_ring(int(cell), 2):
+            if neighbor not in set(cover.tolist()):
+                assert not in_ranges(h3.cell_to_center_child(neighbor, resolution))
+
+
+def test_covering_cells_cover_the_bbox():
+    bbox = min_lat, max_lat, min_lon, max_lon = (52.25, 52.30, 104.22, 104.33)
+    for resolution in (5, 7, 8):
+        cover = set(covering_cells(bbox, resolution).tolist())
+        for lat in np.linspace(min_lat, max_lat, 12):
+            for lon in np.linspace(min_lon, max_lon, 12):
+                assert h3.latlng_to_cell(lat, lon, resolution) in cover
@@ -0,0 +1,57 @@
+"""Бинарный формат ячеек /coverage-hexes (export_service.pack_hexes)"""
+import json
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+h3 = pytest.importorskip('h3.api.basic_int')
+
+from app.services.export_service import HEX_PAYLOAD_MAGIC, pack_hexes  # noqa: E402
+
+
+def test_pack_hexes_layout():
+    cells = [h3.latlng_to_cell(52.27664 + i * 0.01, 104.27792, 10) for i in range(3)]
+    frame = pd.DataFrame({
+        'band': ['LTE2100', 'LTE1800', 'LTE2100'],
+        'cell': np.array(cells, dtype=np.uint64),
+        'avg_rsrp': [-80.5, -95.25, -110.0],
+        'avg_rsrq': [-7.5, -10.0, -12.25],
+        'point_count': [1, 20, 2 ** 40],
+    })
+    payload = pack_hexes(frame, 10)
+
+    magic, count, resolution, table_length = struct.unpack_from('<4sIII', payload)
+    assert (magic, count, resolution) == (HEX_PAYLOAD_MAGIC, 3, 10)
+    assert table_length % 8 == 0
+    bands = json.loads(payload[16:16 + table_length].decode('utf-8'))
+    assert bands == ['LTE1800', 'LTE2100']
+
+    offset = 16 + table_length
+    columns = {}
+    for name, dtype in [('cell', '<u8'), ('avg_rsrp', '<f4'), ('avg_rsrq', '<f4'),
+                        ('point_count', '<u4'), ('band_code', 'u1')]:
+        # Смещение колонки кратно размеру элемента (чтение типизированным массивом в браузере)
+        assert offset % np.dtype(dtype).itemsize == 0
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += count * np.dtype(dtype).itemsize
+    assert offset == len(payload)
+
+    assert columns['cell'].tolist() == cells
+    assert columns['avg_rsrp'].tolist() == [-80.5, -95.25, -110.0]
+    assert columns['avg_rsrq'].tolist() == [-7.5, -10.0, -12.25]
+    # Число точек ограничивается UInt32
+    assert columns['point_count'].tolist() == [1, 20, 2 ** 32 - 1]
+    assert [bands[code] for code in columns['band_code']] == ['LTE2100', 'LTE1800', 'LTE2100']
+
+
+def test_pack_hexes_empty():
+    frame = pd.DataFrame({
+        'band': pd.Series([], dtype=object), 'cell': np.array([], dtype=np.uint64),
+        'avg_rsrp': [], 'avg_rsrq': [], 'point_count': np.array([], dtype=np.uint64),
+    })
+    payload = pack_hexes(frame, 8)
+    magic, count, _, table_length = struct.unpack_from('<4sIII', payload)
+    assert (magic, count) == (HEX_PAYLOAD_MAGIC, 0)
+    assert len(payload) == 16 + table_length